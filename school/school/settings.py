@@ -46,11 +46,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'school_app.metrics.MetricsMiddleware',
+    'school_app.db_routing.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'school_app.portal.PortalProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -59,10 +62,18 @@ ROOT_URLCONF = 'school.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to school_app.metrics
+        'BACKEND': 'school_app.metrics.InstrumentedDjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Compiled templates are kept in memory for the life of the process.
+            # runserver's autoreloader still resets them when a template changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
@@ -78,16 +89,151 @@ WSGI_APPLICATION = 'school.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+#
+# Connection reuse: with POSTGRES_POOL=on connections come from psycopg 3's
+# pool (pip install "psycopg[pool]"), one pool per process and alias.
+# Otherwise each worker thread keeps its connection for POSTGRES_CONN_MAX_AGE
+# seconds and checks it is alive before reusing it. Django does not allow
+# CONN_MAX_AGE together with the pool, so the pool forces it to 0.
+
+POSTGRES_POOL = env.bool('POSTGRES_POOL', default=False)
+
 DATABASES = {
     'default': {
-        'ENGINE':
-        'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'django.db.backends.postgresql',
         'NAME': env("POSTGRES_DB_NAME"),
         'USER': env("POSTGRES_USER"),
         'PASSWORD': env("POSTGRES_PASSWORD"),
         'HOST': env("POSTGRES_HOST"),
         'PORT': env("POSTGRES_PORT"),
+        'CONN_MAX_AGE': 0 if POSTGRES_POOL else env.int('POSTGRES_CONN_MAX_AGE', default=60),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pool': {
+                'min_size': env.int('POSTGRES_POOL_MIN_SIZE', default=2),
+                'max_size': env.int('POSTGRES_POOL_MAX_SIZE', default=10),
+                'timeout': env.float('POSTGRES_POOL_TIMEOUT', default=10),
+            },
+        } if POSTGRES_POOL else {},
+    }
+}
+
+# Read replica (school_app/db_routing.py): set POSTGRES_REPLICA_HOST to send
+# dashboard and report reads to a streaming replica; writes always go to
+# default. In tests the replica mirrors the default test database.
+
+if env('POSTGRES_REPLICA_HOST', default=''):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': env('POSTGRES_REPLICA_HOST'),
+        'PORT': env('POSTGRES_REPLICA_PORT', default=DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
     }
+
+DATABASE_ROUTERS = ['school_app.db_routing.PrimaryReplicaRouter']
+
+# Views that may read from the replica on GET/HEAD. A client that has just
+# written (any successful POST) reads the primary for STICKY_SECONDS, and
+# dashboards reset by new grades are rebuilt from the primary as long.
+
+DB_ROUTING = {
+    'REPLICA_ALIAS': 'replica',
+    'VIEWS': [
+        'student_dashboard', 'parent_dashboard', 'student_grades_view',
+        'student_dashboard_api', 'parent_dashboard_api', 'student_grades_api',
+    ],
+    'STICKY_SECONDS': 10,
+    'STICKY_COOKIE': 'db_primary',
+}
+
+
+# Login throttling (school_app/throttling.py)
+# Token bucket per portal ID and per IP. With several workers switch
+# BACKEND to 'school_app.throttling.CacheBucketBackend' backed by a shared cache
+# (it counts attempts per refill_seconds window with atomic add/incr).
+
+LOGIN_THROTTLE = {
+    'BACKEND': 'school_app.throttling.MemoryBucketBackend',
+    'OPTIONS': {'max_entries': 10000},
+    'PER_ID': {'capacity': 5, 'refill_seconds': 60},
+    'PER_IP': {'capacity': 30, 'refill_seconds': 60},
+}
+
+
+# Portal IDs (school_app/ids.py): how many IDs a process reserves per
+# database round trip. Unused IDs of a reserved block are lost when the
+# process exits, so keep it small - bulk imports reserve exact blocks.
+
+PORTAL_ID_BLOCK_SIZE = 1
+
+
+# Deferred password hashing (school_app/hashing.py): profile saves create
+# the user with an unusable password and a background thread writes the
+# real hash after commit. Until then the account cannot log in.
+# PORTAL_HASH_WORKERS = 0 hashes synchronously right after commit.
+
+PORTAL_DEFERRED_HASHING = True
+PORTAL_HASH_WORKERS = 2
+
+
+# Caches. Dashboard data (school_app/dashboard_cache.py) is cached per
+# student/parent and invalidated when grades or parent links change.
+# With several workers use a shared backend (Redis, Memcached), otherwise
+# each process keeps its own copy and invalidation stays process-local.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'school-portal',
+    }
+}
+
+DASHBOARD_CACHE_ALIAS = 'default'
+DASHBOARD_CACHE_TIMEOUT = 60 * 60
+
+# Sessions keep the user's portal role and profile id (school_app/portal.py).
+# cached_db reads them from the cache, so a logged-in request does not query
+# django_session, but it needs a cache shared by all workers: with a
+# per-process cache a logout deletes the session only from the database and
+# the current worker's cache, and other workers keep serving it (and its
+# stale role) until the cache entry expires. So the db engine is used unless
+# CACHES['default'] is a shared backend (Redis, Memcached).
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+if CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+else:
+    SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Teachers' grade grants (school_app/grants.py) are cached per teacher and
+# invalidated by signals in the process that changed them. Other workers see
+# a revoked grant only when their copy expires, so with a per-process cache
+# grants are kept for a few seconds; with a shared cache invalidation reaches
+# every worker and they can be kept for an hour.
+
+GRADE_GRANTS_CACHE_ALIAS = 'default'
+if CACHES[GRADE_GRANTS_CACHE_ALIAS]['BACKEND'] in PROCESS_LOCAL_CACHES:
+    GRADE_GRANTS_TIMEOUT = 5
+else:
+    GRADE_GRANTS_TIMEOUT = 60 * 60
+
+
+# Per-view metrics (school_app/metrics.py), exposed to staff at /metrics in
+# Prometheus text format. Counters are per process; with several workers
+# set MULTIPROCESS_DIR to a writable directory shared by them so /metrics
+# sums all processes. Requests slower than SLOW_REQUEST_MS are logged to
+# 'school_app.metrics' with their slowest SQL.
+
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_SECONDS': 10,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_LOG_SIZE': 20,
 }
 
 
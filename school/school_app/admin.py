@@ -1,7 +1,61 @@
-from django.contrib import admin
+import re
+
+from django.contrib import admin, messages
 from django import forms
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import Teacher, Subject, SchoolClass, Student, Parent
+from django.core.exceptions import PermissionDenied
+from django.contrib.auth.models import User
+from django.db.models import Count, Q
+from django.shortcuts import render
+from django.urls import path
+from .importers import ImportRowError, ParentImporter, StudentImporter, TeacherImporter, read_rows
+from .reports import ReportCardExport, ReportError, report_response
+from .models import Teacher, Subject, SchoolClass, Student, Parent, SchoolCalendar, Holiday
+
+
+class PeopleImportForm(forms.Form):
+    file = forms.FileField(label='Файл CSV или XLSX')
+
+
+class ImportAdminMixin:
+    """Кнопка "Импорт" в списке: загрузка CSV/XLSX через importers.py."""
+    importer_class = None
+    change_list_template = 'admin/school_app/change_list_import.html'
+
+    def get_urls(self):
+        opts = self.model._meta
+        return [
+            path('import/',
+                 self.admin_site.admin_view(self.import_view),
+                 name=f'{opts.app_label}_{opts.model_name}_import'),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        report = None
+        form = PeopleImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            uploaded = form.cleaned_data['file']
+            try:
+                report = self.importer_class().run(read_rows(uploaded, uploaded.name))
+            except ImportRowError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f'Создано: {len(report.created)}')
+                if report.errors:
+                    messages.warning(request, f'Строк с ошибками: {len(report.errors)}')
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Импорт: {self.model._meta.verbose_name_plural}',
+            'form': form,
+            'report': report,
+            'columns': self.importer_class.columns,
+        }
+        return render(request, 'admin/school_app/import.html', context)
 
 
 class TeacherAdminForm(forms.ModelForm):
@@ -50,12 +104,13 @@ class TeacherInline(admin.StackedInline):
 
 
 @admin.register(Teacher)
-class TeacherAdmin(admin.ModelAdmin):
+class TeacherAdmin(ImportAdminMixin, admin.ModelAdmin):
     form = TeacherAdminForm
+    importer_class = TeacherImporter
     list_display = ['teacher_id', 'get_full_name', 'password']
     search_fields = ['teacher_id', 'user__first_name', 'user__last_name']
     readonly_fields = ['teacher_id', 'password', 'user']
-    filter_horizontal = ['subjects', 'classes']
+    autocomplete_fields = ['subjects', 'classes']
 
     fieldsets = (
         ('Личные данные', {
@@ -70,6 +125,9 @@ class TeacherAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
     def get_full_name(self, obj):
         if obj.user:
             return f'{obj.user.first_name} {obj.user.last_name}'
@@ -101,10 +159,14 @@ class SubjectAdmin(admin.ModelAdmin):
     search_fields = ['name']
     filter_horizontal = ['classes']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(teacher_count=Count('teachers', distinct=True))
+
     def get_teacher_count(self, obj):
-        return obj.teachers.count()
+        return obj.teacher_count
 
     get_teacher_count.short_description = 'Учителя'
+    get_teacher_count.admin_order_field = 'teacher_count'
 
 
 @admin.register(SchoolClass)
@@ -112,16 +174,47 @@ class SchoolClassAdmin(admin.ModelAdmin):
     list_display = ['number_class', 'letter_class', 'full_name', 'get_subject_count']
     list_filter = ['number_class']
     search_fields = ['number_class', 'letter_class']
+    # Автодополнение постранично - ему нужен устойчивый порядок
+    ordering = ['number_class', 'letter_class', 'id']
+    actions = ['export_report_cards_csv', 'export_report_cards_xlsx']
+
+    def get_search_results(self, request, queryset, search_term):
+        # "5-А", "5А", "5" - как классы пишут в автодополнении у учителей
+        match = re.fullmatch(r'\s*(\d+)\s*-?\s*(\w?)\s*', search_term)
+        if match:
+            queryset = queryset.filter(number_class=int(match.group(1)))
+            if match.group(2):
+                queryset = queryset.filter(letter_class__iexact=match.group(2).upper())
+            return queryset, False
+        return super().get_search_results(request, queryset, search_term)
 
     def full_name(self, obj):
         return f'{obj.number_class} {obj.letter_class}'
 
     full_name.short_description = 'Класс'
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(subject_count=Count('subjects', distinct=True))
+
     def get_subject_count(self, obj):
-        return obj.subjects.count()
+        return obj.subject_count
 
     get_subject_count.short_description = 'Предметы'
+    get_subject_count.admin_order_field = 'subject_count'
+
+    def export_report_cards(self, request, queryset, file_format):
+        try:
+            return report_response(request, ReportCardExport(classes=list(queryset)), file_format)
+        except ReportError as e:
+            self.message_user(request, str(e), messages.ERROR)
+
+    @admin.action(description='Выгрузить сводную ведомость (CSV)')
+    def export_report_cards_csv(self, request, queryset):
+        return self.export_report_cards(request, queryset, 'csv')
+
+    @admin.action(description='Выгрузить сводную ведомость (XLSX)')
+    def export_report_cards_xlsx(self, request, queryset):
+        return self.export_report_cards(request, queryset, 'xlsx')
 
 
 class StudentAdminForm(forms.ModelForm):
@@ -170,11 +263,14 @@ class StudentInline(admin.StackedInline):
 
 
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(ImportAdminMixin, admin.ModelAdmin):
     form = StudentAdminForm
+    importer_class = StudentImporter
     list_display = ['student_id', 'get_full_name', 'class_field', 'password']
     list_filter = ['class_field']
-    search_fields = ['student_id', 'user__first_name', 'user__last_name']
+    # Поиск по началу слова (в том числе для автодополнения у родителей), см. get_search_results
+    search_fields = ['^student_id', '^user__last_name', '^user__first_name']
+    ordering = ['user__last_name', 'user__first_name', 'id']
     readonly_fields = ['student_id', 'password', 'user']
 
     fieldsets = (
@@ -187,6 +283,22 @@ class StudentAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user', 'class_field')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Стандартный поиск объединяет условия по ученику и по auth_user через OR
+        # в одном WHERE - индексы из миграции 0011 тогда не используются. Здесь
+        # каждая таблица ищется своим запросом по своим индексам, а результаты
+        # объединяются UNION; слова, как и в стандартном поиске, - через AND.
+        for word in search_term.split():
+            by_id = Student.objects.filter(student_id__istartswith=word).values('pk')
+            by_name = Student.objects.filter(user__in=User.objects.filter(
+                Q(last_name__istartswith=word) | Q(first_name__istartswith=word)
+            ).values('pk')).values('pk')
+            queryset = queryset.filter(pk__in=by_id.union(by_name))
+        return queryset, False
+
     def get_full_name(self, obj):
         if obj.user:
             return f"{obj.user.last_name} {obj.user.first_name}"
@@ -233,12 +345,13 @@ class ParentAdminForm(forms.ModelForm):
 
 
 @admin.register(Parent)
-class ParentAdmin(admin.ModelAdmin):
+class ParentAdmin(ImportAdminMixin, admin.ModelAdmin):
     form = ParentAdminForm
+    importer_class = ParentImporter
     list_display = ['parent_id', 'get_full_name', 'password', 'children_count']
     search_fields = ['parent_id', 'user__first_name', 'user__last_name']
     readonly_fields = ['parent_id', 'password', 'user']
-    filter_horizontal = ['students']
+    autocomplete_fields = ['students']
 
     fieldsets = (
         ('Личные данные', {
@@ -253,6 +366,17 @@ class ParentAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user').annotate(
+            children_total=Count('students', distinct=True)
+        )
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == 'students':
+            # Выбранные дети выводятся в виджете через __str__, которому нужен user
+            kwargs['queryset'] = Student.objects.select_related('user')
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
     def get_full_name(self, obj):
         if obj.user:
             return f"{obj.user.last_name} {obj.user.first_name}"
@@ -261,6 +385,19 @@ class ParentAdmin(admin.ModelAdmin):
     get_full_name.short_description = 'ФИО'
 
     def children_count(self, obj):
-        return obj.students.count()
+        return obj.children_total
+
+    children_count.short_description = 'Количество детей'
+    children_count.admin_order_field = 'children_total'
+
+
+class HolidayInline(admin.TabularInline):
+    model = Holiday
+    extra = 1
+    fields = ['name', 'kind', 'start_date', 'end_date']
+
 
-    children_count.short_description = 'Количество детей'
\ No newline at end of file
+@admin.register(SchoolCalendar)
+class SchoolCalendarAdmin(admin.ModelAdmin):
+    list_display = ['name', 'start_date', 'end_date']
+    inlines = [HolidayInline]
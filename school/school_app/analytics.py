@@ -0,0 +1,149 @@
+"""
+Аналитика по классу и предмету для кабинета учителя.
+
+Все агрегаты считает БД, в Python приходят только итоги:
+- количество, средняя, дата последней оценки и распределение по шкале
+  1-10 - один aggregate с условными COUNT;
+- средние по неделям - GROUP BY TruncWeek(date);
+- ученики, у которых средний балл за последние недели ниже, чем раньше, -
+  GROUP BY ученика с условными AVG/COUNT до и после границы и HAVING.
+Медиана берется из распределения: шкала - всего 10 значений, поэтому
+percentile_cont (его нет в SQLite, на которой идут тесты) не нужен.
+
+Результат кешируется по паре (класс, предмет). Изменения оценок сбрасывают
+кеш после коммита (signals.py, grading.py); перевод ученика в другой класс
+не отслеживается - такие изменения подхватятся по истечении ANALYTICS_TIMEOUT.
+"""
+from datetime import timedelta
+from itertools import accumulate
+
+from django.core.cache import cache
+from django.db.models import Avg, Count, F, Max, Q
+from django.db.models.functions import TruncWeek
+
+from .models import Grade, Student
+
+
+ANALYTICS_TIMEOUT = 10 * 60
+
+# Меняется при изменении формата данных, чтобы старые записи кеша не попали в шаблон
+DATA_VERSION = 2
+
+GRADE_SCALE = range(1, 11)
+
+# "Последние недели" для поиска учеников с падающей успеваемостью
+RECENT_DAYS = 28
+# Насколько должна упасть средняя и сколько оценок нужно в каждом отрезке
+FALLING_DROP = 1.0
+FALLING_MIN_GRADES = 2
+
+
+def analytics_key(class_id, subject_id):
+    return f'analytics:{DATA_VERSION}:{class_id}:{subject_id}'
+
+
+def histogram_median(histogram):
+    """Медиана по распределению оценок (histogram[i] - число оценок i + 1)."""
+    count = sum(histogram)
+    if not count:
+        return 0
+
+    def nth(position):
+        for grade, seen in zip(GRADE_SCALE, accumulate(histogram)):
+            if seen > position:
+                return grade
+
+    middle = count // 2
+    if count % 2:
+        return nth(middle)
+    return (nth(middle - 1) + nth(middle)) / 2
+
+
+def falling_students(grades, cutoff):
+    """Ученики со снижением среднего балла после cutoff - от самого сильного падения."""
+    earlier, recent = Q(date__lte=cutoff), Q(date__gt=cutoff)
+    rows = grades.values('student_id', 'student__user__last_name', 'student__user__first_name').annotate(
+        earlier_count=Count('id', filter=earlier),
+        recent_count=Count('id', filter=recent),
+        earlier=Avg('grade', filter=earlier),
+        recent=Avg('grade', filter=recent),
+    ).filter(
+        earlier_count__gte=FALLING_MIN_GRADES,
+        recent_count__gte=FALLING_MIN_GRADES,
+        earlier__gte=F('recent') + FALLING_DROP,
+    ).order_by(F('recent') - F('earlier'))
+
+    # В кеш - id и имя, а не экземпляры Student
+    return [
+        {
+            'student_id': row['student_id'],
+            'last_name': row['student__user__last_name'] or '',
+            'first_name': row['student__user__first_name'] or '',
+            'earlier': round(row['earlier'], 2),
+            'recent': round(row['recent'], 2),
+        }
+        for row in rows
+    ]
+
+
+def compute_class_subject_stats(class_id, subject_id):
+    grades = Grade.objects.filter(student__class_field_id=class_id, subject_id=subject_id).order_by()
+
+    totals = grades.aggregate(
+        count=Count('id'),
+        average=Avg('grade'),
+        last_date=Max('date'),
+        **{f'grade_{grade}': Count('id', filter=Q(grade=grade)) for grade in GRADE_SCALE},
+    )
+    histogram = [totals[f'grade_{grade}'] for grade in GRADE_SCALE]
+
+    weekly = grades.annotate(week=TruncWeek('date')).values('week').annotate(
+        count=Count('id'), average=Avg('grade')
+    ).order_by('week')
+
+    stats = {
+        'count': totals['count'],
+        'average': round(totals['average'] or 0, 2),
+        'median': histogram_median(histogram),
+        'histogram': histogram,
+        'weekly': [
+            {'week': week['week'], 'count': week['count'], 'average': round(week['average'], 2)}
+            for week in weekly
+        ],
+        'falling': [],
+    }
+
+    if totals['count']:
+        stats['falling'] = falling_students(grades, totals['last_date'] - timedelta(days=RECENT_DAYS))
+
+    return stats
+
+
+def class_subject_stats(class_id, subject_id):
+    key = analytics_key(class_id, subject_id)
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_class_subject_stats(class_id, subject_id)
+        cache.set(key, stats, ANALYTICS_TIMEOUT)
+    return stats
+
+
+def invalidate_class_subject(class_id, subject_id):
+    cache.delete(analytics_key(class_id, subject_id))
+
+
+def invalidate_analytics(student_subjects):
+    """Сбрасывает аналитику по парам (id ученика, id предмета) - классы берутся одним запросом."""
+    student_subjects = set(student_subjects)
+    if not student_subjects:
+        return
+
+    classes = dict(Student.objects.filter(
+        id__in={student_id for student_id, _ in student_subjects}
+    ).values_list('id', 'class_field_id'))
+
+    cache.delete_many([
+        analytics_key(classes[student_id], subject_id)
+        for student_id, subject_id in student_subjects
+        if classes.get(student_id)
+    ])
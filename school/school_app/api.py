@@ -0,0 +1,171 @@
+"""
+JSON API дневников (только чтение) с условными запросами.
+
+Ответы несут сильный ETag, посчитанный одним легким запросом по версиям
+оценок учеников (GradeVersion) и данным, которые выводятся в ответе
+(имя, класс, состав детей). Если клиент прислал совпадающий
+If-None-Match, отвечаем 304 без запросов к оценкам.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+
+from .dashboard_cache import get_or_build, parent_key
+from .forms import GradeHistoryForm
+from .grade_history import student_history
+from .models import Parent, PortalCredential, Student
+from .portal import can_view_student, role_profile
+from .views import build_parent_dashboard, student_dashboard_history
+
+
+# Меняется при изменении формата ответов, чтобы старые ETag не совпали
+API_VERSION = 1
+
+
+def make_etag(*parts):
+    source = repr((API_VERSION,) + parts).encode()
+    return hashlib.sha1(source).hexdigest()
+
+
+def student_etag(request):
+    if not request.user.is_authenticated or request.portal_role != PortalCredential.STUDENT:
+        return None
+    row = Student.objects.filter(id=request.portal_profile_id, user=request.user).values_list(
+        'id', 'class_field_id', 'grade_version__version'
+    ).first()
+    if row is None:
+        return None
+    return make_etag('student', row, request.user.last_name, request.user.first_name,
+                     request.GET.urlencode())
+
+
+def parent_etag(request):
+    if not request.user.is_authenticated or request.portal_role != PortalCredential.PARENT:
+        return None
+    rows = list(Parent.objects.filter(id=request.portal_profile_id, user=request.user).values_list(
+        'students__id', 'students__class_field_id', 'students__grade_version__version',
+        'students__user__last_name', 'students__user__first_name'
+    ).order_by('students__id'))
+    if not rows:
+        return None
+    return make_etag('parent', request.user.id, rows)
+
+
+def student_grades_etag(request, student_id):
+    row = Student.objects.filter(id=student_id).values_list(
+        'class_field_id', 'grade_version__version', 'user__last_name', 'user__first_name'
+    ).first()
+    if row is None:
+        return None
+    return make_etag('grades', student_id, row, request.GET.urlencode())
+
+
+def grade_json(grade):
+    return {'id': grade.id, 'date': grade.date.isoformat(), 'grade': grade.grade}
+
+
+def student_json(student):
+    return {
+        'id': student.id,
+        'student_id': student.student_id,
+        'last_name': student.user.last_name if student.user else '',
+        'first_name': student.user.first_name if student.user else '',
+        'class': student.class_field.name_class if student.class_field else None,
+    }
+
+
+def subject_json(subject_data):
+    return {
+        'id': subject_data['subject'].id,
+        'name': subject_data['subject'].name,
+        'average': round(subject_data['average'], 2),
+        'count': subject_data.get('count', len(subject_data['grades'])),
+        'grades': [grade_json(grade) for grade in subject_data['grades']],
+    }
+
+
+def history_json(history):
+    return {
+        'total_grades_count': history['total_grades_count'],
+        'average_grade': round(history['average_grade'], 2),
+        'grade_stats': history['grade_stats'],
+        'subjects': [subject_json(subject_data) for subject_data in history['subjects_grades_data']],
+        'next_cursor': history['next_cursor'],
+    }
+
+
+def history_form(request):
+    form = GradeHistoryForm(request.GET or None)
+    if form.is_bound and not form.is_valid():
+        return form, JsonResponse({'errors': form.errors}, status=400)
+    return form, None
+
+
+@require_GET
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=student_etag)
+def student_dashboard_api(request):
+    student = role_profile(request, PortalCredential.STUDENT)
+    if student is None:
+        return JsonResponse({'error': 'Доступно только ученикам'}, status=403)
+
+    form, error = history_form(request)
+    if error:
+        return error
+
+    history = student_dashboard_history(student, form)
+    return JsonResponse({'student': student_json(student), **history_json(history)})
+
+
+@require_GET
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=parent_etag)
+def parent_dashboard_api(request):
+    parent = role_profile(request, PortalCredential.PARENT)
+    if parent is None:
+        return JsonResponse({'error': 'Доступно только родителям'}, status=403)
+
+    data = get_or_build(parent_key(parent.id), lambda: build_parent_dashboard(parent))
+    return JsonResponse({
+        'children': [
+            {
+                'student': student_json(child_data['child']),
+                'subjects': [subject_json(subject_data) for subject_data in child_data['subjects_data']],
+            }
+            for child_data in data['children_with_grades']
+        ],
+    })
+
+
+def student_access_required(view):
+    """403, если оценки ученика не видны пользователю; проверяется до ETag."""
+    @wraps(view)
+    def wrapper(request, student_id, *args, **kwargs):
+        if not can_view_student(request, student_id):
+            return JsonResponse({'error': 'Нет доступа к оценкам этого ученика'}, status=403)
+        return view(request, student_id, *args, **kwargs)
+    return wrapper
+
+
+@require_GET
+@login_required
+@cache_control(private=True, no_cache=True)
+@student_access_required
+@condition(etag_func=student_grades_etag)
+def student_grades_api(request, student_id):
+    student = get_object_or_404(Student.objects.select_related('user', 'class_field'), id=student_id)
+
+    form, error = history_form(request)
+    if error:
+        return error
+
+    date_from, date_to = form.period()
+    history = student_history(student, date_from, date_to, form.cursor())
+    return JsonResponse({'student': student_json(student), **history_json(history)})
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class SchoolAppConfig(AppConfig):
     name = 'school_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
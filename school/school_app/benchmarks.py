@@ -0,0 +1,353 @@
+"""
+Сквозные бенчмарки портала на синтетической школе (synthetic.py).
+
+Каждый сценарий - запрос тестового клиента к представлению (вход,
+кабинеты, выставление оценок, история, API, списки админки). Сценарий
+выполняется repeat раз с очищенным кешем: записываются медиана и максимум
+времени и число SQL-запросов; еще один прогон под tracemalloc дает пик
+памяти на запрос.
+
+Результаты сравниваются с сохраненной базовой линией (JSON того же
+формата): больше запросов - всегда регрессия, время и память - если
+выросли больше чем на tolerance (и больше минимального порога, чтобы не
+ловить шум на быстрых запросах).
+
+compare_servers сравнивает одни и те же дневники под WSGI (пул из
+wsgi_threads потоков, как у gunicorn --threads) и ASGI (один цикл
+событий) при clients одновременных клиентах: каждый клиент шлет запросы
+подряд, в задержку входит ожидание свободного потока. Запросы идут прямо
+в WSGIHandler/ASGIHandler, без сети, поэтому данные должны быть
+закоммичены - каждый поток работает со своим соединением.
+"""
+import asyncio
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import transaction
+from django.db.models import Count
+from django.test import Client, RequestFactory, override_settings
+from django.urls import reverse
+
+from .models import Grade, Parent, PortalCredential, Student, Teacher
+from .school_calendar import calendar_service
+from .synthetic import DEFAULT_PASSWORD, SIZES, SyntheticSchool
+
+
+REPEAT = 5
+TOLERANCE = 0.25
+CLIENTS = 200
+REQUESTS_PER_CLIENT = 5
+WSGI_THREADS = 8
+# Разница меньше порога - шум, а не регрессия
+MIN_DELTA = {'median_ms': 2.0, 'peak_kb': 64.0}
+ADMIN_CHANGELISTS = ['teacher', 'student', 'parent', 'subject', 'schoolclass']
+
+
+class QueryCounter:
+    """Счетчик запросов без ограничения длины журнала (для бенчмарков)."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Выполняет i-й запрос сценария и возвращает ответ
+    request: Callable
+    user: Optional[User] = None
+
+
+class BenchmarkError(Exception):
+    """Сценарий вернул неожиданный статус - замеры такого ответа бессмысленны."""
+
+
+class BenchmarkSuite:
+
+    def __init__(self, repeat=REPEAT):
+        self.repeat = repeat
+
+    def prepare(self):
+        """Участники сценариев: учитель, его ученик с оценками, родитель с наибольшим числом детей, админ."""
+        self.teacher = Teacher.objects.annotate(class_count=Count('classes')).select_related('user').filter(
+            class_count__gt=0
+        ).order_by('-class_count', 'id').first()
+        self.school_class = self.teacher.classes.order_by('id').first()
+        self.subject = self.teacher.subjects.filter(classes=self.school_class).order_by('id').first()
+        self.student = Student.objects.filter(class_field=self.school_class).select_related('user').order_by('id').first()
+        self.parent = Parent.objects.annotate(children=Count('students')).select_related('user').order_by(
+            '-children', 'id'
+        ).first()
+        self.admin = User.objects.create_superuser('benchmark_admin', 'admin@example.com', DEFAULT_PASSWORD)
+        self.logins = list(PortalCredential.objects.filter(
+            role=PortalCredential.STUDENT
+        ).order_by('id').values_list('portal_id', 'password')[:self.repeat + 1])
+        self.free_days = self.find_free_days()
+
+    def find_free_days(self):
+        """Учебные дни без оценки ученика по предмету - для сценария выставления оценки."""
+        taken = set(Grade.objects.filter(student=self.student, subject=self.subject).values_list('date', flat=True))
+        day = max(taken, default=date.today())
+        days = []
+        while len(days) <= self.repeat:
+            day -= timedelta(days=1)
+            if day not in taken and calendar_service.is_school_day(day):
+                days.append(day)
+        return days
+
+    def scenarios(self):
+        def get(name, *args, **params):
+            return lambda client, i: client.get(reverse(name, args=args), params)
+
+        def login(client, i):
+            portal_id, password = self.logins[i % len(self.logins)]
+            return client.post(reverse('login'), {'user_id': portal_id, 'password': password})
+
+        def add_grade(client, i):
+            return client.post(reverse('add_grade'), {
+                'student': self.student.id, 'subject': self.subject.id, 'grade': 8,
+                'date': self.free_days[i].isoformat(),
+            })
+
+        teacher, student, parent = self.teacher.user, self.student.user, self.parent.user
+        grade_sheet = {'class': self.school_class.id, 'subject': self.subject.id}
+        return [
+            Scenario('user_login', login),
+            Scenario('teacher_dashboard', get('teacher_dashboard'), teacher),
+            Scenario('add_grade_form', get('add_grade'), teacher),
+            Scenario('add_grade', add_grade, teacher),
+            Scenario('grade_sheet', get('grade_sheet', **grade_sheet), teacher),
+            Scenario('student_dashboard', get('student_dashboard'), student),
+            Scenario('parent_dashboard', get('parent_dashboard'), parent),
+            Scenario('student_grades_view', get('student_grades_view', self.student.id), teacher),
+            Scenario('student_dashboard_api', get('student_dashboard_api'), student),
+            Scenario('parent_dashboard_api', get('parent_dashboard_api'), parent),
+        ] + [
+            Scenario(f'admin_{model_name}_changelist', get(f'admin:school_app_{model_name}_changelist'), self.admin)
+            for model_name in ADMIN_CHANGELISTS
+        ]
+
+    def measure(self, scenario, connection):
+        client = Client()
+        timings = []
+        queries = []
+
+        for i in range(self.repeat + 1):
+            cache.clear()
+            if scenario.user is not None:
+                client.force_login(scenario.user)
+
+            if i < self.repeat:
+                with QueryCounter(connection) as counter:
+                    start = time.perf_counter()
+                    response = scenario.request(client, i)
+                    timings.append((time.perf_counter() - start) * 1000)
+                queries.append(counter.count)
+            else:
+                tracemalloc.start()
+                try:
+                    response = scenario.request(client, i)
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+            if response.status_code not in (200, 302):
+                raise BenchmarkError(f'{scenario.name}: статус {response.status_code}')
+
+        return {
+            'median_ms': round(statistics.median(timings), 2),
+            'max_ms': round(max(timings), 2),
+            'queries': max(queries),
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def run(self, connection):
+        self.prepare()
+        # Сценарий входа повторяется чаще, чем пропускает ограничение попыток
+        with override_settings(LOGIN_THROTTLE={'PER_ID': {'capacity': 1000, 'refill_seconds': 1},
+                                               'PER_IP': {'capacity': 1000, 'refill_seconds': 1}}):
+            return {scenario.name: self.measure(scenario, connection) for scenario in self.scenarios()}
+
+
+def run_size(size, connection, repeat=REPEAT, on_progress=None):
+    """Создает школу размера size, прогоняет сценарии и откатывает все изменения."""
+    with transaction.atomic():
+        counts = SyntheticSchool(**SIZES[size], on_progress=on_progress).run()
+        results = BenchmarkSuite(repeat).run(connection)
+        transaction.set_rollback(True)
+    cache.clear()
+    return {'dataset': counts, 'scenarios': results}
+
+
+def session_cookie(user):
+    client = Client()
+    client.force_login(user)
+    return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+
+def dashboard_requests(count):
+    """(путь, cookie) запросов к дневникам и истории оценок от разных учеников и родителей."""
+    students = Student.objects.select_related('user').order_by('id')[:count]
+    parents = Parent.objects.select_related('user').order_by('id')[:count]
+    requests = []
+    for student, parent in zip(students, parents):
+        student_cookie = session_cookie(student.user)
+        requests += [
+            (reverse('student_dashboard'), student_cookie),
+            (reverse('parent_dashboard'), session_cookie(parent.user)),
+            (reverse('student_grades_view', args=[student.id]), student_cookie),
+        ]
+    return requests
+
+
+def wsgi_call(handler, path, cookie):
+    environ = RequestFactory().get(path, HTTP_COOKIE=cookie).environ
+    statuses = []
+    body = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        b''.join(body)
+    finally:
+        body.close()
+    return int(statuses[0].split()[0])
+
+
+async def asgi_call(handler, path, cookie):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': 'GET', 'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    body_sent = False
+    messages = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Клиент не отключается: Django снимет это ожидание после ответа
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    await handler(scope, receive, send)
+    return messages[0]['status']
+
+
+def latency_summary(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': sum(status != 200 for status in statuses),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2),
+    }
+
+
+def run_wsgi(requests, clients=CLIENTS, per_client=REQUESTS_PER_CLIENT, threads=WSGI_THREADS):
+    handler = WSGIHandler()
+    workers = threading.Semaphore(threads)
+    latencies, statuses = [], []
+
+    def client(i):
+        for j in range(per_client):
+            path, cookie = requests[(i * per_client + j) % len(requests)]
+            start = time.perf_counter()
+            with workers:
+                statuses.append(wsgi_call(handler, path, cookie))
+            latencies.append(time.perf_counter() - start)
+
+    client_threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in client_threads:
+        thread.start()
+    for thread in client_threads:
+        thread.join()
+    return latency_summary(latencies, statuses, time.perf_counter() - start)
+
+
+def run_asgi(requests, clients=CLIENTS, per_client=REQUESTS_PER_CLIENT):
+    handler = ASGIHandler()
+    latencies, statuses = [], []
+
+    async def client(i):
+        for j in range(per_client):
+            path, cookie = requests[(i * per_client + j) % len(requests)]
+            start = time.perf_counter()
+            statuses.append(await asgi_call(handler, path, cookie))
+            latencies.append(time.perf_counter() - start)
+
+    async def run_clients():
+        await asyncio.gather(*(client(i) for i in range(clients)))
+
+    start = time.perf_counter()
+    asyncio.run(run_clients())
+    return latency_summary(latencies, statuses, time.perf_counter() - start)
+
+
+def compare_servers(clients=CLIENTS, per_client=REQUESTS_PER_CLIENT, wsgi_threads=WSGI_THREADS):
+    """Пропускная способность и задержки дневников под WSGI и ASGI на закоммиченных данных."""
+    requests = dashboard_requests(clients)
+    results = {}
+    cache.clear()
+    results['wsgi'] = run_wsgi(requests, clients, per_client, wsgi_threads)
+    cache.clear()
+    results['asgi'] = run_asgi(requests, clients, per_client)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Регрессии относительно базовой линии: (размер, сценарий, метрика, было, стало)."""
+    regressions = []
+    for size, result in results.items():
+        base_scenarios = baseline.get(size, {}).get('scenarios', {})
+        for name, metrics in result['scenarios'].items():
+            base = base_scenarios.get(name)
+            if base is None:
+                continue
+            if metrics['queries'] > base['queries']:
+                regressions.append((size, name, 'queries', base['queries'], metrics['queries']))
+            for key, min_delta in MIN_DELTA.items():
+                if metrics[key] > base[key] * (1 + tolerance) and metrics[key] - base[key] > min_delta:
+                    regressions.append((size, name, key, base[key], metrics[key]))
+    return regressions
+
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2, sort_keys=True)
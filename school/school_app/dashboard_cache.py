@@ -0,0 +1,146 @@
+"""
+Кеш данных дневников ученика и родителя.
+
+Готовые данные дневника (оценки, сводки) хранятся в кеше Django по ключу
+ученика или родителя и сбрасываются точечно: при изменении оценок ученика
+(сигналы Grade и ведомость) - у самого ученика и у всех его родителей,
+при изменении списка детей (Parent.students) - у родителя.
+
+Сброс не только удаляет запись, но и меняет поколение ключа, а запись
+хранится вместе с поколением, прочитанным до сборки. Сборка, начатая до
+коммита изменений, может записать старые данные уже после сброса - такая
+запись не совпадет с новым поколением и будет собрана заново.
+
+Если настроена реплика БД (db_routing), сброшенный дневник в течение
+DB_ROUTING['STICKY_SECONDS'] пересобирается по основной БД: реплика могла
+еще не получить изменения, из-за которых его сбросили.
+"""
+import threading
+import uuid
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .db_routing import get_routing_config, primary_reads, replica_alias
+from .models import Parent
+
+
+# Меняется при изменении формата данных дневника, чтобы старые записи кеша не попали в шаблоны
+DATA_VERSION = 4
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[getattr(settings, 'DASHBOARD_CACHE_ALIAS', 'default')]
+
+
+def student_key(student_id):
+    return f'dashboard:{DATA_VERSION}:student:{student_id}'
+
+
+def parent_key(parent_id):
+    return f'dashboard:{DATA_VERSION}:parent:{parent_id}'
+
+
+def primary_key(key):
+    """Метка "пересобрать key по основной БД"."""
+    return f'primary:{key}'
+
+
+def generation_key(key):
+    """Поколение key: меняется при каждом сбросе."""
+    return f'generation:{key}'
+
+
+def _lookup_keys(key):
+    return [key, primary_key(key), generation_key(key)]
+
+
+def _cached(found, key):
+    """Данные key, если запись собрана в текущем поколении, иначе None."""
+    entry = found.get(key)
+    if entry is not None and entry[0] == found.get(generation_key(key)):
+        return entry[1]
+    return None
+
+
+def _build_reads(found, key):
+    return primary_reads() if found.get(primary_key(key)) else nullcontext()
+
+
+def _count(hit):
+    with _stats_lock:
+        _stats['hits' if hit else 'misses'] += 1
+
+
+def _timeout():
+    return getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 3600)
+
+
+def get_or_build(key, build):
+    cache = _cache()
+    found = cache.get_many(_lookup_keys(key))
+    data = _cached(found, key)
+    _count(data is not None)
+
+    if data is None:
+        with _build_reads(found, key):
+            data = build()
+        cache.set(key, (found.get(generation_key(key)), data), _timeout())
+    return data
+
+
+async def aget_or_build(key, abuild):
+    """get_or_build для асинхронных представлений: abuild - корутинная функция."""
+    cache = _cache()
+    found = await cache.aget_many(_lookup_keys(key))
+    data = _cached(found, key)
+    _count(data is not None)
+
+    if data is None:
+        with _build_reads(found, key):
+            data = await abuild()
+        await cache.aset(key, (found.get(generation_key(key)), data), _timeout())
+    return data
+
+
+def _invalidate(keys):
+    cache = _cache()
+    cache.delete_many(keys)
+    # Поколение без срока: запись, собранная до сброса, больше не совпадет с ним
+    cache.set_many({generation_key(key): uuid.uuid4().hex for key in keys}, None)
+    if replica_alias():
+        cache.set_many({primary_key(key): True for key in keys}, get_routing_config()['STICKY_SECONDS'])
+
+
+def invalidate_students(student_ids):
+    """Сбрасывает дневники учеников и их родителей (родители удаленного ученика - см. signals.py)."""
+    student_ids = set(student_ids)
+    if not student_ids:
+        return
+
+    parent_ids = Parent.students.through.objects.filter(
+        student_id__in=student_ids
+    ).values_list('parent_id', flat=True)
+
+    _invalidate(
+        [student_key(student_id) for student_id in student_ids] +
+        [parent_key(parent_id) for parent_id in set(parent_ids)]
+    )
+
+
+def invalidate_parents(parent_ids):
+    _invalidate([parent_key(parent_id) for parent_id in set(parent_ids)])
+
+
+def dashboard_cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_dashboard_cache_stats():
+    with _stats_lock:
+        _stats.update(hits=0, misses=0)
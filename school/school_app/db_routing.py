@@ -0,0 +1,163 @@
+"""
+Чтение с реплики PostgreSQL, запись - в основную БД.
+
+PrimaryReplicaRouter отправляет все записи в default, а чтение - в реплику
+(DB_ROUTING['REPLICA_ALIAS']) только там, где это явно разрешено:
+- в представлениях из DB_ROUTING['VIEWS'] (дневники и их API) на
+  GET/HEAD-запросах - это включает ReplicaMiddleware;
+- в ведомостях (reports.py), которые читают через read_alias().
+Все остальное - вход, выставление оценок, кабинет учителя, админка -
+читает основную БД. Если реплика не настроена (в DATABASES нет алиаса),
+все запросы идут в default. Внутри открытой транзакции default чтение
+тоже остается в default: транзакция должна видеть свои изменения (в том
+числе транзакция, в которую TestCase оборачивает каждый тест).
+
+Реплика отстает от основной БД, поэтому после записи чтение в течение
+STICKY_SECONDS снова идет в основную БД ("читаем свои записи"):
+- клиент, отправивший успешный POST (оценка, вход, админка), получает
+  cookie STICKY_COOKIE, и пока она жива, его запросы не уходят на реплику;
+- дневники, сброшенные из-за новых оценок (dashboard_cache), в этот срок
+  пересобираются по основной БД, иначе в кеш на час попали бы данные
+  отставшей реплики.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+
+DEFAULTS = {
+    'REPLICA_ALIAS': 'replica',
+    'VIEWS': [],
+    'STICKY_SECONDS': 10,
+    'STICKY_COOKIE': 'db_primary',
+}
+
+SAFE_METHODS = ('GET', 'HEAD')
+
+# Можно ли текущему запросу (или блоку кода) читать с реплики
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+
+
+@lru_cache(maxsize=None)
+def get_routing_config():
+    return {**DEFAULTS, **getattr(settings, 'DB_ROUTING', {})}
+
+
+def replica_alias():
+    """Алиас реплики или None, если ее нет в DATABASES."""
+    alias = get_routing_config()['REPLICA_ALIAS']
+    return alias if alias and alias in settings.DATABASES else None
+
+
+def read_alias():
+    """Куда читать данным, которым не важно отставание реплики (ведомости)."""
+    alias = replica_alias()
+    if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return DEFAULT_DB_ALIAS
+    return alias
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Разрешает (или запрещает при enabled=False) чтение с реплики внутри блока."""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def primary_reads():
+    return replica_reads(False)
+
+
+class PrimaryReplicaRouter:
+    """Запись - всегда в default; чтение - в реплику, только если это разрешено."""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_alias()
+        # Явно default: иначе связанные объекты читались бы из БД, откуда загружен экземпляр
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия default: объекты из обеих БД можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему реплика получает репликацией
+        return db != replica_alias()
+
+
+def is_sticky(request):
+    return get_routing_config()['STICKY_COOKIE'] in request.COOKIES
+
+
+class ReplicaMiddleware:
+    """
+    Включает чтение с реплики на время GET/HEAD-запроса к представлению из
+    DB_ROUTING['VIEWS'], если клиент недавно ничего не записывал; после
+    успешной записи ставит клиенту cookie, которая на STICKY_SECONDS
+    оставляет его чтение в основной БД.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        # process_view меняет переменную внутри запроса - здесь она гарантированно сбрасывается
+        token = _replica_reads.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.mark_sticky(request, response)
+
+    async def __acall__(self, request):
+        token = _replica_reads.set(False)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.mark_sticky(request, response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        config = get_routing_config()
+        if (
+            replica_alias()
+            and request.method in SAFE_METHODS
+            and request.resolver_match.view_name in config['VIEWS']
+            and not is_sticky(request)
+        ):
+            _replica_reads.set(True)
+
+    def mark_sticky(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replica_alias():
+            config = get_routing_config()
+            response.set_cookie(
+                config['STICKY_COOKIE'], '1', max_age=config['STICKY_SECONDS'],
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+
+@receiver(setting_changed)
+def reset_routing_config(setting, **kwargs):
+    if setting == 'DB_ROUTING':
+        get_routing_config.cache_clear()
@@ -1,4 +1,6 @@
 from django import forms
+from .grade_history import decode_cursor
+from .models import SchoolCalendar
 
 
 class LoginForm(forms.Form):
@@ -17,4 +19,47 @@ class LoginForm(forms.Form):
                                    'class': 'form-control',
                                    'autocomplete': 'off',
                                })
-    )
\ No newline at end of file
+    )
+
+class GradeHistoryForm(forms.Form):
+    """Фильтр истории оценок: учебный год и/или даты, плюс курсор страницы."""
+    calendar = forms.ModelChoiceField(queryset=SchoolCalendar.objects.all(),
+                                      required=False,
+                                      label='Учебный год',
+                                      empty_label='Все',
+                                      widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    date_from = forms.DateField(required=False,
+                                label='С',
+                                widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    date_to = forms.DateField(required=False,
+                              label='По',
+                              widget=forms.DateInput(attrs={'type': 'date', 'class': 'form-control form-control-sm'})
+    )
+    after = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    def clean_after(self):
+        after = self.cleaned_data['after']
+        if not after:
+            return None
+        try:
+            return decode_cursor(after)
+        except ValueError:
+            raise forms.ValidationError('Неверная страница')
+
+    def period(self):
+        """(с, по) с учетом границ выбранного учебного года; при ошибках в фильтре - вся история."""
+        if not self.is_valid():
+            return None, None
+
+        calendar = self.cleaned_data['calendar']
+        date_from = self.cleaned_data['date_from']
+        date_to = self.cleaned_data['date_to']
+        if calendar:
+            date_from = max(date_from, calendar.start_date) if date_from else calendar.start_date
+            date_to = min(date_to, calendar.end_date) if date_to else calendar.end_date
+        return date_from, date_to
+
+    def cursor(self):
+        return self.cleaned_data['after'] if self.is_valid() else None
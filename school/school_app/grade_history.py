@@ -0,0 +1,175 @@
+"""
+История оценок ученика: фильтр по периоду и постраничный вывод по ключу.
+
+Страница выбирается условием "раньше последней показанной оценки" по паре
+(date, id) с сортировкой по индексу grade_student_date_id_idx, поэтому
+стоимость страницы не зависит от ее номера и от объема истории. Сводка
+(количество, средние, распределение) считается не по строкам страницы:
+без периода - из GradeAggregate, с периодом - одним GROUP BY по
+(предмет, оценка).
+
+Асинхронные версии (aperiod_aggregates, agrade_page, astudent_history)
+используются асинхронными представлениями: сводка и страница оценок
+загружаются одновременно через asyncio.gather.
+
+Данные для шаблонов готовятся здесь же, один раз при сборке (и кешируются
+вместе с дневником): оценки предмета - списком пар (оценка, дата
+ДД.ММ.ГГГГ), у среднего - CSS-класс значка. Шаблоны ничего не сортируют
+и не группируют.
+"""
+import asyncio
+from datetime import date
+
+from django.db.models import Count, Q
+
+from .models import Grade, GradeAggregate, Subject
+from .queries import agrade_rows, grade_rows
+
+
+PAGE_SIZE = 50
+
+
+def encode_cursor(grade):
+    return f'{grade.date.isoformat()}.{grade.id}'
+
+
+def decode_cursor(cursor):
+    """(дата, id) последней показанной оценки; ValueError при неверном формате."""
+    grade_date, grade_id = cursor.split('.')
+    return date.fromisoformat(grade_date), int(grade_id)
+
+
+def _period(date_from, date_to):
+    period = Q()
+    if date_from:
+        period &= Q(date__gte=date_from)
+    if date_to:
+        period &= Q(date__lte=date_to)
+    return period
+
+
+def period_aggregates(student, date_from=None, date_to=None):
+    """Сводки по предметам за период (несохраненные GradeAggregate для периода)."""
+    if date_from is None and date_to is None:
+        return list(GradeAggregate.objects.filter(student=student))
+
+    return _period_rows_to_aggregates(student, _period_rows(student, date_from, date_to))
+
+
+async def aperiod_aggregates(student, date_from=None, date_to=None):
+    if date_from is None and date_to is None:
+        return [aggregate async for aggregate in GradeAggregate.objects.filter(student=student)]
+
+    rows = [row async for row in _period_rows(student, date_from, date_to)]
+    return _period_rows_to_aggregates(student, rows)
+
+
+def _period_rows(student, date_from, date_to):
+    return Grade.objects.filter(
+        _period(date_from, date_to), student=student
+    ).order_by().values('subject_id', 'grade').annotate(count=Count('id'))
+
+
+def _period_rows_to_aggregates(student, rows):
+    aggregates = {}
+    for row in rows:
+        aggregate = aggregates.get(row['subject_id'])
+        if aggregate is None:
+            aggregate = aggregates[row['subject_id']] = GradeAggregate(
+                student=student, subject_id=row['subject_id']
+            )
+        aggregate._count_grade(row['grade'], row['count'])
+    return list(aggregates.values())
+
+
+def history_queryset(student, date_from=None, date_to=None, after=None):
+    """Оценки от новых к старым, начиная после курсора after."""
+    grades = Grade.objects.filter(
+        _period(date_from, date_to), student=student
+    ).order_by('-date', '-id')
+
+    if after is not None:
+        after_date, after_id = after
+        grades = grades.filter(Q(date__lt=after_date) | Q(date=after_date, id__lt=after_id))
+    return grades
+
+
+def grade_page(student, date_from=None, date_to=None, after=None, page_size=PAGE_SIZE):
+    """Возвращает (оценки страницы строками GradeRow, курсор следующей страницы или None)."""
+    page = grade_rows(history_queryset(student, date_from, date_to, after)[:page_size + 1])
+    return _split_page(page, page_size)
+
+
+async def agrade_page(student, date_from=None, date_to=None, after=None, page_size=PAGE_SIZE):
+    page = await agrade_rows(history_queryset(student, date_from, date_to, after)[:page_size + 1])
+    return _split_page(page, page_size)
+
+
+def _split_page(page, page_size):
+    next_cursor = encode_cursor(page[page_size - 1]) if len(page) > page_size else None
+    return page[:page_size], next_cursor
+
+
+def student_history(student, date_from=None, date_to=None, after=None, page_size=PAGE_SIZE):
+    """Данные для дневника и страницы оценок ученика: предметы со сводкой и страница оценок."""
+    aggregates = period_aggregates(student, date_from, date_to)
+    grades, next_cursor = grade_page(student, date_from, date_to, after, page_size)
+    subjects = Subject.objects.in_bulk([aggregate.subject_id for aggregate in aggregates])
+    return _history_data(aggregates, grades, next_cursor, subjects)
+
+
+async def astudent_history(student, date_from=None, date_to=None, after=None, page_size=PAGE_SIZE):
+    aggregates, (grades, next_cursor) = await asyncio.gather(
+        aperiod_aggregates(student, date_from, date_to),
+        agrade_page(student, date_from, date_to, after, page_size),
+    )
+    subjects = await Subject.objects.ain_bulk([aggregate.subject_id for aggregate in aggregates])
+    return _history_data(aggregates, grades, next_cursor, subjects)
+
+
+def grade_badges(grades):
+    """Оценки для вывода: пары (оценка, дата ДД.ММ.ГГГГ) в порядке grades."""
+    return [(grade.grade, grade.date.strftime('%d.%m.%Y')) for grade in grades]
+
+
+def average_class(average):
+    """CSS-класс значка среднего балла."""
+    if average >= 9:
+        return 'bg-success'
+    if average >= 7:
+        return 'bg-primary'
+    if average >= 5:
+        return 'bg-info'
+    if average >= 3:
+        return 'bg-warning'
+    return 'bg-danger'
+
+
+def _history_data(aggregates, grades, next_cursor, subjects):
+    total_grades_count, average_grade, grade_stats = GradeAggregate.summarize(aggregates)
+
+    grades_by_subject = {}
+    for grade in grades:
+        grades_by_subject.setdefault(grade.subject_id, []).append(grade)
+
+    subjects_grades_data = []
+    for aggregate in aggregates:
+        subject_grades = grades_by_subject.get(aggregate.subject_id, [])
+        subjects_grades_data.append({
+            'subject': subjects[aggregate.subject_id],
+            # От новых к старым, как на странице истории
+            'grades': subject_grades,
+            'badges': grade_badges(subject_grades),
+            'average': aggregate.average,
+            'average_class': average_class(aggregate.average),
+            'count': aggregate.count,
+        })
+    subjects_grades_data.sort(key=lambda subject_data: subject_data['subject'].name)
+
+    return {
+        'subjects_grades_data': subjects_grades_data,
+        'total_grades_count': total_grades_count,
+        'average_grade': average_grade,
+        'grade_stats': grade_stats,
+        'next_cursor': next_cursor,
+    }
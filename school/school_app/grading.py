@@ -0,0 +1,106 @@
+from django.db import transaction
+from . import school_calendar
+from .analytics import invalidate_class_subject
+from .dashboard_cache import invalidate_students
+from .grants import FORBIDDEN, NOT_TAUGHT, get_grants
+from .models import Student, Subject, SchoolClass, Grade, GradeAggregate
+
+
+class GradeSheetError(Exception):
+    """Ошибка, из-за которой не может быть принята вся ведомость целиком."""
+
+
+class GradeSheetForbidden(GradeSheetError):
+    """У учителя нет прав ставить оценки этому классу."""
+
+
+DAY_OFF_REASONS = {
+    school_calendar.WEEKEND: 'это выходной день',
+    school_calendar.HOLIDAY: 'праздничный день',
+    school_calendar.VACATION: 'каникулы',
+}
+
+
+def non_working_day_error(grade_date):
+    """Текст ошибки, если в этот день нельзя ставить оценки, иначе None."""
+    reason = DAY_OFF_REASONS.get(school_calendar.calendar_service.day_code(grade_date))
+    if reason:
+        return f'❌ Нельзя поставить оценку ({grade_date.strftime("%d.%m.%Y")}) - {reason}'
+    return None
+
+
+def save_grade_sheet(teacher, class_id, subject_id, grade_date, grades):
+    """
+    Сохраняет ведомость: оценки по одному предмету для класса на одну дату.
+
+    grades - словарь {id ученика: оценка}, пустые значения пропускаются.
+    Права и дата проверяются один раз на всю ведомость (GradeSheetError),
+    строки - по отдельности. Ведомость сохраняется целиком одной транзакцией
+    или не сохраняется вовсе, если хотя бы в одной строке есть ошибка.
+
+    Возвращает (список созданных оценок, {id ученика: текст ошибки}).
+    """
+    try:
+        class_id, subject_id = int(class_id), int(subject_id)
+    except (TypeError, ValueError):
+        raise GradeSheetError('❌ Выберите класс и предмет')
+    denial = get_grants(teacher.id).check(class_id, subject_id)
+    if denial == FORBIDDEN:
+        raise GradeSheetForbidden('❌ Нет прав')
+
+    school_class = SchoolClass.objects.get(id=class_id)
+    subject = Subject.objects.get(id=subject_id)
+    if denial == NOT_TAUGHT:
+        raise GradeSheetError(f'❌ Предмет "{subject.name}" не преподается в классе {school_class.name_class}')
+
+    error = non_working_day_error(grade_date)
+    if error:
+        raise GradeSheetError(error)
+
+    students = {
+        str(student.id): student
+        for student in Student.objects.filter(class_field=school_class).select_related('user')
+    }
+    graded = set(Grade.objects.filter(
+        student__class_field=school_class,
+        subject=subject,
+        date=grade_date
+    ).values_list('student_id', flat=True))
+
+    new_grades = []
+    errors = {}
+    for student_id, value in grades.items():
+        student_id = str(student_id)
+        if value in (None, ''):
+            continue
+
+        student = students.get(student_id)
+        if student is None:
+            errors[student_id] = '❌ Ученик не найден в этом классе'
+            continue
+
+        try:
+            grade_int = int(value)
+        except (TypeError, ValueError):
+            errors[student_id] = '❌ Оценка должна быть числом от 1 до 10'
+            continue
+
+        if grade_int < 1 or grade_int > 10:
+            errors[student_id] = '❌ Оценка должна быть от 1 до 10'
+        elif student.id in graded:
+            errors[student_id] = f'❌ Уже есть оценка по предмету "{subject.name}" на эту дату'
+        else:
+            new_grades.append(Grade(student=student, subject=subject, grade=grade_int, date=grade_date))
+
+    if errors or not new_grades:
+        return [], errors
+
+    with transaction.atomic():
+        Grade.objects.bulk_create(new_grades)
+        GradeAggregate.add_grades(new_grades)
+        # bulk_create не шлет сигналы - кеши дневников и аналитики сбрасываем сами
+        student_ids = [grade.student_id for grade in new_grades]
+        transaction.on_commit(lambda: invalidate_students(student_ids))
+        transaction.on_commit(lambda: invalidate_class_subject(class_id, subject_id))
+
+    return new_grades, errors
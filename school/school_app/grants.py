@@ -0,0 +1,81 @@
+"""
+Права учителей на выставление оценок.
+
+Для каждого учителя один раз вычисляется набор разрешенных пар
+(id класса, id предмета): предмет ведет сам учитель, класс закреплен за
+учителем, и предмет преподается в этом классе. Набор хранится в кеше
+Django, так что проверка при выставлении оценки - поиск в множестве без
+запросов к БД. Кеш сбрасывается сигналами m2m_changed на Teacher.subjects,
+Teacher.classes и Subject.classes (см. signals.py).
+
+Сброс доходит до других воркеров, только если кеш GRADE_GRANTS_CACHE_ALIAS
+общий (Redis, Memcached); с кешем в памяти процесса права должны храниться
+недолго (GRADE_GRANTS_TIMEOUT, см. settings.py) - иначе отозванные права
+еще действуют в остальных процессах.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Teacher, Subject
+
+# Причины отказа
+FORBIDDEN = 'forbidden'
+NOT_TAUGHT = 'not_taught'
+
+
+class GradeGrants:
+
+    def __init__(self, class_ids, subject_ids, pairs):
+        self.class_ids = frozenset(class_ids)
+        self.subject_ids = frozenset(subject_ids)
+        self.pairs = frozenset(pairs)
+
+    def check(self, class_id, subject_id):
+        """None, если оценку ставить можно, иначе FORBIDDEN или NOT_TAUGHT."""
+        if (class_id, subject_id) in self.pairs:
+            return None
+        if class_id in self.class_ids and subject_id in self.subject_ids:
+            return NOT_TAUGHT
+        return FORBIDDEN
+
+
+def grants_key(teacher_id):
+    return f'grade-grants:teacher:{teacher_id}'
+
+
+def build_grants(teacher_id):
+    class_ids = Teacher.classes.through.objects.filter(
+        teacher_id=teacher_id
+    ).values_list('schoolclass_id', flat=True)
+    subject_ids = Teacher.subjects.through.objects.filter(
+        teacher_id=teacher_id
+    ).values_list('subject_id', flat=True)
+    pairs = Subject.classes.through.objects.filter(
+        subject_id__in=subject_ids,
+        schoolclass_id__in=class_ids
+    ).values_list('schoolclass_id', 'subject_id')
+    return GradeGrants(class_ids, subject_ids, pairs)
+
+
+def _cache():
+    return caches[getattr(settings, 'GRADE_GRANTS_CACHE_ALIAS', 'default')]
+
+
+def get_grants(teacher_id):
+    cache = _cache()
+    grants = cache.get(grants_key(teacher_id))
+    if grants is None:
+        grants = build_grants(teacher_id)
+        cache.set(grants_key(teacher_id), grants, getattr(settings, 'GRADE_GRANTS_TIMEOUT', 5))
+    return grants
+
+
+def invalidate_teachers(teacher_ids):
+    _cache().delete_many([grants_key(teacher_id) for teacher_id in set(teacher_ids)])
+
+
+def invalidate_subjects(subject_ids):
+    """Сбрасывает права всех учителей, ведущих эти предметы."""
+    invalidate_teachers(Teacher.subjects.through.objects.filter(
+        subject_id__in=set(subject_ids)
+    ).values_list('teacher_id', flat=True))
@@ -0,0 +1,94 @@
+"""
+Хеширование паролей вне пути запроса (PBKDF2 нагружает CPU).
+
+- hash_passwords: пачкой в пуле процессов (массовый импорт);
+- create_portal_user: при PORTAL_DEFERRED_HASHING пользователь создается
+  сразу с неиспользуемым паролем ("ожидает активации"), а хеш считается
+  в фоновом потоке после коммита транзакции. Пока хеш не записан, войти
+  под этой учетной записью нельзя. Потерянные задания (например, после
+  перезапуска процесса) дописывает команда hash_pending_passwords.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+def _init_worker():
+    # При запуске через spawn Django в дочернем процессе еще не настроен
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+@contextmanager
+def hashing_pool(workers=None):
+    """Пул процессов для hash_passwords; при workers <= 1 хеширование идет в текущем процессе."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        yield None
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        yield pool
+
+
+def hash_passwords(passwords, pool=None):
+    if pool is None or len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+
+    return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // 32)))
+
+
+@lru_cache(maxsize=None)
+def _background_executor(workers):
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+
+
+def create_portal_user(username, password, first_name, last_name):
+    if not getattr(settings, 'PORTAL_DEFERRED_HASHING', False):
+        return User.objects.create_user(
+            username=username,
+            password=password,
+            first_name=first_name,
+            last_name=last_name,
+            is_active=True
+        )
+
+    user = User(username=username, first_name=first_name, last_name=last_name, is_active=True)
+    user.set_unusable_password()
+    user.save()
+    transaction.on_commit(lambda: schedule_password_hash(user.pk, password))
+    return user
+
+
+def schedule_password_hash(user_id, password):
+    workers = getattr(settings, 'PORTAL_HASH_WORKERS', 2)
+    if workers <= 0:
+        write_password_hash(user_id, password)
+    else:
+        _background_executor(workers).submit(_write_in_background, user_id, password)
+
+
+def write_password_hash(user_id, password):
+    User.objects.filter(pk=user_id).update(password=make_password(password))
+
+
+def _write_in_background(user_id, password):
+    try:
+        write_password_hash(user_id, password)
+    except Exception:
+        logger.exception('Не удалось записать хеш пароля пользователя %s', user_id)
+    finally:
+        # У потока пула собственное соединение с БД
+        connections.close_all()
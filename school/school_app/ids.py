@@ -0,0 +1,129 @@
+"""
+Выдача ID портала (учителя, ученики, родители) без повторных попыток.
+
+Для каждой последовательности (например, "student:26" - ученики 2026 года)
+в таблице IdSequence хранится следующий свободный номер. Номера
+резервируются блоками под блокировкой строки (select_for_update), поэтому
+параллельные сохранения в разных процессах не получают одинаковых ID.
+Номер переводится в видимый ID взаимно однозначной перестановкой, так что
+ID остаются непоследовательными, а формат - прежним.
+
+ID, выданные до появления последовательностей, отбрасываются одним
+запросом на весь блок.
+
+Если ID запрошены внутри внешней транзакции, резерв откатывается вместе с
+ней, и те же номера может зарезервировать другой процесс. Поэтому остаток
+такого блока попадает в запас процесса только после коммита (on_commit).
+"""
+import threading
+from collections import deque
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+
+
+# Множитель перестановки: взаимно прост с 9000 и 900000
+SCRAMBLE = 7919
+
+
+class IdSpaceExhausted(Exception):
+    """Все ID данного формата уже выданы."""
+
+
+class IdFormat:
+    """Формат ID: имя последовательности, емкость и способ отображения номера."""
+
+    def __init__(self, sequence, capacity, render, model_name, field):
+        self.sequence = sequence
+        self.capacity = capacity
+        self.render = render
+        self.model_name = model_name
+        self.field = field
+
+    def taken(self, candidates):
+        model = apps.get_model('school_app', self.model_name)
+        return set(model.objects.filter(**{f'{self.field}__in': candidates}).values_list(self.field, flat=True))
+
+
+def scramble(number, capacity):
+    return number * SCRAMBLE % capacity
+
+
+def student_id_format(year):
+    return IdFormat(f'student:{year}', 9000,
+                    lambda n: f'{year}{1000 + scramble(n, 9000)}',
+                    'Student', 'student_id')
+
+
+def parent_id_format(year):
+    return IdFormat(f'parent:{year}', 9000,
+                    lambda n: f'P{1000 + scramble(n, 9000)}{year}',
+                    'Parent', 'parent_id')
+
+
+def teacher_id_format():
+    return IdFormat('teacher', 900000,
+                    lambda n: f't{100000 + scramble(n, 900000)}',
+                    'Teacher', 'teacher_id')
+
+
+class IdAllocator:
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, id_format, count=1):
+        """Возвращает count свободных ID; из заранее зарезервированного блока - без запросов."""
+        block_size = self.block_size or getattr(settings, 'PORTAL_ID_BLOCK_SIZE', 1)
+
+        ids = self._take(id_format.sequence, count)
+        while len(ids) < count:
+            # _reserve - без блокировки процесса: строку последовательности может держать
+            # транзакция другого потока, которому для коммита тоже нужен allocate
+            needed = count - len(ids)
+            reserved = self._reserve(id_format, max(block_size, needed))
+            ids += reserved[:needed]
+            if transaction.get_connection().in_atomic_block:
+                transaction.on_commit(partial(self._keep, id_format.sequence, reserved[needed:]))
+            else:
+                self._keep(id_format.sequence, reserved[needed:])
+        return ids
+
+    def _take(self, sequence, count):
+        with self._lock:
+            block = self._blocks.get(sequence)
+            ids = []
+            while block and len(ids) < count:
+                ids.append(block.popleft())
+            return ids
+
+    def _keep(self, sequence, ids):
+        with self._lock:
+            self._blocks.setdefault(sequence, deque()).extend(ids)
+
+    def _reserve(self, id_format, size):
+        IdSequence = apps.get_model('school_app', 'IdSequence')
+
+        while True:
+            with transaction.atomic():
+                sequence, _ = IdSequence.objects.select_for_update().get_or_create(name=id_format.sequence)
+                start = sequence.next_value
+                if start >= id_format.capacity:
+                    raise IdSpaceExhausted(f'Исчерпаны ID последовательности "{id_format.sequence}"')
+
+                end = min(start + size, id_format.capacity)
+                sequence.next_value = end
+                sequence.save(update_fields=['next_value'])
+
+            candidates = [id_format.render(number) for number in range(start, end)]
+            taken = id_format.taken(candidates)
+            free = [candidate for candidate in candidates if candidate not in taken]
+            if free:
+                return free
+
+
+id_allocator = IdAllocator()
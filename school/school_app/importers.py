@@ -0,0 +1,308 @@
+"""
+Массовый импорт учеников, родителей и учителей из CSV/XLSX.
+
+Строки читаются генератором и обрабатываются пачками: ID выделяются
+сразу на всю пачку, пароли хешируются в пуле процессов, пользователи,
+профили, связи и данные для входа пишутся через bulk_create - по одной
+транзакции на пачку. Ошибочные строки не прерывают импорт, а попадают
+в отчет с номером строки.
+
+Колонки файла (первая строка - заголовок):
+    student: last_name, first_name, class        (класс в виде "5-А")
+    parent:  last_name, first_name, children     (ID учеников через ";")
+    teacher: last_name, first_name, subjects, classes
+"""
+import csv
+import io
+import re
+from datetime import datetime
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .hashing import hash_passwords, hashing_pool
+from .ids import id_allocator, student_id_format, parent_id_format, teacher_id_format
+from .models import (Teacher, Student, Parent, Subject, SchoolClass, PortalCredential,
+                     generate_portal_password)
+
+
+class ImportRowError(Exception):
+    """Ошибка в одной строке файла импорта."""
+
+
+def read_rows(file, filename):
+    """Генератор словарей {колонка: значение} из CSV или XLSX файла (бинарного)."""
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportRowError('Для импорта XLSX установите пакет openpyxl')
+
+        sheet = load_workbook(file, read_only=True, data_only=True).active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(value or '').strip() for value in next(rows, ())]
+        for values in rows:
+            yield {key: _cell_to_str(value) for key, value in zip(header, values)}
+        return
+
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    for row in csv.DictReader(text):
+        yield {key.strip(): (value or '').strip() for key, value in row.items() if key}
+
+
+def _cell_to_str(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _split(value):
+    return [part for part in re.split(r'[;,]\s*|\s+', value) if part]
+
+
+class ImportReport:
+
+    def __init__(self):
+        self.processed = 0
+        self.created = []
+        self.errors = []
+
+    def write_errors(self, file):
+        writer = csv.writer(file)
+        writer.writerow(['line', 'error', 'row'])
+        for line, error, row in self.errors:
+            writer.writerow([line, error, '; '.join(f'{key}={value}' for key, value in row.items())])
+
+
+class PeopleImporter:
+    model = None
+    id_field = None
+    # Формат ID портала: функция из ids.py; годовым форматам передается текущий год
+    id_format_factory = None
+    yearly_ids = True
+    role = None
+    username_prefix = None
+    username_separator = ''
+    columns = []
+
+    def __init__(self, chunk_size=500, workers=None, on_progress=None):
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.on_progress = on_progress
+
+    def run(self, rows):
+        report = ImportReport()
+        self.load_references()
+        numbered = enumerate(rows, start=2)
+
+        with hashing_pool(self.workers) as pool:
+            while True:
+                chunk = list(islice(numbered, self.chunk_size))
+                if not chunk:
+                    break
+
+                valid = []
+                for line, row in chunk:
+                    try:
+                        valid.append((line, row, self.clean(row)))
+                    except ImportRowError as e:
+                        report.errors.append((line, str(e), row))
+
+                valid = self.check_chunk(valid, report)
+                if valid:
+                    try:
+                        report.created += self.save_chunk([data for _, _, data in valid], pool)
+                    except Exception as e:
+                        report.errors += [(line, f'Пачка не сохранена: {e}', row) for line, row, _ in valid]
+
+                report.processed += len(chunk)
+                if self.on_progress:
+                    self.on_progress(report)
+
+        return report
+
+    def load_references(self):
+        pass
+
+    def check_chunk(self, valid, report):
+        """Проверки, которым нужна вся пачка сразу (один запрос вместо запроса на строку)."""
+        return valid
+
+    def clean(self, row):
+        last_name = row.get('last_name', '')
+        first_name = row.get('first_name', '')
+        if not last_name or not first_name:
+            raise ImportRowError('Не заполнены фамилия или имя')
+        return {'last_name': last_name[:30], 'first_name': first_name[:30]}
+
+    def build_profile(self, data, user, portal_id, password):
+        return self.model(user=user, password=password, **{self.id_field: portal_id})
+
+    def save_relations(self, profiles, rows):
+        pass
+
+    def save_chunk(self, rows, pool):
+        id_format = self.id_format_factory(current_year()) if self.yearly_ids else self.id_format_factory()
+        portal_ids = id_allocator.allocate(id_format, count=len(rows))
+        passwords = [generate_portal_password() for _ in rows]
+        hashes = hash_passwords(passwords, pool)
+        usernames = self.usernames(portal_ids)
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=username, password=password_hash, is_active=True,
+                     first_name=data['first_name'], last_name=data['last_name'])
+                for username, password_hash, data in zip(usernames, hashes, rows)
+            ])
+            profiles = self.model.objects.bulk_create([
+                self.build_profile(data, user, portal_id, password)
+                for data, user, portal_id, password in zip(rows, users, portal_ids, passwords)
+            ])
+            self.save_relations(profiles, rows)
+            PortalCredential.objects.bulk_create([
+                PortalCredential(portal_id=portal_id, role=self.role, user=user, password=password)
+                for portal_id, user, password in zip(portal_ids, users, passwords)
+            ])
+
+        return profiles
+
+    def usernames(self, portal_ids):
+        """Логины как у create_user_with_name; занятые получают числовой суффикс."""
+        bases = [f'{self.username_prefix}_{portal_id}' for portal_id in portal_ids]
+        usernames = list(bases)
+        counters = [0] * len(bases)
+
+        pending = range(len(usernames))
+        while pending:
+            taken = set(User.objects.filter(
+                username__in=[usernames[i] for i in pending]
+            ).values_list('username', flat=True))
+            pending = [i for i in pending if usernames[i] in taken]
+            for i in pending:
+                counters[i] += 1
+                usernames[i] = f'{bases[i]}{self.username_separator}{counters[i]}'
+
+        return usernames
+
+
+class ClassLookupMixin:
+
+    def load_references(self):
+        super().load_references()
+        self.classes = {
+            school_class.name_class.upper(): school_class
+            for school_class in SchoolClass.objects.all()
+        }
+
+    def find_class(self, name):
+        school_class = self.classes.get(name.replace(' ', '').upper())
+        if school_class is None:
+            raise ImportRowError(f'Класс "{name}" не найден')
+        return school_class
+
+
+def current_year():
+    return str(datetime.now().year)[2:]
+
+
+class StudentImporter(ClassLookupMixin, PeopleImporter):
+    model = Student
+    id_field = 'student_id'
+    id_format_factory = staticmethod(student_id_format)
+    role = PortalCredential.STUDENT
+    username_prefix = 'student'
+    columns = ['last_name', 'first_name', 'class']
+
+    def clean(self, row):
+        data = super().clean(row)
+        data['class_field'] = self.find_class(row['class']) if row.get('class') else None
+        return data
+
+    def build_profile(self, data, user, portal_id, password):
+        profile = super().build_profile(data, user, portal_id, password)
+        profile.class_field = data['class_field']
+        return profile
+
+
+class ParentImporter(PeopleImporter):
+    model = Parent
+    id_field = 'parent_id'
+    id_format_factory = staticmethod(parent_id_format)
+    role = PortalCredential.PARENT
+    username_prefix = 'parent'
+    columns = ['last_name', 'first_name', 'children']
+
+    def clean(self, row):
+        data = super().clean(row)
+        data['children'] = _split(row.get('children', ''))
+        return data
+
+    def check_chunk(self, valid, report):
+        student_ids = {student_id for _, _, data in valid for student_id in data['children']}
+        students = dict(Student.objects.filter(student_id__in=student_ids).values_list('student_id', 'id'))
+
+        checked = []
+        for line, row, data in valid:
+            missing = [student_id for student_id in data['children'] if student_id not in students]
+            if missing:
+                report.errors.append((line, f'Не найдены ученики: {", ".join(missing)}', row))
+                continue
+            data['children'] = [students[student_id] for student_id in data['children']]
+            checked.append((line, row, data))
+        return checked
+
+    def save_relations(self, profiles, rows):
+        Parent.students.through.objects.bulk_create([
+            Parent.students.through(parent_id=parent.id, student_id=student_id)
+            for parent, data in zip(profiles, rows)
+            for student_id in data['children']
+        ], ignore_conflicts=True)
+
+
+class TeacherImporter(ClassLookupMixin, PeopleImporter):
+    model = Teacher
+    id_field = 'teacher_id'
+    id_format_factory = staticmethod(teacher_id_format)
+    yearly_ids = False
+    role = PortalCredential.TEACHER
+    username_prefix = 'teacher'
+    columns = ['last_name', 'first_name', 'subjects', 'classes']
+    username_separator = '_'
+
+    def load_references(self):
+        super().load_references()
+        self.subjects = {subject.name.lower(): subject for subject in Subject.objects.all()}
+
+    def clean(self, row):
+        data = super().clean(row)
+        data['classes'] = [self.find_class(name) for name in _split(row.get('classes', ''))]
+
+        data['subjects'] = []
+        for name in filter(None, (part.strip() for part in row.get('subjects', '').split(';'))):
+            subject = self.subjects.get(name.lower())
+            if subject is None:
+                raise ImportRowError(f'Предмет "{name}" не найден')
+            data['subjects'].append(subject)
+        return data
+
+    def save_relations(self, profiles, rows):
+        Teacher.subjects.through.objects.bulk_create([
+            Teacher.subjects.through(teacher_id=teacher.id, subject_id=subject.id)
+            for teacher, data in zip(profiles, rows)
+            for subject in data['subjects']
+        ], ignore_conflicts=True)
+        Teacher.classes.through.objects.bulk_create([
+            Teacher.classes.through(teacher_id=teacher.id, schoolclass_id=school_class.id)
+            for teacher, data in zip(profiles, rows)
+            for school_class in data['classes']
+        ], ignore_conflicts=True)
+
+
+IMPORTERS = {
+    'student': StudentImporter,
+    'parent': ParentImporter,
+    'teacher': TeacherImporter,
+}
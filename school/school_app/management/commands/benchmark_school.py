@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+from school_app.benchmarks import (CLIENTS, REPEAT, REQUESTS_PER_CLIENT, TOLERANCE, WSGI_THREADS, BenchmarkError,
+                                   compare, compare_servers, load_baseline, run_size, save_results)
+from school_app.db_routing import replica_alias
+from school_app.synthetic import SIZES, SyntheticSchool
+
+
+class Command(BaseCommand):
+    help = ('Сквозные бенчмарки представлений на синтетической школе нескольких размеров '
+            'со сравнением с базовой линией. Работает в отдельной тестовой базе')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', dest='sizes', action='append', choices=sorted(SIZES),
+                            help='Размер школы; можно указать несколько раз (по умолчанию small и medium)')
+        parser.add_argument('--repeat', type=int, default=REPEAT, help=f'Повторов сценария (по умолчанию {REPEAT})')
+        parser.add_argument('--baseline', default='benchmark_baseline.json',
+                            help='JSON с базовой линией (по умолчанию benchmark_baseline.json)')
+        parser.add_argument('--save-baseline', action='store_true', help='Записать результаты как новую базовую линию')
+        parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                            help=f'Допустимый рост времени и памяти (по умолчанию {TOLERANCE})')
+        parser.add_argument('--output', '-o', help='Куда записать результаты (JSON)')
+        parser.add_argument('--servers', action='store_true',
+                            help='Дополнительно сравнить дневники под WSGI и ASGI (на последнем размере)')
+        parser.add_argument('--clients', type=int, default=CLIENTS,
+                            help=f'Одновременных клиентов для --servers (по умолчанию {CLIENTS})')
+        parser.add_argument('--requests-per-client', type=int, default=REQUESTS_PER_CLIENT,
+                            help=f'Запросов от каждого клиента (по умолчанию {REQUESTS_PER_CLIENT})')
+        parser.add_argument('--wsgi-threads', type=int, default=WSGI_THREADS,
+                            help=f'Потоков WSGI-сервера (по умолчанию {WSGI_THREADS})')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Не спрашивать перед удалением старой тестовой базы')
+
+    def handle(self, *args, **options):
+        sizes = options['sizes'] or ['small', 'medium']
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'])
+        if replica_alias():
+            # Дневники в --servers читают реплику - она должна смотреть в ту же тестовую базу
+            connections[replica_alias()].creation.set_as_test_mirror(connection.settings_dict)
+        try:
+            results = {}
+            for size in sizes:
+                self.stdout.write(f'Размер {size}...')
+                results[size] = run_size(size, connection, options['repeat'])
+                self.write_table(size, results[size])
+            if options['servers']:
+                servers = self.compare_servers(sizes[-1], options)
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['servers']:
+            for server, metrics in servers.items():
+                self.stdout.write(f'{server}: ' + ', '.join(f'{key}: {value}' for key, value in metrics.items()))
+
+        if options['output']:
+            save_results(results, options['output'])
+        if options['save_baseline']:
+            save_results({**load_baseline(options['baseline']), **results}, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f'Базовая линия записана в {options["baseline"]}'))
+            return
+
+        regressions = compare(results, load_baseline(options['baseline']), options['tolerance'])
+        for size, name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'{size} {name}: {metric} {before} -> {after}'))
+        if regressions:
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def compare_servers(self, size, options):
+        self.stdout.write(f'WSGI и ASGI, размер {size}, клиентов: {options["clients"]}...')
+        # Потоки серверов видят только закоммиченные данные; тестовая база все равно удаляется
+        SyntheticSchool(**SIZES[size]).run()
+        return compare_servers(options['clients'], options['requests_per_client'], options['wsgi_threads'])
+
+    def write_table(self, size, result):
+        self.stdout.write(', '.join(f'{key}: {value}' for key, value in result['dataset'].items()))
+        self.stdout.write(f'{"сценарий":32} {"медиана, мс":>12} {"макс, мс":>10} {"SQL":>5} {"пик, КБ":>10}')
+        for name, metrics in result['scenarios'].items():
+            self.stdout.write(f'{name:32} {metrics["median_ms"]:>12} {metrics["max_ms"]:>10} '
+                              f'{metrics["queries"]:>5} {metrics["peak_kb"]:>10}')
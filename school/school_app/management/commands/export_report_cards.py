@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from school_app.models import SchoolClass
+from school_app.reports import FORMATS, ReportCardExport, ReportError, csv_chunks, write_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка сводной ведомости (средние по ученикам и предметам) в CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv', help='Формат файла (по умолчанию csv)')
+        parser.add_argument('--class', dest='classes', action='append', default=[],
+                            help='Класс, например "5-А"; можно указать несколько раз. По умолчанию - вся школа')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help='Начало периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help='Конец периода, ГГГГ-ММ-ДД')
+        parser.add_argument('--output', '-o', help='Путь к файлу (для CSV по умолчанию - stdout)')
+
+    def handle(self, *args, **options):
+        export = ReportCardExport(
+            classes=self.find_classes(options['classes']) if options['classes'] else None,
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+        )
+
+        try:
+            if options['format'] == 'xlsx':
+                if not options['output']:
+                    raise CommandError('Для XLSX укажите --output')
+                with open(options['output'], 'wb') as file:
+                    write_xlsx(export.rows(), file)
+            elif options['output']:
+                with open(options['output'], 'w', encoding='utf-8', newline='') as file:
+                    file.writelines(csv_chunks(export.rows()))
+            else:
+                for chunk in csv_chunks(export.rows(), bom=False):
+                    self.stdout.write(chunk, ending='')
+        except (OSError, ReportError) as e:
+            raise CommandError(str(e))
+
+    def find_classes(self, names):
+        classes = {school_class.name_class.upper(): school_class for school_class in SchoolClass.objects.all()}
+        missing = [name for name in names if name.replace(' ', '').upper() not in classes]
+        if missing:
+            raise CommandError(f'Классы не найдены: {", ".join(missing)}')
+        return [classes[name.replace(' ', '').upper()] for name in names]
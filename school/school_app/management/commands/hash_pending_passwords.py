@@ -0,0 +1,21 @@
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from school_app.models import PortalCredential
+
+
+class Command(BaseCommand):
+    help = 'Дописывает хеши паролей учетных записей, ожидающих активации'
+
+    def handle(self, *args, **options):
+        credentials = PortalCredential.objects.filter(
+            user__password__startswith=UNUSABLE_PASSWORD_PREFIX
+        ).select_related('user')
+
+        updated = []
+        for credential in credentials.iterator(chunk_size=500):
+            credential.user.password = make_password(credential.password)
+            updated.append(credential.user)
+
+        User.objects.bulk_update(updated, ['password'], batch_size=500)
+        self.stdout.write(self.style.SUCCESS(f'Активировано учетных записей: {len(updated)}'))
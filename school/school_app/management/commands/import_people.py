@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from school_app.importers import IMPORTERS, ImportRowError, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Массовый импорт учеников, родителей или учителей из CSV/XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='Кого импортировать')
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--errors', help='Куда записать CSV со строками, которые не удалось импортировать')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Размер пачки (по умолчанию 500)')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Процессов для хеширования паролей (по умолчанию - по числу CPU)')
+
+    def handle(self, *args, **options):
+        importer = IMPORTERS[options['kind']](
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            on_progress=self.progress,
+        )
+
+        try:
+            with open(options['path'], 'rb') as file:
+                report = importer.run(read_rows(file, options['path']))
+        except (OSError, ImportRowError) as e:
+            raise CommandError(str(e))
+
+        if report.errors and options['errors']:
+            with open(options['errors'], 'w', encoding='utf-8', newline='') as file:
+                report.write_errors(file)
+
+        self.stdout.write(self.style.SUCCESS(f'Создано: {len(report.created)}'))
+        if report.errors:
+            self.stdout.write(self.style.WARNING(f'Строк с ошибками: {len(report.errors)}'))
+            for line, error, _ in report.errors[:20]:
+                self.stdout.write(f'  строка {line}: {error}')
+
+    def progress(self, report):
+        self.stdout.write(f'Обработано строк: {report.processed}, создано: {len(report.created)}, '
+                          f'ошибок: {len(report.errors)}')
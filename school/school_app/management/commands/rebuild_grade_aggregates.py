@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from school_app.models import GradeAggregate
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу сводок оценок (GradeAggregate) по всем оценкам'
+
+    def handle(self, *args, **options):
+        count = GradeAggregate.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано сводок: {count}'))
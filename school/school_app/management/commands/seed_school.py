@@ -0,0 +1,53 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from school_app.models import SchoolClass, Student, Teacher
+from school_app.synthetic import DEFAULT_PASSWORD, SIZES, SyntheticSchool
+
+
+class Command(BaseCommand):
+    help = 'Заполнение пустой базы синтетической школой (классы, учителя, ученики, родители, оценки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='medium',
+                            help='Готовый размер школы (по умолчанию medium); параметры ниже его уточняют')
+        parser.add_argument('--classes', type=int, help='Количество классов')
+        parser.add_argument('--students-per-class', type=int, help='Учеников в классе')
+        parser.add_argument('--subjects', type=int, help='Количество предметов')
+        parser.add_argument('--teachers', type=int, help='Количество учителей')
+        parser.add_argument('--parents', type=int, help='Количество родителей')
+        parser.add_argument('--weeks', type=int, help='Учебных недель с оценками')
+        parser.add_argument('--grades-per-week', type=int, default=1,
+                            help='Оценок в неделю по каждому предмету (по умолчанию 1)')
+        parser.add_argument('--start', type=date.fromisoformat, default=date(2025, 9, 1),
+                            help='Начало учебного года, ГГГГ-ММ-ДД')
+        parser.add_argument('--password', default=DEFAULT_PASSWORD,
+                            help=f'Пароль всех учетных записей (по умолчанию {DEFAULT_PASSWORD})')
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+
+    def handle(self, *args, **options):
+        if SchoolClass.objects.exists() or Student.objects.exists() or Teacher.objects.exists():
+            raise CommandError('База уже содержит классы или людей - синтетическая школа создается только в пустой базе')
+
+        counts = {**SIZES[options['size']], **{
+            key: options[key]
+            for key in ('classes', 'students_per_class', 'subjects', 'teachers', 'parents', 'weeks')
+            if options[key] is not None
+        }}
+
+        try:
+            school = SyntheticSchool(
+                grades_per_week=options['grades_per_week'],
+                start=options['start'],
+                password=options['password'],
+                seed=options['seed'],
+                on_progress=self.stdout.write,
+                **counts,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        created = school.run()
+        self.stdout.write(self.style.SUCCESS(
+            'Создано: ' + ', '.join(f'{key} - {value}' for key, value in created.items())
+        ))
@@ -0,0 +1,382 @@
+"""
+Метрики производительности по представлениям и эндпоинт /metrics.
+
+MetricsMiddleware замеряет каждый запрос и складывает результат в счетчики
+процесса по имени URL (resolver_match.view_name): гистограмма длительности,
+число SQL-запросов и время в БД, время рендера шаблонов и размер ответа.
+Запросы к БД считает record_query - обертка execute_wrappers, которая
+один раз вешается на каждое соединение и пишет в замеры текущего запроса
+(contextvar, поэтому учитываются и запросы асинхронных представлений из
+потоков sync_to_async). Рендер считает бэкенд шаблонов
+InstrumentedDjangoTemplates (подключается в TEMPLATES).
+
+Счетчики живут в памяти процесса. Если воркеров несколько, задайте
+METRICS['MULTIPROCESS_DIR']: каждый процесс не чаще раза в FLUSH_SECONDS
+сбрасывает свои счетчики в файл <pid>.json этого каталога, а /metrics
+суммирует все файлы.
+
+Запросы дольше SLOW_REQUEST_MS пишутся в лог school_app.metrics вместе с
+самыми долгими SQL; SLOW_LOG_SIZE худших из них хранятся в памяти процесса
+и доступны на /metrics/slow/.
+"""
+import contextvars
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.http import HttpResponse, JsonResponse
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_SECONDS': 10,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_LOG_SIZE': 20,
+    # Сколько самых долгих SQL сохранять для медленного запроса
+    'SLOW_SQL_COUNT': 20,
+}
+
+# Границы корзин гистограммы длительности, секунды
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNRESOLVED = '<unresolved>'
+
+# Замеры текущего запроса (в том числе для рендера шаблонов)
+current_request = contextvars.ContextVar('metrics_request', default=None)
+
+
+@lru_cache(maxsize=None)
+def get_metrics_config():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class RequestStats:
+    """Замеры одного запроса."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.sql = []
+
+    def add_query(self, elapsed, sql):
+        self.queries += 1
+        self.db_time += elapsed
+        self.sql.append((elapsed, sql))
+
+    def slowest_sql(self, count):
+        return [{'ms': round(elapsed * 1000, 2), 'sql': sql}
+                for elapsed, sql in heapq.nlargest(count, self.sql, key=lambda item: item[0])]
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(time.perf_counter() - start, sql)
+
+
+def install_query_recorder():
+    """Вешает record_query на соединения текущего потока, если его там еще нет."""
+    for alias in connections:
+        wrappers = connections[alias].execute_wrappers
+        if record_query not in wrappers:
+            # В начало списка: временные обертки (execute_wrapper) снимаются с конца
+            wrappers.insert(0, record_query)
+
+
+def empty_view_metrics():
+    return {
+        'buckets': [0] * len(BUCKETS),
+        'count': 0,
+        'duration': 0.0,
+        'queries': 0,
+        'db_time': 0.0,
+        'template_time': 0.0,
+        'response_bytes': 0,
+    }
+
+
+def merge_view_metrics(target, source):
+    target['buckets'] = [a + b for a, b in zip(target['buckets'], source['buckets'])]
+    for field in ('count', 'duration', 'queries', 'db_time', 'template_time', 'response_bytes'):
+        target[field] += source[field]
+
+
+class MetricsRegistry:
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+            self._slow = []
+            self._flushed_at = self.clock()
+
+    def record(self, view, duration, stats, response_bytes):
+        with self._lock:
+            metrics = self._views.get(view)
+            if metrics is None:
+                metrics = self._views[view] = empty_view_metrics()
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    metrics['buckets'][i] += 1
+                    break
+            metrics['count'] += 1
+            metrics['duration'] += duration
+            metrics['queries'] += stats.queries
+            metrics['db_time'] += stats.db_time
+            metrics['template_time'] += stats.template_time
+            metrics['response_bytes'] += response_bytes
+
+    def record_slow(self, duration, entry, size):
+        with self._lock:
+            # Ключ с id(entry) - чтобы не сравнивать словари при равной длительности
+            item = (duration, id(entry), entry)
+            if len(self._slow) < size:
+                heapq.heappush(self._slow, item)
+            elif duration > self._slow[0][0]:
+                heapq.heapreplace(self._slow, item)
+
+    def snapshot(self):
+        with self._lock:
+            return {view: {**metrics, 'buckets': list(metrics['buckets'])}
+                    for view, metrics in self._views.items()}
+
+    def slow_requests(self):
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slow, key=lambda item: -item[0])]
+
+    def flush_due(self, flush_seconds):
+        with self._lock:
+            if self.clock() - self._flushed_at < flush_seconds:
+                return False
+            self._flushed_at = self.clock()
+            return True
+
+
+registry = MetricsRegistry()
+
+
+def process_file(directory, pid=None):
+    return os.path.join(directory, f'{pid or os.getpid()}.json')
+
+
+def flush(directory):
+    """Атомарно записывает счетчики процесса в его файл."""
+    path = process_file(directory)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(tmp_path, path)
+
+
+def collect(directory=None):
+    """Счетчики всех процессов (или только текущего, если каталог не задан)."""
+    if directory is None:
+        return registry.snapshot()
+
+    flush(directory)
+    views = {}
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                process_views = json.load(file)
+        except (OSError, ValueError):
+            continue
+        for view, metrics in process_views.items():
+            merge_view_metrics(views.setdefault(view, empty_view_metrics()), metrics)
+    return views
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(views):
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        lines.extend(samples)
+
+    histogram = []
+    for view, metrics in sorted(views.items()):
+        label = f'view="{escape_label(view)}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, metrics['buckets']):
+            cumulative += count
+            histogram.append(f'school_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        histogram.append(f'school_request_duration_seconds_bucket{{{label},le="+Inf"}} {metrics["count"]}')
+        histogram.append(f'school_request_duration_seconds_sum{{{label}}} {metrics["duration"]:.6f}')
+        histogram.append(f'school_request_duration_seconds_count{{{label}}} {metrics["count"]}')
+    metric('school_request_duration_seconds', 'histogram', 'Request latency by URL name.', histogram)
+
+    counters = [
+        ('school_db_queries_total', 'queries', 'SQL queries executed.', '{}'),
+        ('school_db_duration_seconds_total', 'db_time', 'Time spent in SQL queries.', '{:.6f}'),
+        ('school_template_duration_seconds_total', 'template_time', 'Time spent rendering templates.', '{:.6f}'),
+        ('school_response_bytes_total', 'response_bytes', 'Response body size (non-streaming responses).', '{}'),
+    ]
+    for name, field, help_text, value_format in counters:
+        metric(name, 'counter', help_text, [
+            f'{name}{{view="{escape_label(view)}"}} {value_format.format(metrics[field])}'
+            for view, metrics in sorted(views.items())
+        ])
+
+    return '\n'.join(lines) + '\n'
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        config = get_metrics_config()
+        if not config['ENABLED']:
+            return self.get_response(request)
+
+        install_query_recorder()
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        if self.record(request, response, time.perf_counter() - start, stats, config):
+            flush(config['MULTIPROCESS_DIR'])
+        return response
+
+    async def __acall__(self, request):
+        config = get_metrics_config()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+
+        # Запросы к БД идут из потока sync_to_async этого запроса - обертку вешаем там
+        await sync_to_async(install_query_recorder)()
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        if self.record(request, response, time.perf_counter() - start, stats, config):
+            await sync_to_async(flush)(config['MULTIPROCESS_DIR'])
+        return response
+
+    def record(self, request, response, duration, stats, config):
+        """Учитывает запрос; True, если пора сбросить счетчики в файл процесса."""
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED
+        registry.record(view, duration, stats, response_size(response))
+
+        if duration * 1000 >= config['SLOW_REQUEST_MS']:
+            self.log_slow(request, response, view, duration, stats, config)
+
+        return bool(config['MULTIPROCESS_DIR']) and registry.flush_due(config['FLUSH_SECONDS'])
+
+    def log_slow(self, request, response, view, duration, stats, config):
+        entry = {
+            'view': view,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'ms': round(duration * 1000, 2),
+            'queries': stats.queries,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'template_ms': round(stats.template_time * 1000, 2),
+            'sql': stats.slowest_sql(config['SLOW_SQL_COUNT']),
+        }
+        registry.record_slow(duration, entry, config['SLOW_LOG_SIZE'])
+        logger.warning('Медленный запрос %s %s (%s): %.0f мс, SQL: %d за %.0f мс',
+                       entry['method'], entry['path'], view, entry['ms'], entry['queries'], entry['db_ms'],
+                       extra={'slow_request': entry})
+
+
+class InstrumentedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        stats = current_request.get()
+        if stats is None:
+            return super().render(context, request)
+
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates, который засчитывает время рендера текущему запросу."""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return InstrumentedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
+
+
+@staff_member_required
+def metrics_view(request):
+    views = collect(get_metrics_config()['MULTIPROCESS_DIR'])
+    return HttpResponse(prometheus_text(views), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def slow_requests_view(request):
+    """Худшие запросы текущего процесса с их самыми долгими SQL."""
+    return JsonResponse({'slow_requests': registry.slow_requests()})
+
+
+@receiver(setting_changed)
+def reset_metrics_config(setting, **kwargs):
+    if setting == 'METRICS':
+        get_metrics_config.cache_clear()
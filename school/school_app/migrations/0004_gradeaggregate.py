@@ -0,0 +1,64 @@
+# Generated by Django 6.0 on 2026-10-18 20:25
+
+import django.db.models.deletion
+import school_app.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum, Min, Max, Q
+
+
+def build_aggregates(apps, schema_editor):
+    Grade = apps.get_model('school_app', 'Grade')
+    GradeAggregate = apps.get_model('school_app', 'GradeAggregate')
+
+    rows = Grade.objects.order_by().values('student_id', 'subject_id').annotate(
+        count=Count('id'),
+        total=Sum('grade'),
+        min_grade=Min('grade'),
+        max_grade=Max('grade'),
+        last_date=Max('date'),
+        **{f'grade_{value}': Count('id', filter=Q(grade=value)) for value in range(1, 11)}
+    )
+
+    aggregates = []
+    for row in rows:
+        histogram = [row.pop(f'grade_{value}') for value in range(1, 11)]
+        aggregates.append(GradeAggregate(histogram=histogram, **row))
+
+    GradeAggregate.objects.bulk_create(aggregates, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0003_grade'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='student',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='student_profile', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.CreateModel(
+            name='GradeAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество оценок')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')),
+                ('min_grade', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Минимальная оценка')),
+                ('max_grade', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Максимальная оценка')),
+                ('last_date', models.DateField(blank=True, null=True, verbose_name='Дата последней оценки')),
+                ('histogram', models.JSONField(default=school_app.models.empty_histogram, verbose_name='Распределение оценок')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grade_aggregates', to='school_app.student', verbose_name='Ученик')),
+                ('subject', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grade_aggregates', to='school_app.subject', verbose_name='Предмет')),
+            ],
+            options={
+                'verbose_name': 'Сводка оценок',
+                'verbose_name_plural': 'Сводки оценок',
+                'constraints': [models.UniqueConstraint(fields=('student', 'subject'), name='unique_grade_aggregate')],
+            },
+        ),
+        migrations.RunPython(build_aggregates, migrations.RunPython.noop),
+    ]
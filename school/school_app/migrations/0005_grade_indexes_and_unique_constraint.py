@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-18 20:26
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Min, Max, Q
+
+
+def remove_duplicate_grades(apps, schema_editor):
+    """Оставляет по одной (самой ранней) оценке на ученика, предмет и дату."""
+    Grade = apps.get_model('school_app', 'Grade')
+    GradeAggregate = apps.get_model('school_app', 'GradeAggregate')
+
+    duplicates = Grade.objects.order_by().values('student_id', 'subject_id', 'date').annotate(
+        first_id=Min('id'),
+        count=Count('id'),
+    ).filter(count__gt=1)
+
+    affected = set()
+    for row in duplicates:
+        Grade.objects.filter(
+            student_id=row['student_id'],
+            subject_id=row['subject_id'],
+            date=row['date'],
+        ).exclude(id=row['first_id']).delete()
+        affected.add((row['student_id'], row['subject_id']))
+
+    # Сводки затронутых пар пересчитываются, т.к. сигналы в миграциях не работают
+    for student_id, subject_id in affected:
+        grades = Grade.objects.filter(student_id=student_id, subject_id=subject_id)
+        row = grades.aggregate(
+            count=Count('id'),
+            total=Sum('grade'),
+            min_grade=Min('grade'),
+            max_grade=Max('grade'),
+            last_date=Max('date'),
+            **{f'grade_{value}': Count('id', filter=Q(grade=value)) for value in range(1, 11)}
+        )
+        histogram = [row.pop(f'grade_{value}') for value in range(1, 11)]
+        GradeAggregate.objects.filter(student_id=student_id, subject_id=subject_id).update(
+            histogram=histogram, **row
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0004_gradeaggregate'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_grades, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['student', '-date'], include=('subject', 'grade'), name='grade_student_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['subject', 'student'], include=('grade',), name='grade_subject_student_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='grade',
+            constraint=models.UniqueConstraint(fields=('student', 'subject', 'date'), name='unique_grade_per_day'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 6.0 on 2026-10-18 20:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_credentials(apps, schema_editor):
+    PortalCredential = apps.get_model('school_app', 'PortalCredential')
+    profiles = [
+        ('Teacher', 'teacher_id', 'teacher'),
+        ('Student', 'student_id', 'student'),
+        ('Parent', 'parent_id', 'parent'),
+    ]
+
+    credentials = []
+    for model_name, id_field, role in profiles:
+        model = apps.get_model('school_app', model_name)
+        for profile in model.objects.exclude(user=None).exclude(**{id_field: None}).exclude(password=None):
+            credentials.append(PortalCredential(
+                portal_id=getattr(profile, id_field),
+                role=role,
+                user_id=profile.user_id,
+                password=profile.password,
+            ))
+
+    PortalCredential.objects.bulk_create(credentials, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0005_grade_indexes_and_unique_constraint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortalCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('portal_id', models.CharField(max_length=10, unique=True, verbose_name='ID для входа')),
+                ('role', models.CharField(choices=[('teacher', 'Учитель'), ('student', 'Ученик'), ('parent', 'Родитель')], max_length=10, verbose_name='Роль')),
+                ('password', models.CharField(max_length=6, verbose_name='Пароль для входа')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='portal_credential', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Данные для входа',
+                'verbose_name_plural': 'Данные для входа',
+            },
+        ),
+        migrations.RunPython(fill_credentials, migrations.RunPython.noop),
+    ]
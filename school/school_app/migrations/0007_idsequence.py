@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0006_portalcredential'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('name', models.CharField(max_length=30, primary_key=True, serialize=False, verbose_name='Последовательность')),
+                ('next_value', models.PositiveIntegerField(default=0, verbose_name='Следующий номер')),
+            ],
+            options={
+                'verbose_name': 'Последовательность ID',
+                'verbose_name_plural': 'Последовательности ID',
+            },
+        ),
+    ]
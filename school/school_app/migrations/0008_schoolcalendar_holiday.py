@@ -0,0 +1,77 @@
+# Generated by Django 6.0 on 2026-10-18 20:42
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Праздники, которые раньше были зашиты в код (grading.HOLIDAYS_2025_2026)
+HOLIDAYS_2025_2026 = [
+    datetime.date(2025, 11, 7),
+    datetime.date(2025, 12, 25),
+    datetime.date(2026, 1, 1),
+    datetime.date(2026, 1, 2),
+    datetime.date(2026, 1, 7),
+    datetime.date(2026, 3, 8),
+    datetime.date(2026, 5, 1),
+    datetime.date(2026, 5, 9),
+]
+
+
+def create_calendar_2025_2026(apps, schema_editor):
+    SchoolCalendar = apps.get_model('school_app', 'SchoolCalendar')
+    Holiday = apps.get_model('school_app', 'Holiday')
+
+    calendar, created = SchoolCalendar.objects.get_or_create(
+        name='2025/2026',
+        defaults={'start_date': datetime.date(2025, 9, 1), 'end_date': datetime.date(2026, 5, 31)}
+    )
+    if created:
+        Holiday.objects.bulk_create([
+            Holiday(calendar=calendar, name='Праздник', kind='holiday', start_date=day, end_date=day)
+            for day in HOLIDAYS_2025_2026
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0007_idsequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchoolCalendar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=20, unique=True, verbose_name='Учебный год')),
+                ('start_date', models.DateField(verbose_name='Начало учебного года')),
+                ('end_date', models.DateField(verbose_name='Конец учебного года')),
+            ],
+            options={
+                'verbose_name': 'Учебный календарь',
+                'verbose_name_plural': 'Учебные календари',
+                'ordering': ['start_date'],
+                'constraints': [models.CheckConstraint(condition=models.Q(('end_date__gte', models.F('start_date'))), name='school_calendar_dates_ordered')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Holiday',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('kind', models.CharField(choices=[('holiday', 'Праздник'), ('vacation', 'Каникулы'), ('working_day', 'Учебный выходной день')], default='holiday', max_length=20, verbose_name='Тип')),
+                ('start_date', models.DateField(verbose_name='С')),
+                ('end_date', models.DateField(verbose_name='По')),
+                ('calendar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holidays', to='school_app.schoolcalendar', verbose_name='Учебный год')),
+            ],
+            options={
+                'verbose_name': 'Нерабочий день',
+                'verbose_name_plural': 'Нерабочие дни',
+                'ordering': ['start_date'],
+                'constraints': [models.CheckConstraint(condition=models.Q(('end_date__gte', models.F('start_date'))), name='holiday_dates_ordered')],
+            },
+        ),
+        migrations.RunPython(create_calendar_2025_2026, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 6.0 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0008_schoolcalendar_holiday'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='grade',
+            name='grade_student_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['student', '-date', '-id'], include=('subject', 'grade'), name='grade_student_date_id_idx'),
+        ),
+    ]
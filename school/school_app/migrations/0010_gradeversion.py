@@ -0,0 +1,25 @@
+# Generated by Django 6.0 on 2026-10-18 20:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_app', '0009_grade_student_date_id_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradeVersion',
+            fields=[
+                ('student', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='grade_version', serialize=False, to='school_app.student', verbose_name='Ученик')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Версия')),
+            ],
+            options={
+                'verbose_name': 'Версия оценок',
+                'verbose_name_plural': 'Версии оценок',
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-18 21:05
+
+from django.db import migrations
+
+
+# Индексы под поиск по началу слова в админке (StudentAdmin.get_search_results
+# ищет учеников и auth_user отдельными запросами и объединяет их UNION):
+# Django строит для istartswith условие UPPER("поле"::text) LIKE UPPER('...%'),
+# text_pattern_ops позволяет использовать для него B-tree при любой локали БД.
+INDEXES = {
+    'student_id_prefix_idx': ('school_app_student', 'student_id'),
+    'auth_user_last_name_prefix_idx': ('auth_user', 'last_name'),
+    'auth_user_first_name_prefix_idx': ('auth_user', 'first_name'),
+}
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, (table, column) in INDEXES.items():
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON {table} (UPPER({column}::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('school_app', '0010_gradeversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
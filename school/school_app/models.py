@@ -1,9 +1,30 @@
 import string
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, Sum, Min, Max, Q, F
 from django.contrib.auth.models import User
-import random, secrets
+import secrets
 from datetime import datetime
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils.crypto import constant_time_compare
+from .hashing import create_portal_user
+from .ids import id_allocator, student_id_format, parent_id_format, teacher_id_format
+
+
+def generate_portal_password():
+    return ''.join(secrets.choice(string.digits) for _ in range(6))
+
+
+class IdSequence(models.Model):
+    """Счетчик для выдачи ID портала, см. ids.py."""
+    name = models.CharField(max_length=30, primary_key=True, verbose_name='Последовательность')
+    next_value = models.PositiveIntegerField(default=0, verbose_name='Следующий номер')
+
+    def __str__(self):
+        return f'{self.name}: {self.next_value}'
+
+    class Meta:
+        verbose_name = 'Последовательность ID'
+        verbose_name_plural = 'Последовательности ID'
 
 
 class Subject(models.Model):
@@ -85,27 +106,17 @@ class Teacher(models.Model):
             username = f'{original_user_name}_{counter}'
             counter += 1
 
-        user= User.objects.create_user(
-                   username=username,
-                   password=self.password,
-                   first_name=first_name,
-                   last_name=last_name,
-                   is_active=True
-        )
+        user = create_portal_user(username, self.password, first_name, last_name)
 
         return user
 
     def generate_teacher_id(self):
 
-        while True:
-            number = str(random.randint(100000, 999999))
-            teacher_id = f't{number}'
-            if not Teacher.objects.filter(teacher_id=teacher_id).exists():
-                return teacher_id
+        return id_allocator.allocate(teacher_id_format())[0]
 
     def generate_password(self):
 
-        return ''.join(secrets.choice(string.digits) for _ in range(6))
+        return generate_portal_password()
 
     def __str__(self):
         if self.user:
@@ -169,13 +180,7 @@ class Student(models.Model):
             username = f"{original_username}{counter}"
             counter += 1
 
-        user = User.objects.create_user(
-            username=username,
-            password=self.password,
-            first_name=first_name,
-            last_name=last_name,
-            is_active=True
-        )
+        user = create_portal_user(username, self.password, first_name, last_name)
 
         self.user = user
         return user
@@ -183,15 +188,11 @@ class Student(models.Model):
     def generate_student_id(self):
 
         year = str(datetime.now().year)[2:]
-        while True:
-            number = str(random.randint(1000, 9999))
-            student_id = f"{year}{number}"
-            if not Student.objects.filter(student_id=student_id).exists():
-                return student_id
+        return id_allocator.allocate(student_id_format(year))[0]
 
     def generate_password(self):
 
-        return ''.join(secrets.choice(string.digits) for _ in range(6))
+        return generate_portal_password()
 
     def __str__(self):
         if self.user:
@@ -251,13 +252,7 @@ class Parent(models.Model):
             username = f"{original_username}{counter}"
             counter += 1
 
-        user = User.objects.create_user(
-            username=username,
-            password=self.password,
-            first_name=first_name,
-            last_name=last_name,
-            is_active=True
-        )
+        user = create_portal_user(username, self.password, first_name, last_name)
 
         self.user = user
         return user
@@ -265,15 +260,11 @@ class Parent(models.Model):
     def generate_parent_id(self):
 
         year = str(datetime.now().year)[2:]
-        while True:
-            number = str(random.randint(1000, 9999))
-            parent_id = f"P{number}{year}"
-            if not Parent.objects.filter(parent_id=parent_id).exists():
-                return parent_id
+        return id_allocator.allocate(parent_id_format(year))[0]
 
     def generate_password(self):
 
-        return ''.join(secrets.choice(string.digits) for _ in range(6))
+        return generate_portal_password()
 
     def __str__(self):
         if self.user:
@@ -285,6 +276,74 @@ class Parent(models.Model):
         verbose_name_plural = "Родители"
 
 
+class PortalCredential(models.Model):
+    """Единый справочник входа: ID портала -> роль и пользователь."""
+
+    TEACHER = 'teacher'
+    STUDENT = 'student'
+    PARENT = 'parent'
+    ROLE_CHOICES = [
+        (TEACHER, 'Учитель'),
+        (STUDENT, 'Ученик'),
+        (PARENT, 'Родитель'),
+    ]
+
+    portal_id = models.CharField(max_length=10, unique=True, verbose_name='ID для входа')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, verbose_name='Роль')
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                related_name='portal_credential',
+                                verbose_name='Пользователь'
+    )
+    password = models.CharField(max_length=6, verbose_name='Пароль для входа')
+
+    @property
+    def is_pending(self):
+        """Хеш пароля еще считается в фоне (см. hashing.create_portal_user)."""
+        return not self.user.has_usable_password()
+
+    @staticmethod
+    def role_for_portal_id(portal_id):
+        """Роль по формату ID: t123456 - учитель, P123426 - родитель, 261234 - ученик."""
+        if not portal_id:
+            return None
+        if portal_id[0] == 't':
+            return PortalCredential.TEACHER
+        if portal_id[0] == 'P':
+            return PortalCredential.PARENT
+        if portal_id.isdigit():
+            return PortalCredential.STUDENT
+        return None
+
+    @classmethod
+    def authenticate(cls, portal_id, password):
+        """Один индексированный запрос (с join пользователя) вместо перебора ролей."""
+        role = cls.role_for_portal_id(portal_id)
+        if role is None:
+            return None
+
+        credential = cls.objects.select_related('user').filter(portal_id=portal_id, role=role).first()
+        if credential is None or not constant_time_compare(credential.password, password):
+            return None
+        return credential
+
+    @classmethod
+    def sync(cls, portal_id, role, user, password):
+        if not (portal_id and user and password):
+            return
+        cls.objects.update_or_create(
+            portal_id=portal_id,
+            defaults={'role': role, 'user': user, 'password': password}
+        )
+
+    def __str__(self):
+        return f"{self.portal_id} ({self.get_role_display()})"
+
+    class Meta:
+        verbose_name = "Данные для входа"
+        verbose_name_plural = "Данные для входа"
+
+
 class Grade(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, verbose_name="Ученик")
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, verbose_name="Предмет")
@@ -299,4 +358,263 @@ class Grade(models.Model):
 
     class Meta:
         verbose_name = "Оценка"
-        verbose_name_plural = "Оценки"
\ No newline at end of file
+        verbose_name_plural = "Оценки"
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subject', 'date'], name='unique_grade_per_day'),
+        ]
+        indexes = [
+            # Дневники и история оценок: по убыванию (date, id) - постраничный вывод по ключу
+            models.Index(fields=['student', '-date', '-id'], include=['subject', 'grade'],
+                         name='grade_student_date_id_idx'),
+            # Оценки по предмету в разрезе учеников (отчеты, аналитика)
+            models.Index(fields=['subject', 'student'], include=['grade'], name='grade_subject_student_idx'),
+        ]
+
+def empty_histogram():
+    return [0] * 10
+
+
+class GradeAggregate(models.Model):
+    student = models.ForeignKey(Student,
+                                on_delete=models.CASCADE,
+                                related_name='grade_aggregates',
+                                verbose_name='Ученик'
+    )
+    subject = models.ForeignKey(Subject,
+                                on_delete=models.CASCADE,
+                                related_name='grade_aggregates',
+                                verbose_name='Предмет'
+    )
+    count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
+    total = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
+    min_grade = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Минимальная оценка')
+    max_grade = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Максимальная оценка')
+    last_date = models.DateField(null=True, blank=True, verbose_name='Дата последней оценки')
+    # histogram[i] - количество оценок i + 1 (шкала 1-10)
+    histogram = models.JSONField(default=empty_histogram, verbose_name='Распределение оценок')
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else 0
+
+    @classmethod
+    def add_grade(cls, student_id, subject_id, grade, grade_date):
+        cls._apply(student_id, subject_id, grade, grade_date, 1)
+        GradeVersion.bump([student_id])
+
+    @classmethod
+    def remove_grade(cls, student_id, subject_id, grade, grade_date):
+        cls._apply(student_id, subject_id, grade, grade_date, -1)
+        GradeVersion.bump([student_id])
+
+    @classmethod
+    def add_grades(cls, grades):
+        """Учитывает пачку новых оценок (после bulk_create, где сигналы не вызываются)."""
+        with transaction.atomic():
+            aggregates = {
+                (aggregate.student_id, aggregate.subject_id): aggregate
+                for aggregate in cls.objects.select_for_update().filter(
+                    student_id__in={grade.student_id for grade in grades},
+                    subject_id__in={grade.subject_id for grade in grades}
+                )
+            }
+            existing = list(aggregates.values())
+            created = []
+
+            for grade in grades:
+                key = (grade.student_id, grade.subject_id)
+                if key not in aggregates:
+                    aggregates[key] = cls(student_id=grade.student_id, subject_id=grade.subject_id)
+                    created.append(aggregates[key])
+                aggregates[key]._count_grade(grade.grade, 1)
+                if aggregates[key].last_date is None or grade.date > aggregates[key].last_date:
+                    aggregates[key].last_date = grade.date
+
+            cls.objects.bulk_create(created)
+            cls.objects.bulk_update(existing, ['count', 'total', 'min_grade', 'max_grade', 'last_date', 'histogram'])
+            GradeVersion.bump({grade.student_id for grade in grades})
+
+    @classmethod
+    def _apply(cls, student_id, subject_id, grade, grade_date, delta):
+        with transaction.atomic():
+            aggregates = cls.objects.select_for_update()
+            if delta > 0:
+                aggregate, _ = aggregates.get_or_create(student_id=student_id, subject_id=subject_id)
+            else:
+                aggregate = aggregates.filter(student_id=student_id, subject_id=subject_id).first()
+                if aggregate is None:
+                    return
+
+            aggregate._count_grade(grade, delta)
+            if aggregate.count <= 0:
+                aggregate.delete()
+                return
+
+            if delta > 0:
+                if aggregate.last_date is None or grade_date > aggregate.last_date:
+                    aggregate.last_date = grade_date
+            elif grade_date == aggregate.last_date:
+                aggregate.last_date = Grade.objects.filter(
+                    student_id=student_id,
+                    subject_id=subject_id
+                ).aggregate(last_date=Max('date'))['last_date']
+
+            aggregate.save()
+
+    def _count_grade(self, grade, delta):
+        self.count += delta
+        self.total += delta * grade
+
+        histogram = list(self.histogram)
+        histogram[grade - 1] += delta
+        self.histogram = histogram
+
+        present = [value for value, count in enumerate(histogram, start=1) if count > 0]
+        self.min_grade = present[0] if present else None
+        self.max_grade = present[-1] if present else None
+
+    @classmethod
+    def rebuild(cls):
+        """Пересчитывает всю таблицу по исходным оценкам."""
+        rows = Grade.objects.order_by().values('student_id', 'subject_id').annotate(
+            count=Count('id'),
+            total=Sum('grade'),
+            min_grade=Min('grade'),
+            max_grade=Max('grade'),
+            last_date=Max('date'),
+            **{f'grade_{value}': Count('id', filter=Q(grade=value)) for value in range(1, 11)}
+        )
+
+        aggregates = []
+        for row in rows:
+            histogram = [row.pop(f'grade_{value}') for value in range(1, 11)]
+            aggregates.append(cls(histogram=histogram, **row))
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(aggregates, batch_size=1000)
+
+        return len(aggregates)
+
+    @staticmethod
+    def summarize(aggregates):
+        """Общее количество, средняя и распределение оценок по набору предметов."""
+        total_count = 0
+        total_sum = 0
+        grade_stats = {value: 0 for value in range(1, 11)}
+
+        for aggregate in aggregates:
+            total_count += aggregate.count
+            total_sum += aggregate.total
+            for value, count in enumerate(aggregate.histogram, start=1):
+                grade_stats[value] += count
+
+        average = total_sum / total_count if total_count > 0 else 0
+        return total_count, average, grade_stats
+
+    def __str__(self):
+        return f"{self.student} - {self.subject}: {self.count}"
+
+    class Meta:
+        verbose_name = "Сводка оценок"
+        verbose_name_plural = "Сводки оценок"
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'subject'], name='unique_grade_aggregate'),
+        ]
+
+
+class GradeVersion(models.Model):
+    """Счетчик изменений оценок ученика - основа ETag для API дневников (api.py)."""
+    student = models.OneToOneField(Student,
+                                   on_delete=models.CASCADE,
+                                   primary_key=True,
+                                   related_name='grade_version',
+                                   verbose_name='Ученик'
+    )
+    version = models.PositiveBigIntegerField(default=0, verbose_name='Версия')
+
+    @classmethod
+    def bump(cls, student_ids):
+        """
+        Увеличивает версии учеников. Недостающие счетчики создаются после
+        коммита и только для учеников, которые еще есть: оценки удаляются и
+        каскадом вместе с учеником, и новый счетчик сослался бы на
+        удаляемую строку.
+        """
+        student_ids = set(student_ids)
+        updated = cls.objects.filter(student_id__in=student_ids).update(version=F('version') + 1)
+        if updated < len(student_ids):
+            transaction.on_commit(lambda: cls._create_missing(student_ids))
+
+    @classmethod
+    def _create_missing(cls, student_ids):
+        existing = Student.objects.filter(id__in=student_ids).values_list('id', flat=True)
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([cls(student_id=student_id) for student_id in existing],
+                                        ignore_conflicts=True)
+                # И для счетчиков, созданных параллельно: изменение видно только после этого коммита
+                cls.objects.filter(student_id__in=student_ids).update(version=F('version') + 1)
+        except IntegrityError:
+            # Ученика удалили между проверкой и вставкой
+            pass
+
+    def __str__(self):
+        return f'{self.student}: {self.version}'
+
+    class Meta:
+        verbose_name = 'Версия оценок'
+        verbose_name_plural = 'Версии оценок'
+
+
+class SchoolCalendar(models.Model):
+    """Учебный год: границы и нерабочие дни (см. school_calendar.py)."""
+    name = models.CharField(max_length=20, unique=True, verbose_name='Учебный год')
+    start_date = models.DateField(verbose_name='Начало учебного года')
+    end_date = models.DateField(verbose_name='Конец учебного года')
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Учебный календарь'
+        verbose_name_plural = 'Учебные календари'
+        ordering = ['start_date']
+        constraints = [
+            models.CheckConstraint(condition=Q(end_date__gte=F('start_date')),
+                                   name='school_calendar_dates_ordered'),
+        ]
+
+
+class Holiday(models.Model):
+    HOLIDAY = 'holiday'
+    VACATION = 'vacation'
+    WORKING_DAY = 'working_day'
+    KIND_CHOICES = [
+        (HOLIDAY, 'Праздник'),
+        (VACATION, 'Каникулы'),
+        # Перенос: суббота/воскресенье, которые объявлены учебными днями
+        (WORKING_DAY, 'Учебный выходной день'),
+    ]
+
+    calendar = models.ForeignKey(SchoolCalendar,
+                                 on_delete=models.CASCADE,
+                                 related_name='holidays',
+                                 verbose_name='Учебный год'
+    )
+    name = models.CharField(max_length=100, verbose_name='Название')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=HOLIDAY, verbose_name='Тип')
+    start_date = models.DateField(verbose_name='С')
+    end_date = models.DateField(verbose_name='По')
+
+    def __str__(self):
+        return f'{self.name} ({self.start_date:%d.%m.%Y} - {self.end_date:%d.%m.%Y})'
+
+    class Meta:
+        verbose_name = 'Нерабочий день'
+        verbose_name_plural = 'Нерабочие дни'
+        ordering = ['start_date']
+        constraints = [
+            models.CheckConstraint(condition=Q(end_date__gte=F('start_date')),
+                                   name='holiday_dates_ordered'),
+        ]
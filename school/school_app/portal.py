@@ -0,0 +1,168 @@
+"""
+Роль и профиль пользователя портала в запросе.
+
+Роль (учитель, ученик, родитель) и id профиля определяются одним запросом
+при входе (сигнал user_logged_in) и хранятся в сессии. Сессии, открытые
+до этого, дополняются при первом запросе. PortalProfileMiddleware
+вешает на запрос:
+- request.portal_role - роль из сессии или None (администратор без профиля);
+- request.portal_profile - ленивый профиль: загружается вместе с
+  пользователем при первом обращении; в асинхронных представлениях -
+  await request.aportal_profile().
+Проверка роли и редирект "не та роль" не обращаются к БД: для этого
+представления берут профиль через role_profile / arole_profile.
+can_view_student проверяет доступ к оценкам ученика по роли и id профиля
+из сессии, не загружая профиль.
+"""
+from functools import partial
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.utils.functional import SimpleLazyObject
+
+from .models import Parent, PortalCredential, Student, Teacher
+
+
+ROLE_SESSION_KEY = '_portal_role'
+PROFILE_SESSION_KEY = '_portal_profile_id'
+
+PROFILES = {
+    PortalCredential.TEACHER: (Teacher, 'teacher_profile', ['user']),
+    PortalCredential.STUDENT: (Student, 'student_profile', ['user', 'class_field']),
+    PortalCredential.PARENT: (Parent, 'parent_profile', ['user']),
+}
+
+
+def profile_lookup(user_id):
+    """Запрос (id ученика, родителя, учителя) пользователя - одна строка с LEFT JOIN профилей."""
+    return get_user_model().objects.filter(pk=user_id).values_list(
+        *[f'{related_name}__id' for _, related_name, _ in PROFILES.values()]
+    )
+
+
+def session_values(row):
+    """Значения сессии по строке profile_lookup; порядок ролей как в PROFILES."""
+    for role, profile_id in zip(PROFILES, row or ()):
+        if profile_id is not None:
+            return {ROLE_SESSION_KEY: role, PROFILE_SESSION_KEY: profile_id}
+    return {ROLE_SESSION_KEY: None, PROFILE_SESSION_KEY: None}
+
+
+def remember_portal_profile(session, user_id):
+    values = session_values(profile_lookup(user_id).first())
+    session.update(values)
+    return values[ROLE_SESSION_KEY], values[PROFILE_SESSION_KEY]
+
+
+async def aremember_portal_profile(session, user_id):
+    values = session_values(await profile_lookup(user_id).afirst())
+    await session.aupdate(values)
+    return values[ROLE_SESSION_KEY], values[PROFILE_SESSION_KEY]
+
+
+def portal_session(request):
+    """(роль, id профиля) пользователя сессии; без входа - (None, None)."""
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    if user_id is None:
+        return None, None
+    if ROLE_SESSION_KEY not in session:
+        return remember_portal_profile(session, user_id)
+    return session[ROLE_SESSION_KEY], session[PROFILE_SESSION_KEY]
+
+
+async def aportal_session(request):
+    session = request.session
+    user_id = await session.aget(SESSION_KEY)
+    if user_id is None:
+        return None, None
+    if not await session.ahas_key(ROLE_SESSION_KEY):
+        return await aremember_portal_profile(session, user_id)
+    return await session.aget(ROLE_SESSION_KEY), await session.aget(PROFILE_SESSION_KEY)
+
+
+def profile_queryset(request):
+    model, _, related = PROFILES[request.portal_role]
+    return model.objects.select_related(*related).filter(pk=request.portal_profile_id)
+
+
+def checked_profile(profile, user):
+    # Профиль должен принадлежать вошедшему пользователю, иначе его нет
+    if profile is None or profile.user_id != user.pk:
+        return None
+    return profile
+
+
+def get_portal_profile(request):
+    if not hasattr(request, '_cached_portal_profile'):
+        profile = None
+        if request.portal_role is not None:
+            profile = checked_profile(profile_queryset(request).first(), request.user)
+        request._cached_portal_profile = profile
+    return request._cached_portal_profile
+
+
+async def aget_portal_profile(request):
+    if not hasattr(request, '_cached_portal_profile'):
+        profile = None
+        if request.portal_role is not None:
+            profile = checked_profile(await profile_queryset(request).afirst(), await request.auser())
+        request._cached_portal_profile = profile
+    return request._cached_portal_profile
+
+
+def role_profile(request, role):
+    """Профиль пользователя, если его роль - role; иначе None без запросов к БД."""
+    if request.portal_role != role:
+        return None
+    return get_portal_profile(request)
+
+
+async def arole_profile(request, role):
+    if request.portal_role != role:
+        return None
+    return await aget_portal_profile(request)
+
+
+# Через какую связь ученика видит родитель и учитель
+STUDENT_VIEWERS = {
+    PortalCredential.PARENT: 'parent',
+    PortalCredential.TEACHER: 'class_field__teachers',
+}
+
+
+def can_view_student(request, student_id):
+    """Оценки ученика видят он сам, его родители и учителя его класса."""
+    role, profile_id = request.portal_role, request.portal_profile_id
+    if role == PortalCredential.STUDENT:
+        return profile_id == student_id
+    if role not in STUDENT_VIEWERS:
+        return False
+    return Student.objects.filter(id=student_id, **{STUDENT_VIEWERS[role]: profile_id}).exists()
+
+
+class PortalProfileMiddleware:
+    """Вешает на запрос роль и ленивый профиль; ставится после AuthenticationMiddleware."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.attach(request, *portal_session(request))
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        self.attach(request, *await aportal_session(request))
+        return await self.get_response(request)
+
+    def attach(self, request, role, profile_id):
+        request.portal_role = role
+        request.portal_profile_id = profile_id
+        request.portal_profile = SimpleLazyObject(partial(get_portal_profile, request))
+        request.aportal_profile = partial(aget_portal_profile, request)
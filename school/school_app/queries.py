@@ -0,0 +1,57 @@
+"""
+Чтение оценок для дневников: компактные строки вместо экземпляров Grade.
+
+Дневникам и API от оценки нужны id, ученик, предмет (id и название), балл
+и дата. Оценки читаются через values_list с названием предмета из JOIN и
+превращаются в GradeRow - именованный кортеж без состояния модели, поэтому
+нет ни конструирования Grade, ни отдельных экземпляров Subject/Student на
+каждую строку. Такие строки и хранятся в кеше дневников: они меньше в
+памяти и быстрее сериализуются (pickle).
+
+GradeRow объявлен на уровне модуля, а не через values_list(named=True):
+класс строки, созданный на лету, не проходит через pickle.
+"""
+from datetime import date
+from typing import NamedTuple
+
+from .models import Grade
+
+
+GRADE_ROW_FIELDS = ('id', 'student_id', 'subject_id', 'subject__name', 'grade', 'date')
+
+
+class SubjectRef(NamedTuple):
+    """Предмет строки оценки: то, что дневники выводят и по чему группируют."""
+    id: int
+    name: str
+
+
+class GradeRow(NamedTuple):
+    id: int
+    student_id: int
+    subject_id: int
+    subject_name: str
+    grade: int
+    date: date
+
+    @property
+    def subject(self):
+        return SubjectRef(self.subject_id, self.subject_name)
+
+
+def grade_values(grades):
+    """values_list с полями GradeRow; фильтры, порядок и срез - от grades."""
+    return grades.values_list(*GRADE_ROW_FIELDS)
+
+
+def grade_rows(grades):
+    return list(map(GradeRow._make, grade_values(grades)))
+
+
+async def agrade_rows(grades):
+    return [GradeRow._make(row) async for row in grade_values(grades)]
+
+
+def children_grades(children):
+    """Оценки детей (queryset учеников) от новых к старым - один запрос с подзапросом детей."""
+    return Grade.objects.filter(student__in=children).order_by('-date', '-id')
@@ -0,0 +1,182 @@
+"""
+Сводные ведомости (средние по каждому ученику и предмету) для всей школы
+или выбранных классов в CSV и XLSX.
+
+Средние считает БД (GROUP BY ученик, предмет), строки читаются через
+iterator(chunk_size=...) и сразу превращаются в строки файла, поэтому
+память не растет с размером школы: в ней одновременно только текущий
+ученик. Ученики и их средние читаются двумя запросами в одинаковом
+порядке и сливаются по ходу чтения, так что в ведомость попадают и
+ученики без оценок.
+
+Ведомость читает реплику БД, если она настроена (db_routing.read_alias):
+отставание на секунды для сводных средних не важно.
+
+Под ASGI Django собирает синхронный итератор ответа в память целиком,
+поэтому там ответ получает асинхронный итератор: строки по-прежнему
+читаются синхронно, пачками в потоке (sync_to_async).
+"""
+import csv
+import tempfile
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Q, Sum
+from django.http import FileResponse, StreamingHttpResponse
+
+from .db_routing import read_alias
+from .models import Grade, Student, Subject
+
+
+CHUNK_SIZE = 2000
+
+# Одинаковый порядок для учеников и для их средних - слияние за один проход
+STUDENT_ORDER = ['class_field__number_class', 'class_field__letter_class',
+                 'user__last_name', 'user__first_name', 'id']
+
+
+class ReportError(Exception):
+    """Ведомость не может быть выгружена (например, нет openpyxl для XLSX)."""
+
+
+class ReportCardExport:
+
+    def __init__(self, classes=None, date_from=None, date_to=None, chunk_size=CHUNK_SIZE, using=None):
+        self.classes = classes
+        self.date_from = date_from
+        self.date_to = date_to
+        self.chunk_size = chunk_size
+        self.using = using or read_alias()
+
+    def students(self):
+        students = Student.objects.using(self.using)
+        if self.classes is not None:
+            students = students.filter(class_field__in=self.classes)
+        return students
+
+    def subjects(self):
+        if self.classes is None:
+            return list(Subject.objects.using(self.using).order_by('name'))
+        return list(Subject.objects.using(self.using).filter(
+            Q(classes__in=self.classes) | Q(grade__student__class_field__in=self.classes)
+        ).distinct().order_by('name'))
+
+    def subject_totals(self):
+        """(id ученика, id предмета, количество, сумма) в порядке STUDENT_ORDER."""
+        grades = Grade.objects.using(self.using).filter(student__in=self.students())
+        if self.date_from:
+            grades = grades.filter(date__gte=self.date_from)
+        if self.date_to:
+            grades = grades.filter(date__lte=self.date_to)
+
+        return grades.order_by(
+            *[f'student__{field}' for field in STUDENT_ORDER]
+        ).values_list('student_id', 'subject_id').annotate(
+            count=Count('id'), total=Sum('grade')
+        ).iterator(chunk_size=self.chunk_size)
+
+    def header(self, subjects):
+        return ['Класс', 'ID ученика', 'Фамилия', 'Имя'] + [subject.name for subject in subjects] + ['Средний балл']
+
+    def rows(self):
+        """Генератор строк ведомости; первая строка - заголовок."""
+        subjects = self.subjects()
+        yield self.header(subjects)
+
+        students = self.students().order_by(*STUDENT_ORDER).values_list(
+            'id', 'student_id', 'user__last_name', 'user__first_name',
+            'class_field__number_class', 'class_field__letter_class'
+        ).iterator(chunk_size=self.chunk_size)
+        totals = self.subject_totals()
+        pending = next(totals, None)
+
+        for student_id, portal_id, last_name, first_name, number, letter in students:
+            by_subject = {}
+            while pending is not None and pending[0] == student_id:
+                by_subject[pending[1]] = pending[2:]
+                pending = next(totals, None)
+
+            averages = []
+            for subject in subjects:
+                count, total = by_subject.get(subject.id, (0, 0))
+                averages.append(round(total / count, 2) if count else '')
+
+            count = sum(count for count, _ in by_subject.values())
+            total = sum(total for _, total in by_subject.values())
+            class_name = f'{number}-{letter}' if number is not None else ''
+            yield ([class_name, portal_id or '', last_name or '', first_name or '']
+                   + averages + [round(total / count, 2) if count else ''])
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу отдает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, bom=True):
+    writer = csv.writer(Echo())
+    if bom:
+        # Чтобы Excel открыл UTF-8 с кириллицей
+        yield '\ufeff'
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, file):
+    """Пишет строки в XLSX в режиме write_only (строки не копятся в памяти)."""
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ReportError('Для выгрузки XLSX установите пакет openpyxl')
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Ведомость')
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
+
+
+def xlsx_file(rows):
+    """Временный файл с XLSX, открытый на чтение с начала."""
+    file = tempfile.TemporaryFile()
+    write_xlsx(rows, file)
+    file.seek(0)
+    return file
+
+
+FORMATS = ('csv', 'xlsx')
+
+# Сколько кусков ответа читается в потоке за один переход из асинхронного кода
+ASYNC_BATCH = 100
+
+
+async def aiter_in_thread(chunks, batch_size=ASYNC_BATCH):
+    """Асинхронный итератор по синхронному: куски читаются пачками в потоке."""
+    chunks = iter(chunks)
+    next_batch = sync_to_async(lambda: list(islice(chunks, batch_size)))
+    while batch := await next_batch():
+        for chunk in batch:
+            yield chunk
+
+
+def response_chunks(request, chunks):
+    if isinstance(request, ASGIRequest):
+        return aiter_in_thread(chunks)
+    return chunks
+
+
+def report_response(request, export, file_format, filename='report_cards'):
+    if file_format == 'xlsx':
+        file = xlsx_file(export.rows())
+        response = FileResponse(file, as_attachment=True, filename=f'{filename}.xlsx')
+        if isinstance(request, ASGIRequest):
+            response.streaming_content = aiter_in_thread(iter(lambda: file.read(response.block_size), b''))
+        return response
+
+    response = StreamingHttpResponse(response_chunks(request, csv_chunks(export.rows())),
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
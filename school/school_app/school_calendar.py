@@ -0,0 +1,111 @@
+"""
+Учебный календарь: проверка "учебный ли это день" без запросов к БД.
+
+Все учебные годы (SchoolCalendar с праздниками и каникулами) загружаются
+в память процесса одним проходом и разворачиваются в массив кодов дней,
+где индекс - номер дня от начала самого раннего учебного года. Проверка
+даты - одно обращение по индексу.
+
+Сохранение или удаление календаря/праздника сбрасывает загруженные данные
+в текущем процессе (сигналы в signals.py); другие процессы перечитывают
+календарь не реже раза в RELOAD_SECONDS секунд.
+
+Даты вне учебных годов (в том числе лето между ними) проверяются только
+на выходные.
+"""
+import threading
+import time
+from datetime import date
+
+from .models import SchoolCalendar, Holiday
+
+
+RELOAD_SECONDS = 5 * 60
+
+# Коды дней
+SCHOOL_DAY = 0
+WEEKEND = 1
+HOLIDAY = 2
+VACATION = 3
+
+HOLIDAY_CODES = {
+    Holiday.HOLIDAY: HOLIDAY,
+    Holiday.VACATION: VACATION,
+    Holiday.WORKING_DAY: SCHOOL_DAY,
+}
+
+
+def weekend_code(day):
+    return WEEKEND if day.weekday() in (5, 6) else SCHOOL_DAY
+
+
+class CalendarDays:
+    """Коды всех дней от начала первого до конца последнего учебного года."""
+
+    def __init__(self, calendars):
+        calendars = list(calendars)
+        if not calendars:
+            self.first, self.codes = 0, bytearray()
+            return
+
+        self.first = min(calendar.start_date for calendar in calendars).toordinal()
+        last = max(calendar.end_date for calendar in calendars).toordinal()
+        self.codes = bytearray(
+            weekend_code(date.fromordinal(ordinal)) for ordinal in range(self.first, last + 1)
+        )
+
+        # Каникулы и праздники раньше переносов: перенос отменяет выходной
+        holidays = sorted(
+            (holiday for calendar in calendars for holiday in calendar.holidays.all()),
+            key=lambda holiday: holiday.kind == Holiday.WORKING_DAY
+        )
+        for holiday in holidays:
+            start = max(holiday.start_date.toordinal(), self.first)
+            end = min(holiday.end_date.toordinal(), last)
+            for ordinal in range(start, end + 1):
+                self.codes[ordinal - self.first] = HOLIDAY_CODES[holiday.kind]
+
+    def code(self, day):
+        index = day.toordinal() - self.first
+        if 0 <= index < len(self.codes):
+            return self.codes[index]
+        return weekend_code(day)
+
+
+class CalendarService:
+
+    def __init__(self, reload_seconds=RELOAD_SECONDS, clock=time.monotonic):
+        self.reload_seconds = reload_seconds
+        self.clock = clock
+        self._days = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def days(self):
+        with self._lock:
+            if self._days is None or self.clock() - self._loaded_at > self.reload_seconds:
+                self._days = CalendarDays(SchoolCalendar.objects.prefetch_related('holidays'))
+                self._loaded_at = self.clock()
+            return self._days
+
+    def invalidate(self):
+        with self._lock:
+            self._days = None
+
+    def day_code(self, day):
+        return self.days().code(day)
+
+    def is_school_day(self, day):
+        return self.day_code(day) == SCHOOL_DAY
+
+    def day_codes(self, days):
+        """Коды для множества дат за один вызов: {дата: код}."""
+        calendar_days = self.days()
+        return {day: calendar_days.code(day) for day in days}
+
+    def non_school_days(self, days):
+        """Нерабочие даты из переданных: {дата: код}."""
+        return {day: code for day, code in self.day_codes(days).items() if code != SCHOOL_DAY}
+
+
+calendar_service = CalendarService()
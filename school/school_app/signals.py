@@ -0,0 +1,167 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from .analytics import invalidate_analytics
+from .dashboard_cache import invalidate_students, invalidate_parents
+from .grants import invalidate_teachers, invalidate_subjects
+from .portal import remember_portal_profile
+from .models import (Teacher, Student, Parent, Subject, Grade, GradeAggregate, PortalCredential,
+                     SchoolCalendar, Holiday)
+from .school_calendar import calendar_service
+
+
+def _grade_key(grade):
+    # В обработчики может прийти необработанное значение из формы (строки)
+    grade_value = Grade._meta.get_field('grade').to_python(grade.grade)
+    grade_date = Grade._meta.get_field('date').to_python(grade.date)
+    return grade.student_id, grade.subject_id, grade_value, grade_date
+
+
+@receiver(pre_save, sender=Grade)
+def remember_previous_grade(sender, instance, raw=False, **kwargs):
+    instance._previous_key = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+
+    previous = Grade.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._previous_key = _grade_key(previous)
+
+
+@receiver(post_save, sender=Grade)
+def update_aggregate_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    key = _grade_key(instance)
+    previous_key = getattr(instance, '_previous_key', None)
+
+    if not created and previous_key is not None:
+        if previous_key == key:
+            return
+        GradeAggregate.remove_grade(*previous_key)
+        _grades_changed(previous_key[:2])
+
+    GradeAggregate.add_grade(*key)
+    _grades_changed(key[:2])
+
+
+@receiver(post_delete, sender=Grade)
+def update_aggregate_on_delete(sender, instance, **kwargs):
+    key = _grade_key(instance)
+    GradeAggregate.remove_grade(*key)
+    _grades_changed(key[:2])
+
+
+def _grades_changed(student_subject):
+    """Сбрасывает кеши, зависящие от оценок ученика по предмету: дневники и аналитику."""
+    def invalidate():
+        invalidate_students([student_subject[0]])
+        invalidate_analytics([student_subject])
+    # После коммита: иначе параллельный запрос может закешировать старые данные
+    transaction.on_commit(invalidate)
+
+
+def _invalidate_student_dashboards(*student_ids):
+    transaction.on_commit(lambda: invalidate_students(student_ids))
+
+
+@receiver(post_save, sender=Student)
+def invalidate_student_dashboard(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _invalidate_student_dashboards(instance.id)
+
+
+@receiver(pre_delete, sender=Student)
+def invalidate_parents_of_deleted_student(sender, instance, **kwargs):
+    # Связи с родителями удаляются каскадом без m2m_changed, а после коммита
+    # их уже не найти - родители собираются до удаления
+    parent_ids = list(instance.parent_set.values_list('id', flat=True))
+    if parent_ids:
+        transaction.on_commit(lambda: invalidate_parents(parent_ids))
+
+
+def _m2m_owner_ids(instance, action, reverse, pk_set, related_name):
+    """
+    ID объектов со стороны поля ManyToMany, у которых изменились связи,
+    или None для неинтересных действий. Для reverse clear pk_set не
+    передается, а после очистки связей их уже не найти - поэтому ID
+    собираются на pre_clear через обратный менеджер related_name.
+    """
+    if reverse and action == 'pre_clear':
+        return list(getattr(instance, related_name).values_list('id', flat=True))
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        return list(pk_set or ()) if reverse else [instance.pk]
+    return None
+
+
+@receiver(m2m_changed, sender=Parent.students.through)
+def invalidate_parent_dashboards(sender, instance, action, reverse, pk_set, **kwargs):
+    parent_ids = _m2m_owner_ids(instance, action, reverse, pk_set, 'parent_set')
+    if parent_ids is not None:
+        transaction.on_commit(lambda: invalidate_parents(parent_ids))
+
+
+def _invalidate_grants(invalidate, ids):
+    # Сразу - для текущей транзакции, и после коммита - на случай, если
+    # параллельный запрос успел закешировать права по старым данным
+    invalidate(ids)
+    transaction.on_commit(lambda: invalidate(ids))
+
+
+@receiver(m2m_changed, sender=Teacher.subjects.through)
+@receiver(m2m_changed, sender=Teacher.classes.through)
+def invalidate_teacher_grants(sender, instance, action, reverse, pk_set, **kwargs):
+    teacher_ids = _m2m_owner_ids(instance, action, reverse, pk_set, 'teachers')
+    if teacher_ids is not None:
+        _invalidate_grants(invalidate_teachers, teacher_ids)
+
+
+@receiver(m2m_changed, sender=Subject.classes.through)
+def invalidate_subject_grants(sender, instance, action, reverse, pk_set, **kwargs):
+    subject_ids = _m2m_owner_ids(instance, action, reverse, pk_set, 'subjects')
+    if subject_ids is not None:
+        _invalidate_grants(invalidate_subjects, subject_ids)
+
+
+@receiver(post_save, sender=SchoolCalendar)
+@receiver(post_delete, sender=SchoolCalendar)
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def invalidate_calendar(sender, **kwargs):
+    calendar_service.invalidate()
+    transaction.on_commit(calendar_service.invalidate)
+
+
+@receiver(user_logged_in)
+def remember_profile_on_login(sender, request, user, **kwargs):
+    # Роль и профиль - в сессию, чтобы запросы не искали профиль заново
+    if request is not None and hasattr(request, 'session'):
+        remember_portal_profile(request.session, user.pk)
+
+
+# Модель профиля -> (поле с ID портала, роль)
+PROFILE_ROLES = {
+    Teacher: ('teacher_id', PortalCredential.TEACHER),
+    Student: ('student_id', PortalCredential.STUDENT),
+    Parent: ('parent_id', PortalCredential.PARENT),
+}
+
+
+@receiver(post_save, sender=Teacher)
+@receiver(post_save, sender=Student)
+@receiver(post_save, sender=Parent)
+def sync_credential(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    id_field, role = PROFILE_ROLES[sender]
+    PortalCredential.sync(getattr(instance, id_field), role, instance.user, instance.password)
+
+
+@receiver(post_delete, sender=Teacher)
+@receiver(post_delete, sender=Student)
+@receiver(post_delete, sender=Parent)
+def delete_credential(sender, instance, **kwargs):
+    id_field, _ = PROFILE_ROLES[sender]
+    PortalCredential.objects.filter(portal_id=getattr(instance, id_field)).delete()
@@ -0,0 +1,231 @@
+"""
+Синтетическая школа для разработки и бенчмарков.
+
+Классы, предметы, учителя, ученики, родители и оценки за заданное число
+учебных недель создаются через bulk_create пачками, без save() моделей:
+ID портала выделяются блоком на всю роль, пароль у всех учетных записей
+один и хешируется один раз. Сводки оценок (GradeAggregate) строятся одним
+пересчетом в конце. Генератор детерминирован при одинаковом seed.
+
+Оценки ставятся только в учебные дни (school_calendar): по каждому
+предмету grades_per_week оценок в неделю каждому ученику.
+"""
+import random
+from datetime import date, timedelta
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .ids import id_allocator, parent_id_format, student_id_format, teacher_id_format
+from .importers import current_year
+from .models import Grade, GradeAggregate, Parent, PortalCredential, SchoolClass, Student, Subject, Teacher
+from .school_calendar import calendar_service
+
+
+SUBJECT_NAMES = [
+    'Математика', 'Русский язык', 'Белорусский язык', 'Русская литература', 'Английский язык',
+    'История', 'География', 'Биология', 'Физика', 'Химия', 'Информатика', 'Физкультура',
+    'Музыка', 'Трудовое обучение',
+]
+FIRST_NAMES = ['Анна', 'Мария', 'Дарья', 'Елена', 'Ольга', 'Алиса', 'Полина', 'Софья',
+               'Иван', 'Максим', 'Артем', 'Никита', 'Егор', 'Кирилл', 'Дмитрий', 'Павел']
+LAST_NAMES = ['Иванов', 'Петров', 'Сидоров', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Соколов',
+              'Лебедев', 'Кузнецов', 'Попов', 'Васильев', 'Зайцев', 'Ковалев', 'Романов', 'Орлов']
+CLASS_LETTERS = 'АБВГДЕ'
+
+# Готовые размеры для seed_school --size и бенчмарков
+SIZES = {
+    'small': {'classes': 4, 'students_per_class': 10, 'subjects': 5, 'teachers': 4, 'parents': 30, 'weeks': 6},
+    'medium': {'classes': 22, 'students_per_class': 25, 'subjects': 12, 'teachers': 30, 'parents': 450,
+               'weeks': 34},
+    'large': {'classes': 44, 'students_per_class': 30, 'subjects': 14, 'teachers': 60, 'parents': 1100,
+              'weeks': 34},
+}
+
+DEFAULT_PASSWORD = '000000'
+BATCH_SIZE = 5000
+
+
+def batched(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class SyntheticSchool:
+
+    def __init__(self, classes=22, students_per_class=25, subjects=12, teachers=30, parents=None,
+                 weeks=34, grades_per_week=1, start=date(2025, 9, 1), password=DEFAULT_PASSWORD,
+                 seed=0, batch_size=BATCH_SIZE, on_progress=None):
+        if classes > 11 * len(CLASS_LETTERS):
+            raise ValueError(f'Не больше {11 * len(CLASS_LETTERS)} классов')
+        self.classes = classes
+        self.students_per_class = students_per_class
+        self.subjects = subjects
+        self.teachers = max(1, teachers)
+        self.parents = parents if parents is not None else classes * students_per_class * 4 // 5
+        self.weeks = weeks
+        self.grades_per_week = grades_per_week
+        self.start = start - timedelta(days=start.weekday())
+        self.password = password
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.random = random.Random(seed)
+
+    def progress(self, message):
+        if self.on_progress:
+            self.on_progress(message)
+
+    def run(self):
+        """Создает школу в одной транзакции; возвращает {что: сколько создано}."""
+        self.password_hash = make_password(self.password)
+
+        with transaction.atomic():
+            classes = self.create_classes()
+            subjects = self.create_subjects(classes)
+            teachers = self.create_teachers(classes, subjects)
+            students = self.create_students(classes)
+            parents = self.create_parents(students)
+            grades = self.create_grades(students, subjects)
+            GradeAggregate.rebuild()
+
+        return {
+            'classes': len(classes),
+            'subjects': len(subjects),
+            'teachers': len(teachers),
+            'students': len(students),
+            'parents': len(parents),
+            'grades': grades,
+        }
+
+    def create_classes(self):
+        classes = SchoolClass.objects.bulk_create([
+            SchoolClass(number_class=i % 11 + 1, letter_class=CLASS_LETTERS[i // 11])
+            for i in range(self.classes)
+        ])
+        self.progress(f'Классов: {len(classes)}')
+        return classes
+
+    def create_subjects(self, classes):
+        names = SUBJECT_NAMES[:self.subjects] + [
+            f'Предмет {i}' for i in range(len(SUBJECT_NAMES) + 1, self.subjects + 1)
+        ]
+        subjects = Subject.objects.bulk_create([Subject(name=name) for name in names])
+        # Все классы изучают все предметы
+        Subject.classes.through.objects.bulk_create([
+            Subject.classes.through(subject_id=subject.id, schoolclass_id=school_class.id)
+            for subject in subjects for school_class in classes
+        ], batch_size=self.batch_size)
+        self.progress(f'Предметов: {len(subjects)}')
+        return subjects
+
+    def random_name(self):
+        return self.random.choice(FIRST_NAMES), self.random.choice(LAST_NAMES)
+
+    def create_people(self, model, id_field, id_format, role, username_prefix, names, **fields):
+        """Пользователи, профили и данные для входа для одной роли; fields - списки значений полей профиля."""
+        portal_ids = id_allocator.allocate(id_format, count=len(names))
+        users = User.objects.bulk_create([
+            User(username=f'{username_prefix}_{portal_id}', password=self.password_hash, is_active=True,
+                 first_name=first_name, last_name=last_name)
+            for portal_id, (first_name, last_name) in zip(portal_ids, names)
+        ], batch_size=self.batch_size)
+        profiles = model.objects.bulk_create([
+            model(user=user, password=self.password, **{id_field: portal_id},
+                  **{field: values[i] for field, values in fields.items()})
+            for i, (user, portal_id) in enumerate(zip(users, portal_ids))
+        ], batch_size=self.batch_size)
+        PortalCredential.objects.bulk_create([
+            PortalCredential(portal_id=portal_id, role=role, user=user, password=self.password)
+            for portal_id, user in zip(portal_ids, users)
+        ], batch_size=self.batch_size)
+        return profiles
+
+    def create_teachers(self, classes, subjects):
+        teachers = self.create_people(
+            Teacher, 'teacher_id', teacher_id_format(), PortalCredential.TEACHER, 'teacher',
+            [self.random_name() for _ in range(self.teachers)]
+        )
+
+        # Предмет s ведут учителя s, s + len(subjects), ...; если учителей меньше - учитель ведет несколько
+        subject_teachers = {
+            subject.id: [teacher for i, teacher in enumerate(teachers) if i % len(subjects) == s]
+            or [teachers[s % len(teachers)]]
+            for s, subject in enumerate(subjects)
+        }
+        teacher_subjects = set()
+        teacher_classes = set()
+        for c, school_class in enumerate(classes):
+            for subject in subjects:
+                candidates = subject_teachers[subject.id]
+                teacher = candidates[c % len(candidates)]
+                teacher_subjects.add((teacher.id, subject.id))
+                teacher_classes.add((teacher.id, school_class.id))
+
+        Teacher.subjects.through.objects.bulk_create([
+            Teacher.subjects.through(teacher_id=teacher_id, subject_id=subject_id)
+            for teacher_id, subject_id in sorted(teacher_subjects)
+        ], batch_size=self.batch_size)
+        Teacher.classes.through.objects.bulk_create([
+            Teacher.classes.through(teacher_id=teacher_id, schoolclass_id=class_id)
+            for teacher_id, class_id in sorted(teacher_classes)
+        ], batch_size=self.batch_size)
+        self.progress(f'Учителей: {len(teachers)}')
+        return teachers
+
+    def create_students(self, classes):
+        class_fields = [school_class for school_class in classes for _ in range(self.students_per_class)]
+        students = self.create_people(
+            Student, 'student_id', student_id_format(current_year()), PortalCredential.STUDENT, 'student',
+            [self.random_name() for _ in class_fields], class_field=class_fields
+        )
+        self.progress(f'Учеников: {len(students)}')
+        return students
+
+    def create_parents(self, students):
+        if not self.parents or not students:
+            return []
+
+        # Ученик i - ребенок родителя i % parents: часть родителей получает нескольких детей
+        children = [students[i::self.parents] for i in range(min(self.parents, len(students)))]
+        names = [(self.random.choice(FIRST_NAMES), kids[0].user.last_name) for kids in children]
+        parents = self.create_people(
+            Parent, 'parent_id', parent_id_format(current_year()), PortalCredential.PARENT, 'parent', names
+        )
+        Parent.students.through.objects.bulk_create([
+            Parent.students.through(parent_id=parent.id, student_id=student.id)
+            for parent, kids in zip(parents, children)
+            for student in kids
+        ], batch_size=self.batch_size)
+        self.progress(f'Родителей: {len(parents)}')
+        return parents
+
+    def school_weeks(self):
+        """Списки учебных дней по неделям начиная с self.start."""
+        for week in range(self.weeks):
+            monday = self.start + timedelta(weeks=week)
+            days = [monday + timedelta(days=i) for i in range(7)]
+            days = [day for day in days if calendar_service.is_school_day(day)]
+            if days:
+                yield days
+
+    def generate_grades(self, students, subjects):
+        weeks = list(self.school_weeks())
+        for student in students:
+            # Уровень ученика: у каждого свой средний балл
+            level = self.random.uniform(4, 9)
+            for subject in subjects:
+                for days in weeks:
+                    for day in self.random.sample(days, min(self.grades_per_week, len(days))):
+                        grade = min(10, max(1, round(self.random.gauss(level, 1.5))))
+                        yield Grade(student_id=student.id, subject_id=subject.id, grade=grade, date=day)
+
+    def create_grades(self, students, subjects):
+        created = 0
+        for batch in batched(self.generate_grades(students, subjects), self.batch_size):
+            Grade.objects.bulk_create(batch)
+            created += len(batch)
+            self.progress(f'Оценок: {created}')
+        return created
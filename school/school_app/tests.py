@@ -1,3 +1,2019 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .analytics import class_subject_stats, compute_class_subject_stats
+from .benchmarks import BenchmarkSuite, QueryCounter, compare, compare_servers, run_size
+from .dashboard_cache import (dashboard_cache_stats, get_or_build, invalidate_students, primary_key,
+                              reset_dashboard_cache_stats, student_key)
+from .db_routing import PrimaryReplicaRouter, read_alias, replica_alias, replica_reads
+from .metrics import collect, prometheus_text, registry
+from .reports import ReportCardExport, csv_chunks
+from .synthetic import SIZES, SyntheticSchool
+from .school_calendar import HOLIDAY, SCHOOL_DAY, VACATION, WEEKEND, calendar_service
+from .grade_history import PAGE_SIZE, decode_cursor, grade_page, history_queryset, student_history
+from .forms import GradeHistoryForm
+from .grading import non_working_day_error
+from .portal import PROFILE_SESSION_KEY, ROLE_SESSION_KEY
+from .grants import FORBIDDEN, NOT_TAUGHT, get_grants
+from .queries import GradeRow, SubjectRef, children_grades, grade_rows, grade_values
+from .importers import ParentImporter, StudentImporter, TeacherImporter, read_rows
+from .ids import IdAllocator, IdFormat, IdSpaceExhausted, student_id_format
+from .throttling import CacheBucketBackend, LoginThrottle, get_login_throttle
+from .views import build_parent_dashboard
+from .models import (Teacher, Student, Subject, SchoolClass, Grade, Parent, GradeAggregate, GradeVersion,
+                     PortalCredential, SchoolCalendar, Holiday)
+
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+# Быстрые хеши и синхронное хеширование: в TestCase коммитов (и on_commit) нет
+fast_accounts = override_settings(PASSWORD_HASHERS=FAST_HASHERS, PORTAL_DEFERRED_HASHING=False)
+RUN_BENCHMARKS = bool(os.environ.get('SCHOOL_BENCHMARK'))
+
+
+def report_benchmark(name, **metrics):
+    values = ', '.join(f'{key}={value:.4g}' if isinstance(value, float) else f'{key}={value}'
+                       for key, value in metrics.items())
+    print(f'\n[benchmark] {name}: {values}')
+
+
+def make_student(school_class, first_name='Иван', last_name='Иванов'):
+    student = Student.objects.create(class_field=school_class)
+    student.user.first_name = first_name
+    student.user.last_name = last_name
+    student.user.save()
+    return student
+
+
+def make_teacher(subjects, classes):
+    teacher = Teacher.objects.create()
+    teacher.user = teacher.create_user('Мария', 'Петрова')
+    teacher.save()
+    teacher.subjects.set(subjects)
+    teacher.classes.set(classes)
+    return teacher
+
+
+def make_parent(children):
+    parent = Parent.objects.create()
+    parent.students.set(children)
+    return parent
+
+
+@fast_accounts
+class ParentDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+
+    def seed(self, children_count, subjects_count):
+        subjects = [Subject.objects.create(name=f'Предмет {i}') for i in range(subjects_count)]
+        children = [make_student(self.school_class, last_name=f'Ученик {i}') for i in range(children_count)]
+        for child in children:
+            for i, subject in enumerate(subjects):
+                Grade.objects.create(student=child, subject=subject, grade=i % 10 + 1, date=date(2025, 10, 1))
+                Grade.objects.create(student=child, subject=subject, grade=10, date=date(2025, 10, 2))
+        return make_parent(children)
+
+    def count_dashboard_queries(self, parent):
+        self.client.force_login(parent.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('parent_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_query_count_does_not_grow_with_children_or_subjects(self):
+        small, _ = self.count_dashboard_queries(self.seed(1, 1))
+        large, _ = self.count_dashboard_queries(self.seed(4, 6))
+        self.assertEqual(small, large)
+
+    def test_subjects_grouped_with_averages(self):
+        parent = self.seed(2, 3)
+        _, response = self.count_dashboard_queries(parent)
+
+        children_with_grades = response.context['children_with_grades']
+        self.assertEqual(len(children_with_grades), 2)
+        for child_data in children_with_grades:
+            self.assertEqual(len(child_data['grades']), 6)
+            self.assertEqual([s['subject'].name for s in child_data['subjects_data']],
+                             ['Предмет 0', 'Предмет 1', 'Предмет 2'])
+            self.assertEqual([s['average'] for s in child_data['subjects_data']], [5.5, 6, 6.5])
+
+    def test_grades_prepared_for_template(self):
+        _, response = self.count_dashboard_queries(self.seed(1, 2))
+
+        subjects_data = response.context['children_with_grades'][0]['subjects_data']
+        # Оценки предмета - от старых к новым, даты уже отформатированы
+        self.assertEqual([s['badges'] for s in subjects_data],
+                         [[(1, '01.10.2025'), (10, '02.10.2025')], [(2, '01.10.2025'), (10, '02.10.2025')]])
+        self.assertEqual([s['average_class'] for s in subjects_data], ['bg-info', 'bg-info'])
+        self.assertContains(response, 'title="02.10.2025" data-grade="10"', count=2)
+        self.assertContains(response, '5.50')
+
+
+@fast_accounts
+class DashboardCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_dashboard_cache_stats()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.student = make_student(self.school_class)
+        self.parent = make_parent([self.student])
+        Grade.objects.create(student=self.student, subject=self.subject, grade=7, date=date(2025, 10, 1))
+
+    def get_dashboard(self, user, name):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        grade_queries = [query['sql'] for query in ctx.captured_queries
+                         if 'school_app_grade' in query['sql']]
+        return response, grade_queries
+
+    def test_cached_dashboards_do_not_query_grades(self):
+        for user, name in ((self.student.user, 'student_dashboard'), (self.parent.user, 'parent_dashboard')):
+            _, first = self.get_dashboard(user, name)
+            response, second = self.get_dashboard(user, name)
+            self.assertTrue(first)
+            self.assertEqual(second, [])
+
+        self.assertEqual(response.context['children_with_grades'][0]['grades'][0].grade, 7)
+        self.assertEqual(dashboard_cache_stats(), {'hits': 2, 'misses': 2})
+
+    def test_new_grade_invalidates_student_and_parents(self):
+        self.get_dashboard(self.student.user, 'student_dashboard')
+        self.get_dashboard(self.parent.user, 'parent_dashboard')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.create(student=self.student, subject=self.subject, grade=9, date=date(2025, 10, 2))
+
+        response, queries = self.get_dashboard(self.student.user, 'student_dashboard')
+        self.assertTrue(queries)
+        self.assertEqual(response.context['total_grades_count'], 2)
+        response, queries = self.get_dashboard(self.parent.user, 'parent_dashboard')
+        self.assertEqual(len(response.context['children_with_grades'][0]['grades']), 2)
+
+    def test_grade_sheet_invalidates_dashboard(self):
+        self.subject.classes.add(self.school_class)
+        teacher = make_teacher([self.subject], [self.school_class])
+        self.get_dashboard(self.student.user, 'student_dashboard')
+
+        self.client.force_login(teacher.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('grade_sheet'), {
+                'class': self.school_class.id, 'subject': self.subject.id,
+                'date': '2025-10-06', f'grade_{self.student.id}': 10,
+            })
+
+        response, _ = self.get_dashboard(self.student.user, 'student_dashboard')
+        self.assertEqual(response.context['total_grades_count'], 2)
+
+    def test_children_change_invalidates_parent(self):
+        self.get_dashboard(self.parent.user, 'parent_dashboard')
+        other = make_student(self.school_class, last_name='Петров')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.parent_set.add(self.parent)
+        response, _ = self.get_dashboard(self.parent.user, 'parent_dashboard')
+        self.assertEqual(len(response.context['children']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.parent_set.clear()
+        response, _ = self.get_dashboard(self.parent.user, 'parent_dashboard')
+        self.assertEqual(len(response.context['children']), 1)
+
+    def test_deleted_child_invalidates_parent(self):
+        other = make_student(self.school_class, last_name='Петров')
+        self.parent.students.add(other)
+        self.get_dashboard(self.parent.user, 'parent_dashboard')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        response, _ = self.get_dashboard(self.parent.user, 'parent_dashboard')
+        self.assertEqual(len(response.context['children']), 1)
+
+    def test_build_racing_invalidation_not_served(self):
+        key = student_key(self.student.id)
+
+        def stale_build():
+            # Изменения закоммичены и кеш сброшен, пока собирались старые данные
+            invalidate_students([self.student.id])
+            return 'stale'
+
+        self.assertEqual(get_or_build(key, stale_build), 'stale')
+        self.assertEqual(get_or_build(key, lambda: 'fresh'), 'fresh')
+        self.assertEqual(get_or_build(key, lambda: 'rebuilt'), 'fresh')
+
+
+@fast_accounts
+class GradeHistoryTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subjects = [Subject.objects.create(name=name) for name in ('Физика', 'Алгебра')]
+        self.student = make_student(self.school_class)
+        self.client.force_login(self.student.user)
+
+    def add_grades(self, days, start=date(2025, 9, 1)):
+        grades = [
+            Grade(student=self.student, subject=subject, grade=day % 10 + 1, date=start + timedelta(days=day))
+            for day in range(days) for subject in self.subjects
+        ]
+        Grade.objects.bulk_create(grades)
+        GradeAggregate.add_grades(grades)
+
+    def test_pages_cover_history_once(self):
+        self.add_grades(30)
+        seen = []
+        after = None
+        while True:
+            page, cursor = grade_page(self.student, after=after, page_size=7)
+            seen += [grade.id for grade in page]
+            if cursor is None:
+                break
+            after = decode_cursor(cursor)
+
+        expected = list(Grade.objects.filter(student=self.student).order_by('-date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_page_rows_are_compact(self):
+        self.add_grades(2)
+        with CaptureQueriesContext(connection) as ctx:
+            page, _ = grade_page(self.student)
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        algebra = self.subjects[1]
+        self.assertEqual(page[0], GradeRow(page[0].id, self.student.id, algebra.id, 'Алгебра', 2, date(2025, 9, 2)))
+        self.assertEqual(page[0].subject, SubjectRef(algebra.id, 'Алгебра'))
+        # Строки уходят в кеш дневников
+        self.assertEqual(pickle.loads(pickle.dumps(page)), page)
+
+    def test_page_cost_does_not_grow_with_history(self):
+        def count_queries(**params):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse('student_grades_view', args=[self.student.id]), params)
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries), response
+
+        self.add_grades(10)
+        small, _ = count_queries()
+        self.add_grades(200, start=date(2024, 1, 1))
+        large, response = count_queries()
+        paged, _ = count_queries(after=response.context['next_cursor'])
+
+        self.assertEqual(small, large)
+        self.assertEqual(large, paged)
+        self.assertEqual(response.context['total_grades_count'], 420)
+        self.assertEqual(sum(len(data['grades']) for data in response.context['subjects_grades_data']), PAGE_SIZE)
+
+    def test_period_summary(self):
+        self.add_grades(10)
+        response = self.client.get(reverse('student_grades_view', args=[self.student.id]),
+                                   {'date_from': '2025-09-03', 'date_to': '2025-09-04'})
+
+        self.assertEqual(response.context['total_grades_count'], 4)
+        self.assertEqual(response.context['average_grade'], 3.5)
+        self.assertEqual([data['subject'].name for data in response.context['subjects_grades_data']],
+                         ['Алгебра', 'Физика'])
+        self.assertIsNone(response.context['next_page_url'])
+
+        # В данных - от новых к старым, на странице - от старых к новым
+        self.assertEqual(response.context['subjects_grades_data'][0]['badges'], [(4, '04.09.2025'), (3, '03.09.2025')])
+        content = response.content.decode()
+        self.assertLess(content.index('Дата: 03.09.2025'), content.index('Дата: 04.09.2025'))
+
+    def test_invalid_filter_shows_whole_history(self):
+        self.add_grades(3)
+        response = self.client.get(reverse('student_dashboard'), {'after': 'garbage', 'date_from': 'x'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors)
+        self.assertEqual(response.context['total_grades_count'], 6)
+
+
+@fast_accounts
+class DashboardApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.student = make_student(self.school_class)
+        self.parent = make_parent([self.student])
+        Grade.objects.create(student=self.student, subject=self.subject, grade=7, date=date(2025, 10, 1))
+
+    def get(self, name, etag=None, kwargs=None):
+        headers = {'If-None-Match': etag} if etag else {}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(name, **(kwargs or {})), headers=headers)
+        app_queries = [query['sql'] for query in ctx.captured_queries if 'school_app_' in query['sql']]
+        return response, app_queries
+
+    def test_student_dashboard_not_modified(self):
+        self.client.force_login(self.student.user)
+        response, _ = self.get('student_dashboard_api')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['subjects'][0]['grades'][0]['grade'], 7)
+        self.assertEqual(response.json()['student']['class'], '5-А')
+
+        cached, queries = self.get('student_dashboard_api', etag=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"school_app_grade"', queries[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.create(student=self.student, subject=self.subject, grade=9, date=date(2025, 10, 2))
+        changed, _ = self.get('student_dashboard_api', etag=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+
+    def test_parent_dashboard_not_modified(self):
+        self.client.force_login(self.parent.user)
+        response, _ = self.get('parent_dashboard_api')
+        self.assertEqual(len(response.json()['children']), 1)
+
+        cached, queries = self.get('parent_dashboard_api', etag=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        self.parent.students.add(make_student(self.school_class, last_name='Петров'))
+        changed, _ = self.get('parent_dashboard_api', etag=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+
+    def test_student_grades_etag_depends_on_filter(self):
+        self.client.force_login(self.parent.user)
+        response, _ = self.get('student_grades_api', kwargs={'args': [self.student.id]})
+        self.assertEqual(response.json()['total_grades_count'], 1)
+
+        cached, queries = self.get('student_grades_api', etag=response['ETag'], kwargs={'args': [self.student.id]})
+        self.assertEqual(cached.status_code, 304)
+        # Проверка доступа родителя и ETag; оценки не читаются
+        self.assertEqual(len(queries), 2)
+        self.assertNotIn('"school_app_grade"', ' '.join(queries))
+
+        response = self.client.get(reverse('student_grades_api', args=[self.student.id]),
+                                   {'date_from': '2025-10-02'}, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total_grades_count'], 0)
+
+    def test_wrong_role_forbidden(self):
+        self.client.force_login(self.student.user)
+        response, _ = self.get('parent_dashboard_api')
+        self.assertEqual(response.status_code, 403)
+
+    def test_student_with_grades_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student.delete()
+        self.assertFalse(Grade.objects.exists())
+        self.assertFalse(GradeVersion.objects.exists())
+
+    def test_student_user_with_grades_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.student.user.delete()
+        self.assertFalse(Student.objects.filter(id=self.student.id).exists())
+        self.assertFalse(GradeVersion.objects.exists())
+
+    def test_student_grades_limited_to_related_users(self):
+        other = make_student(self.school_class, last_name='Петров')
+        teacher = make_teacher([self.subject], [self.school_class])
+
+        for user, student, status in [
+            (self.student.user, self.student, 200),
+            (self.student.user, other, 403),
+            (self.parent.user, other, 403),
+            (teacher.user, other, 200),
+        ]:
+            self.client.force_login(user)
+            response, _ = self.get('student_grades_api', kwargs={'args': [student.id]})
+            self.assertEqual(response.status_code, status)
+
+
+@fast_accounts
+class GradeAggregateTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.student = make_student(self.school_class)
+
+    def aggregate(self):
+        return GradeAggregate.objects.get(student=self.student, subject=self.subject)
+
+    def test_kept_up_to_date_on_create_update_delete(self):
+        first = Grade.objects.create(student=self.student, subject=self.subject, grade='4', date='2025-10-01')
+        second = Grade.objects.create(student=self.student, subject=self.subject, grade=9, date=date(2025, 10, 3))
+
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.total), (2, 13))
+        self.assertEqual((aggregate.min_grade, aggregate.max_grade), (4, 9))
+        self.assertEqual(aggregate.last_date, date(2025, 10, 3))
+        self.assertEqual(aggregate.histogram, [0, 0, 0, 1, 0, 0, 0, 0, 1, 0])
+
+        first = Grade.objects.get(pk=first.pk)
+        first.grade = 10
+        first.save()
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.total, aggregate.min_grade, aggregate.max_grade), (2, 19, 9, 10))
+
+        second.delete()
+        aggregate = self.aggregate()
+        self.assertEqual((aggregate.count, aggregate.total), (1, 10))
+        self.assertEqual(aggregate.last_date, date(2025, 10, 1))
+
+        first.delete()
+        self.assertFalse(GradeAggregate.objects.exists())
+
+    def test_rebuild_command_matches_incremental_state(self):
+        for day, value in enumerate([3, 7, 7, 10], start=1):
+            Grade.objects.create(student=self.student, subject=self.subject, grade=value, date=date(2025, 10, day))
+        expected = self.aggregate()
+
+        GradeAggregate.objects.all().delete()
+        call_command('rebuild_grade_aggregates', stdout=StringIO())
+
+        rebuilt = self.aggregate()
+        for field in ('count', 'total', 'min_grade', 'max_grade', 'last_date', 'histogram'):
+            self.assertEqual(getattr(rebuilt, field), getattr(expected, field))
+
+    def test_student_dashboard_reads_summary_from_aggregates(self):
+        Grade.objects.create(student=self.student, subject=self.subject, grade=8, date=date(2025, 10, 1))
+        Grade.objects.create(student=self.student, subject=self.subject, grade=6, date=date(2025, 10, 2))
+        GradeAggregate.objects.filter(student=self.student).update(total=20)
+
+        self.client.force_login(self.student.user)
+        response = self.client.get(reverse('student_dashboard'))
+
+        self.assertEqual(response.context['total_grades_count'], 2)
+        self.assertEqual(response.context['average_grade'], 10)
+        self.assertEqual(response.context['grade_stats'][8], 1)
+
+
+@fast_accounts
+class AddGradeTests(TestCase):
+
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.subject.classes.add(self.school_class)
+        self.student = make_student(self.school_class)
+        self.teacher = make_teacher([self.subject], [self.school_class])
+        self.client.force_login(self.teacher.user)
+
+    def post_grade(self, grade, grade_date='2025-10-06'):
+        return self.client.post(reverse('add_grade'), {
+            'student': self.student.id,
+            'subject': self.subject.id,
+            'grade': grade,
+            'date': grade_date,
+        }, follow=True)
+
+    def test_duplicate_grade_rejected_by_unique_constraint(self):
+        self.post_grade(7)
+        response = self.post_grade(9)
+
+        self.assertEqual(Grade.objects.get().grade, 7)
+        self.assertIn('уже есть оценка', ' '.join(str(m) for m in response.context['messages']))
+
+
+
+@fast_accounts
+class GradeSheetTests(TestCase):
+
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.subject.classes.add(self.school_class)
+        self.teacher = make_teacher([self.subject], [self.school_class])
+        self.client.force_login(self.teacher.user)
+
+    def add_students(self, count):
+        return [make_student(self.school_class, last_name=f'Ученик {i}') for i in range(count)]
+
+    def post_sheet(self, grades, grade_date='2025-10-06'):
+        data = {'class': self.school_class.id, 'subject': self.subject.id, 'date': grade_date}
+        data.update({f'grade_{student_id}': value for student_id, value in grades.items()})
+        return self.client.post(reverse('grade_sheet'), data)
+
+    def test_whole_class_saved_in_one_batch(self):
+        students = self.add_students(3)
+        response = self.post_sheet({student.id: 8 for student in students})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Grade.objects.filter(grade=8).count(), 3)
+        self.assertEqual(sum(GradeAggregate.objects.values_list('count', flat=True)), 3)
+
+    def test_query_count_does_not_grow_with_class_size(self):
+        def count_queries(students):
+            with CaptureQueriesContext(connection) as ctx:
+                self.post_sheet({student.id: 7 for student in students}, grade_date=grade_date)
+            return len(ctx.captured_queries)
+
+        get_grants(self.teacher.id)  # права кешируются при первой ведомости
+        grade_date = '2025-10-06'
+        small = count_queries(self.add_students(2))
+        Grade.objects.all().delete()
+        grade_date = '2025-10-07'
+        large = count_queries(self.add_students(20))
+        self.assertEqual(small, large)
+
+    def test_row_errors_reported_and_nothing_committed(self):
+        first, second = self.add_students(2)
+        Grade.objects.create(student=second, subject=self.subject, grade=5, date=date(2025, 10, 6))
+
+        response = self.post_sheet({first.id: 9, second.id: 6})
+
+        self.assertEqual(response.status_code, 200)
+        rows = {row['student'].id: row for row in response.context['rows']}
+        self.assertIsNone(rows[first.id]['error'])
+        self.assertIn('Уже есть оценка', rows[second.id]['error'])
+        self.assertEqual(Grade.objects.count(), 1)
+
+    def test_non_numeric_ids_open_empty_sheet(self):
+        self.add_students(2)
+        response = self.client.get(reverse('grade_sheet'), {'class': 'abc', 'subject': self.subject.id})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['rows'], [])
+
+    def test_missing_ids_reported_on_post(self):
+        student, = self.add_students(1)
+        response = self.client.post(reverse('grade_sheet'), {'date': '2025-10-06', f'grade_{student.id}': 8})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Выберите класс и предмет', ' '.join(str(m) for m in response.context['messages']))
+        self.assertFalse(Grade.objects.exists())
+
+    def test_weekend_rejected_once_for_whole_batch(self):
+        students = self.add_students(2)
+        self.post_sheet({student.id: 9 for student in students}, grade_date='2025-10-04')
+        self.assertFalse(Grade.objects.exists())
+
+    def test_json_api(self):
+        first, second = self.add_students(2)
+        response = self.client.post(reverse('grade_sheet'), json.dumps({
+            'class': self.school_class.id,
+            'subject': self.subject.id,
+            'date': '2025-10-06',
+            'grades': {first.id: 10, second.id: 11},
+        }), content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], {str(second.id): '❌ Оценка должна быть от 1 до 10'})
+        self.assertFalse(Grade.objects.exists())
+
+    def post_json_sheet(self, school_class, grade_date='2025-10-06'):
+        student, = self.add_students(1)
+        return self.client.post(reverse('grade_sheet'), json.dumps({
+            'class': school_class.id if school_class else None,
+            'subject': self.subject.id,
+            'date': grade_date,
+            'grades': {student.id: 8},
+        }), content_type='application/json')
+
+    def test_json_api_forbidden_class(self):
+        other_class = SchoolClass.objects.create(number_class=6, letter_class='Б')
+        self.assertEqual(self.post_json_sheet(other_class).status_code, 403)
+
+    def test_json_api_invalid_sheet(self):
+        self.assertEqual(self.post_json_sheet(None).status_code, 400)
+        self.assertEqual(self.post_json_sheet(self.school_class, grade_date='2025-10-04').status_code, 400)
+        self.assertFalse(Grade.objects.exists())
+
+EXPLAIN_GRADES = int(os.environ.get('SCHOOL_EXPLAIN_GRADES', '0'))
+
+
+@fast_accounts
+class GradeGrantsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.other_class = SchoolClass.objects.create(number_class=6, letter_class='Б')
+        self.subject = Subject.objects.create(name='Математика')
+        self.subject.classes.add(self.school_class)
+        self.teacher = make_teacher([self.subject], [self.school_class])
+
+    def check(self, school_class, subject=None):
+        return get_grants(self.teacher.id).check(school_class.id, (subject or self.subject).id)
+
+    def test_cached_check_runs_no_queries(self):
+        self.assertIsNone(self.check(self.school_class))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.check(self.school_class))
+            self.assertEqual(self.check(self.other_class), FORBIDDEN)
+
+    @override_settings(GRADE_GRANTS_TIMEOUT=0)
+    def test_unshared_cache_expiry(self):
+        self.assertIsNone(self.check(self.school_class))
+        # Права отозваны в другом процессе: сигналы здесь не срабатывают
+        Teacher.classes.through.objects.filter(teacher_id=self.teacher.id).delete()
+        self.assertEqual(self.check(self.school_class), FORBIDDEN)
+
+    def test_teacher_links_invalidate(self):
+        self.assertEqual(self.check(self.other_class), FORBIDDEN)
+        self.teacher.classes.add(self.other_class)
+        self.assertEqual(self.check(self.other_class), NOT_TAUGHT)
+
+        self.other_class.subjects.add(self.subject)
+        self.assertIsNone(self.check(self.other_class))
+
+        self.subject.teachers.clear()
+        self.assertEqual(self.check(self.other_class), FORBIDDEN)
+
+    def test_subject_classes_invalidate(self):
+        self.assertIsNone(self.check(self.school_class))
+        self.school_class.subjects.clear()
+        self.assertEqual(self.check(self.school_class), NOT_TAUGHT)
+
+    def test_add_grade_respects_grants(self):
+        student = make_student(self.other_class)
+        self.client.force_login(self.teacher.user)
+        data = {'student': student.id, 'subject': self.subject.id, 'grade': 8, 'date': '2025-10-06'}
+
+        self.client.post(reverse('add_grade'), data)
+        self.teacher.classes.add(self.other_class)
+        self.other_class.subjects.add(self.subject)
+        self.client.post(reverse('add_grade'), data)
+
+        self.assertEqual(Grade.objects.filter(student=student).count(), 1)
+
+
+class SchoolCalendarTests(TestCase):
+
+    def setUp(self):
+        # Откат транзакции теста не шлет сигналов - сбрасываем календарь сами
+        calendar_service.invalidate()
+        self.addCleanup(calendar_service.invalidate)
+        self.calendar = SchoolCalendar.objects.get(name='2025/2026')
+
+    def test_seeded_year_and_weekends(self):
+        self.assertEqual(calendar_service.day_code(date(2025, 10, 6)), SCHOOL_DAY)
+        self.assertEqual(calendar_service.day_code(date(2025, 10, 4)), WEEKEND)
+        self.assertEqual(calendar_service.day_code(date(2026, 1, 7)), HOLIDAY)
+        # Вне учебных годов - только выходные
+        self.assertTrue(calendar_service.is_school_day(date(2030, 6, 3)))
+        self.assertFalse(calendar_service.is_school_day(date(2030, 6, 1)))
+
+    def test_changes_visible_after_save(self):
+        self.assertTrue(calendar_service.is_school_day(date(2025, 11, 3)))
+        Holiday.objects.create(calendar=self.calendar, name='Осенние каникулы', kind=Holiday.VACATION,
+                               start_date=date(2025, 11, 1), end_date=date(2025, 11, 9))
+        Holiday.objects.create(calendar=self.calendar, name='Перенос', kind=Holiday.WORKING_DAY,
+                               start_date=date(2025, 11, 8), end_date=date(2025, 11, 8))
+
+        self.assertEqual(calendar_service.day_code(date(2025, 11, 3)), VACATION)
+        self.assertEqual(calendar_service.day_code(date(2025, 11, 8)), SCHOOL_DAY)
+        self.assertIn('каникулы', non_working_day_error(date(2025, 11, 3)))
+
+    def test_many_dates_checked_without_queries(self):
+        days = [date(2025, 9, 1) + timedelta(days=i) for i in range(5000)]
+        calendar_service.days()
+
+        with self.assertNumQueries(0):
+            non_school = calendar_service.non_school_days(days)
+
+        self.assertIn(date(2025, 12, 25), non_school)
+        self.assertNotIn(date(2025, 12, 24), non_school)
+        self.assertEqual(non_school[date(2025, 9, 6)], WEEKEND)
+
+
+@skipUnless(EXPLAIN_GRADES, 'задайте SCHOOL_EXPLAIN_GRADES (например, 1000000) для проверки планов запросов')
+class GradeQueryPlanTests(TestCase):
+    """Проверяет по EXPLAIN, что запросы дневников используют индексы Grade."""
+
+    SUBJECTS = 20
+    DAYS = 25
+
+    @classmethod
+    def setUpTestData(cls):
+        students_count = max(EXPLAIN_GRADES // (cls.SUBJECTS * cls.DAYS), 1)
+        Student.objects.bulk_create(
+            [Student(student_id=f'x{i}', password='000000') for i in range(students_count)],
+            batch_size=5000
+        )
+        Subject.objects.bulk_create([Subject(name=f'Предмет {i}') for i in range(cls.SUBJECTS)])
+
+        student_ids = list(Student.objects.values_list('id', flat=True))
+        subject_ids = list(Subject.objects.values_list('id', flat=True))
+        dates = [date(2025, 9, 1) + timedelta(days=day) for day in range(cls.DAYS)]
+
+        batch = []
+        for student_id in student_ids:
+            for subject_id in subject_ids:
+                for day, grade_date in enumerate(dates):
+                    batch.append(Grade(student_id=student_id, subject_id=subject_id,
+                                       grade=day % 10 + 1, date=grade_date))
+            if len(batch) >= 10000:
+                Grade.objects.bulk_create(batch)
+                batch = []
+        Grade.objects.bulk_create(batch)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.student = Student.objects.order_by('id')[students_count // 2]
+        cls.subject = Subject.objects.order_by('id').first()
+        cls.parent = Parent.objects.bulk_create([Parent(parent_id='px', password='000000')])[0]
+        cls.parent.students.set(Student.objects.order_by('id')[:3])
+
+    def assertIndexScan(self, queryset):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'(?i)index', plan)
+        self.assertNotIn('Seq Scan on school_app_grade', plan)
+
+    def test_student_grades_by_date(self):
+        self.assertIndexScan(Grade.objects.filter(student=self.student).order_by('-date'))
+
+    def test_children_grades(self):
+        # Тот же запрос, что читает дневник родителя: оценки с подзапросом детей
+        self.assertIndexScan(grade_values(children_grades(self.parent.students.all())))
+
+    def test_history_page_after_cursor(self):
+        self.assertIndexScan(history_queryset(self.student, after=(date(2025, 9, 10), 1))[:PAGE_SIZE + 1])
+
+    def test_subject_grades_by_student(self):
+        self.assertIndexScan(Grade.objects.filter(subject=self.subject, student=self.student))
+
+    def test_duplicate_lookup(self):
+        self.assertIndexScan(Grade.objects.filter(student=self.student, subject=self.subject,
+                                                  date=date(2025, 9, 1)))
+
+
+@fast_accounts
+class LoginTests(TestCase):
+
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.student = make_student(self.school_class)
+        self.parent = make_parent([self.student])
+        self.teacher = make_teacher([], [self.school_class])
+        get_login_throttle.cache_clear()
+
+    def login(self, user_id, password):
+        return self.client.post(reverse('login'), {'user_id': user_id, 'password': password})
+
+    def test_each_role_redirected_to_its_dashboard(self):
+        for profile, portal_id, url_name in [
+            (self.teacher, self.teacher.teacher_id, 'teacher_dashboard'),
+            (self.student, self.student.student_id, 'student_dashboard'),
+            (self.parent, self.parent.parent_id, 'parent_dashboard'),
+        ]:
+            response = self.login(portal_id, profile.password)
+            self.assertRedirects(response, reverse(url_name), fetch_redirect_response=False)
+            self.assertEqual(int(self.client.session['_auth_user_id']), profile.user.id)
+            self.client.logout()
+
+    def test_wrong_password_rejected(self):
+        wrong = '000000' if self.student.password != '000000' else '111111'
+        response = self.login(self.student.student_id, wrong)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_single_lookup_and_no_probing_for_unknown_format(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIsNotNone(PortalCredential.authenticate(self.parent.parent_id, self.parent.password))
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertIsNone(PortalCredential.authenticate('x12345', '123456'))
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+    def test_credentials_follow_profile_lifecycle(self):
+        credential = PortalCredential.objects.get(portal_id=self.student.student_id)
+        self.assertEqual((credential.role, credential.user_id), (PortalCredential.STUDENT, self.student.user_id))
+
+        self.student.delete()
+        self.assertFalse(PortalCredential.objects.filter(portal_id=self.student.student_id).exists())
+
+
+
+@fast_accounts
+class PortalProfileTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.student = make_student(self.school_class)
+        self.parent = make_parent([self.student])
+        self.teacher = make_teacher([], [self.school_class])
+        get_login_throttle.cache_clear()
+
+    def profile_queries(self, url):
+        """Ответ и запросы к таблицам приложения (профили, оценки и т.п.)."""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [query['sql'] for query in ctx.captured_queries if 'school_app_' in query['sql']]
+
+    def test_login_stores_role_and_profile(self):
+        self.client.post(reverse('login'), {'user_id': self.student.student_id, 'password': self.student.password})
+        self.assertEqual(self.client.session[ROLE_SESSION_KEY], PortalCredential.STUDENT)
+        self.assertEqual(self.client.session[PROFILE_SESSION_KEY], self.student.id)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.assertIsNone(self.client.session[ROLE_SESSION_KEY])
+        response, queries = self.profile_queries(reverse('student_dashboard'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+        self.assertEqual(queries, [])
+
+    def test_wrong_role_redirects_without_queries(self):
+        for user, url_name in [(self.student.user, 'teacher_dashboard'), (self.student.user, 'add_grade'),
+                               (self.teacher.user, 'student_dashboard'), (self.teacher.user, 'parent_dashboard')]:
+            self.client.force_login(user)
+            response, queries = self.profile_queries(reverse(url_name))
+            self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+            self.assertEqual(queries, [], url_name)
+
+    def test_profile_loaded_once_with_user(self):
+        self.client.force_login(self.teacher.user)
+        response, queries = self.profile_queries(reverse('teacher_dashboard'))
+
+        self.assertEqual(response.context['teacher'], self.teacher)
+        self.assertEqual(sum('FROM "school_app_teacher"' in sql for sql in queries), 1)
+        self.assertContains(response, 'Учитель: Петрова Мария')
+
+    def test_old_session_gets_role_on_first_request(self):
+        self.client.force_login(self.parent.user)
+        session = self.client.session
+        del session[ROLE_SESSION_KEY], session[PROFILE_SESSION_KEY]
+        session.save()
+
+        response = self.client.get(reverse('parent_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session[PROFILE_SESSION_KEY], self.parent.id)
+
+    def test_profile_of_another_user_is_ignored(self):
+        self.client.force_login(self.student.user)
+        other = make_student(self.school_class, 'Петр', 'Петров')
+        session = self.client.session
+        session[PROFILE_SESSION_KEY] = other.id
+        session.save()
+
+        response = self.client.get(reverse('student_dashboard'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+@fast_accounts
+@override_settings(LOGIN_THROTTLE={
+    'PER_ID': {'capacity': 3, 'refill_seconds': 60},
+    'PER_IP': {'capacity': 5, 'refill_seconds': 60},
+})
+class LoginThrottleTests(TestCase):
+
+    def setUp(self):
+        get_login_throttle.cache_clear()
+        self.student = make_student(SchoolClass.objects.create(number_class=5, letter_class='А'))
+        self.wrong = '000000' if self.student.password != '000000' else '111111'
+
+    def attempt(self, user_id, password, ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'user_id': user_id, 'password': password},
+                                REMOTE_ADDR=ip)
+
+    def test_bucket_refills_over_time(self):
+        now = [0.0]
+        throttle = LoginThrottle(get_login_throttle().backend,
+                                 per_id={'capacity': 2, 'refill_seconds': 10},
+                                 per_ip={'capacity': 100, 'refill_seconds': 10},
+                                 clock=lambda: now[0])
+
+        self.assertEqual([throttle.allow('261234', 'ip') for _ in range(3)], [True, True, False])
+        now[0] += 5
+        self.assertEqual([throttle.allow('261234', 'ip') for _ in range(2)], [True, False])
+
+    def test_attack_rejected_before_database(self):
+        with CaptureQueriesContext(connection) as ctx:
+            statuses = [self.attempt(self.student.student_id, self.wrong).status_code for _ in range(50)]
+
+        self.assertEqual(statuses.count(429), 47)
+        self.assertEqual(len(ctx.captured_queries), 3)
+
+    def test_ip_limit_spans_portal_ids(self):
+        statuses = [self.attempt(f'26{1000 + i}', self.wrong).status_code for i in range(6)]
+        self.assertEqual(statuses, [200] * 5 + [429])
+        self.assertEqual(self.attempt('261999', self.wrong, ip='10.0.0.2').status_code, 200)
+
+    @override_settings(LOGIN_THROTTLE={
+        'BACKEND': 'school_app.throttling.CacheBucketBackend',
+        'PER_ID': {'capacity': 1, 'refill_seconds': 60},
+        'PER_IP': {'capacity': 5, 'refill_seconds': 60},
+    })
+    def test_cache_backend(self):
+        cache.clear()
+        self.assertIsInstance(get_login_throttle().backend, CacheBucketBackend)
+        self.assertEqual(self.attempt(self.student.student_id, self.wrong).status_code, 200)
+        self.assertEqual(self.attempt(self.student.student_id, self.student.password).status_code, 429)
+
+    def test_cache_backend_concurrent_attempts(self):
+        cache.clear()
+        backend = CacheBucketBackend()
+        barrier = threading.Barrier(20)
+        results = []
+
+        def attempt():
+            barrier.wait()
+            results.append(backend.consume('id:261234', capacity=5, refill_seconds=60, now=30.0))
+
+        threads = [threading.Thread(target=attempt) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 5)
+        self.assertFalse(backend.consume('id:261234', capacity=5, refill_seconds=60, now=59.0))
+        self.assertTrue(backend.consume('id:261234', capacity=5, refill_seconds=60, now=60.0))
+
+def legacy_login_lookup(user_id, password):
+    """Прежний порядок входа: перебор учителей, учеников и родителей."""
+    for model, field in [(Teacher, 'teacher_id'), (Student, 'student_id'), (Parent, 'parent_id')]:
+        try:
+            return model.objects.get(**{field: user_id, 'password': password}).user
+        except model.DoesNotExist:
+            pass
+    return None
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class LoginBenchmark(TestCase):
+    ACCOUNTS = 300
+    ROUNDS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        cls.accounts = []
+        for i in range(cls.ACCOUNTS):
+            student = make_student(school_class)
+            parent = make_parent([student])
+            cls.accounts.append((parent.parent_id, parent.password))
+            cls.accounts.append((f'P{9000 + i}99', '000000'))
+
+    def measure(self, lookup):
+        with QueryCounter(connection) as counter:
+            started = time.perf_counter()
+            for _ in range(self.ROUNDS):
+                for user_id, password in self.accounts:
+                    lookup(user_id, password)
+            elapsed = time.perf_counter() - started
+        attempts = self.ROUNDS * len(self.accounts)
+        return attempts / elapsed, counter.count / attempts
+
+    def test_login_throughput(self):
+        legacy_rate, legacy_queries = self.measure(legacy_login_lookup)
+        directory_rate, directory_queries = self.measure(PortalCredential.authenticate)
+
+        report_benchmark('login', legacy_per_sec=legacy_rate, legacy_queries=legacy_queries,
+                         directory_per_sec=directory_rate, directory_queries=directory_queries)
+        self.assertLess(directory_queries, legacy_queries)
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class LoginAttackBenchmark(TestCase):
+    ATTEMPTS = 2000
+
+    def test_database_load_stays_flat_under_attack(self):
+        student = make_student(SchoolClass.objects.create(number_class=5, letter_class='А'))
+        get_login_throttle.cache_clear()
+
+        with QueryCounter(connection) as counter:
+            started = time.perf_counter()
+            for i in range(self.ATTEMPTS):
+                self.client.post(reverse('login'), {'user_id': student.student_id, 'password': f'{i:06d}'},
+                                 REMOTE_ADDR=f'10.0.{i % 250}.{i % 7}')
+            elapsed = time.perf_counter() - started
+
+        report_benchmark('login attack', attempts=self.ATTEMPTS, per_sec=self.ATTEMPTS / elapsed,
+                         db_queries=counter.count)
+        self.assertLessEqual(counter.count, 5)
+
+
+@fast_accounts
+class IdAllocatorTests(TestCase):
+
+    def test_visible_formats_kept(self):
+        school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        student = make_student(school_class)
+        parent = make_parent([student])
+        teacher = Teacher.objects.create()
+
+        year = str(date.today().year)[2:]
+        self.assertRegex(student.student_id, rf'^{year}[1-9]\d{{3}}$')
+        self.assertRegex(parent.parent_id, rf'^P[1-9]\d{{3}}{year}$')
+        self.assertRegex(teacher.teacher_id, r'^t[1-9]\d{5}$')
+
+    def test_legacy_ids_skipped(self):
+        id_format = student_id_format('99')
+        Student.objects.bulk_create([Student(student_id=id_format.render(n)) for n in (0, 1)])
+
+        self.assertEqual(IdAllocator().allocate(id_format), [id_format.render(2)])
+
+    def test_reserved_block_served_without_queries(self):
+        allocator = IdAllocator(block_size=10)
+        id_format = student_id_format('98')
+        with self.captureOnCommitCallbacks(execute=True):
+            allocator.allocate(id_format)
+
+        with CaptureQueriesContext(connection) as ctx:
+            ids = allocator.allocate(id_format, count=9)
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(len(set(ids)), 9)
+
+    def test_processes_get_disjoint_blocks(self):
+        id_format = student_id_format('97')
+        first, second = IdAllocator(block_size=5), IdAllocator(block_size=5)
+
+        ids = []
+        for _ in range(12):
+            ids += first.allocate(id_format) + second.allocate(id_format)
+        self.assertEqual(len(set(ids)), 24)
+
+    def test_rolled_back_block_not_reused(self):
+        id_format = student_id_format('95')
+        allocator = IdAllocator(block_size=5)
+        try:
+            with transaction.atomic():
+                allocator.allocate(id_format)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+
+        # Откаченный резерв достается другому процессу - у этого его остатка быть не должно
+        other = IdAllocator(block_size=5).allocate(id_format, count=5)
+        self.assertFalse(set(allocator.allocate(id_format, count=5)) & set(other))
+
+    def test_exhaustion_reported(self):
+        id_format = IdFormat('tiny', 3, str, 'Student', 'student_id')
+        allocator = IdAllocator()
+        self.assertEqual(allocator.allocate(id_format, count=3), ['0', '1', '2'])
+        with self.assertRaises(IdSpaceExhausted):
+            allocator.allocate(id_format)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class IdAllocatorStressTests(TransactionTestCase):
+    WORKERS = 8
+    PER_WORKER = 50
+
+    def test_parallel_workers_get_unique_ids(self):
+        id_format = student_id_format('96')
+        results = []
+        errors = []
+
+        def worker():
+            allocator = IdAllocator(block_size=3)
+            try:
+                for _ in range(self.PER_WORKER):
+                    results.extend(allocator.allocate(id_format))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.WORKERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), self.WORKERS * self.PER_WORKER)
+        self.assertEqual(len(set(results)), len(results))
+
+    def test_no_deadlock_with_outer_transaction(self):
+        id_format = student_id_format('94')
+        allocator = IdAllocator(block_size=1)
+        row_locked = threading.Event()
+        errors = []
+
+        def holder():
+            try:
+                with transaction.atomic():
+                    allocator.allocate(id_format)
+                    row_locked.set()
+                    time.sleep(0.2)  # второй поток ждет строку последовательности
+                    allocator.allocate(id_format)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        def waiter():
+            row_locked.wait()
+            try:
+                allocator.allocate(id_format)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=holder, daemon=True), threading.Thread(target=waiter, daemon=True)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(errors, [])
+
+
+
+def csv_rows(text):
+    return read_rows(BytesIO(text.encode('utf-8')), 'people.csv')
+
+
+@fast_accounts
+class ImportTests(TestCase):
+
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+
+    def test_students_imported_in_bulk(self):
+        report = StudentImporter(chunk_size=2, workers=1).run(csv_rows(
+            'last_name,first_name,class\n'
+            'Иванов,Иван,5-А\n'
+            'Петров,Петр,9-Я\n'
+            'Сидоров,Сидор,5-а\n'
+        ))
+
+        self.assertEqual(len(report.created), 2)
+        self.assertEqual(report.errors[0][:2], (3, 'Класс "9-Я" не найден'))
+
+        student = Student.objects.get(user__last_name='Сидоров')
+        self.assertEqual(student.class_field, self.school_class)
+        self.assertTrue(student.user.check_password(student.password))
+        self.assertEqual(PortalCredential.authenticate(student.student_id, student.password).user, student.user)
+
+    def test_parents_linked_to_children(self):
+        student = make_student(self.school_class)
+        report = ParentImporter(workers=1).run(csv_rows(
+            'last_name,first_name,children\n'
+            f'Иванова,Мария,{student.student_id}\n'
+            'Петрова,Анна,009999\n'
+        ))
+
+        self.assertEqual(len(report.created), 1)
+        self.assertEqual(list(report.created[0].students.all()), [student])
+        self.assertIn('009999', report.errors[0][1])
+
+    def test_teachers_get_subjects_and_classes(self):
+        report = TeacherImporter(workers=1).run(csv_rows(
+            'last_name,first_name,subjects,classes\n'
+            'Петрова,Мария,математика,5-А\n'
+        ))
+
+        teacher = report.created[0]
+        self.assertRegex(teacher.teacher_id, r'^t\d{6}$')
+        self.assertEqual(list(teacher.subjects.all()), [self.subject])
+        self.assertEqual(list(teacher.classes.all()), [self.school_class])
+
+    def test_command_writes_error_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = Path(directory, 'students.csv')
+            errors = Path(directory, 'errors.csv')
+            source.write_text('last_name,first_name,class\nИванов,Иван,5-А\n,Петр,5-А\n', encoding='utf-8')
+
+            call_command('import_people', 'student', str(source), '--errors', str(errors),
+                         '--workers', '1', stdout=StringIO())
+
+            self.assertEqual(Student.objects.count(), 1)
+            self.assertIn('Не заполнены фамилия или имя', errors.read_text(encoding='utf-8'))
+
+    def test_admin_upload(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.client.force_login(admin_user)
+        upload = SimpleUploadedFile('students.csv', 'last_name,first_name,class\nИванов,Иван,5-А\n'.encode('utf-8'))
+
+        response = self.client.post(reverse('admin:school_app_student_import'), {'file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(self.client.get(reverse('admin:school_app_student_changelist')), 'Импорт из CSV/XLSX')
+        self.assertEqual(Student.objects.get().user.last_name, 'Иванов')
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+class ImportBenchmark(TestCase):
+    STUDENTS = 5000
+
+    def test_import_students(self):
+        SchoolClass.objects.create(number_class=5, letter_class='А')
+        rows = ({'last_name': f'Ученик{i}', 'first_name': 'Иван', 'class': '5-А'} for i in range(self.STUDENTS))
+
+        with QueryCounter(connection) as counter:
+            started = time.perf_counter()
+            report = StudentImporter(chunk_size=500).run(rows)
+            elapsed = time.perf_counter() - started
+
+        report_benchmark('import students', rows=self.STUDENTS, seconds=elapsed,
+                         rows_per_sec=self.STUDENTS / elapsed, db_queries=counter.count)
+        self.assertEqual(len(report.created), self.STUDENTS)
+
+
+
+@fast_accounts
+class ClassAnalyticsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.subject = Subject.objects.create(name='Математика')
+        self.subject.classes.add(self.school_class)
+        self.teacher = make_teacher([self.subject], [self.school_class])
+        self.steady = make_student(self.school_class, 'Анна', 'Андреева')
+        self.falling = make_student(self.school_class, 'Борис', 'Борисов')
+
+        start = date(2025, 9, 1)
+        for week, (steady, falling) in enumerate([(8, 9), (8, 9), (8, 8), (8, 5), (8, 4), (8, 4)]):
+            day = start + timedelta(weeks=week)
+            Grade.objects.create(student=self.steady, subject=self.subject, grade=steady, date=day)
+            Grade.objects.create(student=self.falling, subject=self.subject, grade=falling, date=day)
+
+    def test_statistics(self):
+        stats = class_subject_stats(self.school_class.id, self.subject.id)
+
+        self.assertEqual(stats['count'], 12)
+        self.assertEqual(stats['average'], 7.25)
+        self.assertEqual(stats['median'], 8)
+        self.assertEqual(stats['histogram'], [0, 0, 0, 2, 1, 0, 0, 7, 2, 0])
+        self.assertEqual([week['average'] for week in stats['weekly']], [8.5, 8.5, 8, 6.5, 6, 6])
+        self.assertEqual([item['student_id'] for item in stats['falling']], [self.falling.id])
+        self.assertEqual((stats['falling'][0]['earlier'], stats['falling'][0]['recent']), (9, 5.25))
+
+    def test_cached_until_grades_change(self):
+        class_subject_stats(self.school_class.id, self.subject.id)
+        with self.assertNumQueries(0):
+            class_subject_stats(self.school_class.id, self.subject.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.create(student=self.steady, subject=self.subject, grade=10, date=date(2025, 10, 14))
+        self.assertEqual(class_subject_stats(self.school_class.id, self.subject.id)['count'], 13)
+
+    def test_dashboard_panel(self):
+        self.client.force_login(self.teacher.user)
+        response = self.client.get(reverse('teacher_dashboard'))
+
+        self.assertEqual(response.context['selected_pair'], (self.school_class, self.subject))
+        self.assertContains(response, 'Успеваемость снижается')
+        self.assertContains(response, 'Борисов')
+
+
+class AdminChangelistQueryTests(TestCase):
+    CHANGELISTS = ['teacher', 'student', 'parent', 'subject', 'schoolclass']
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.seeded = 0
+
+    def seed(self, count):
+        start, self.seeded = self.seeded, self.seeded + count
+        numbers = range(start, self.seeded)
+
+        users = User.objects.bulk_create([User(username=f'{role}{i}') for i in numbers
+                                          for role in ('teacher', 'student', 'parent')])
+        classes = SchoolClass.objects.bulk_create([SchoolClass(number_class=i, letter_class='А') for i in numbers])
+        subjects = Subject.objects.bulk_create([Subject(name=f'Предмет {i}') for i in numbers])
+        teachers = Teacher.objects.bulk_create([Teacher(user=user, teacher_id=f't{i}', password='000000')
+                                                for i, user in zip(numbers, users[0::3])])
+        students = Student.objects.bulk_create([
+            Student(user=user, student_id=f's{i}', password='000000', class_field=school_class)
+            for i, user, school_class in zip(numbers, users[1::3], classes)
+        ])
+        parents = Parent.objects.bulk_create([Parent(user=user, parent_id=f'P{i}', password='000000')
+                                              for i, user in zip(numbers, users[2::3])])
+
+        Teacher.subjects.through.objects.bulk_create([Teacher.subjects.through(teacher=teacher, subject=subject)
+                                                      for teacher, subject in zip(teachers, subjects)])
+        Subject.classes.through.objects.bulk_create([Subject.classes.through(subject=subject, schoolclass=school_class)
+                                                     for subject, school_class in zip(subjects, classes)])
+        Parent.students.through.objects.bulk_create([Parent.students.through(parent=parent, student=student)
+                                                      for parent, student in zip(parents, students)])
+
+    def count_queries(self):
+        counts = {}
+        for model_name in self.CHANGELISTS:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(reverse(f'admin:school_app_{model_name}_changelist'))
+            self.assertEqual(response.status_code, 200)
+            counts[model_name] = len(ctx.captured_queries)
+        return counts
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.seed(10)
+        small = self.count_queries()
+        self.seed(990)
+        self.assertEqual(self.count_queries(), small)
+
+
+@fast_accounts
+class AdminAutocompleteTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        SchoolClass.objects.create(number_class=5, letter_class='Б')
+        SchoolClass.objects.create(number_class=11, letter_class='А')
+        self.parent = make_parent([])
+
+    def autocomplete(self, term, model_name='parent', field_name='students', page=1):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('admin:autocomplete'), {
+                'app_label': 'school_app', 'model_name': model_name,
+                'field_name': field_name, 'term': term, 'page': page,
+            })
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_students_by_last_name_prefix_paginated(self):
+        for i in range(25):
+            make_student(self.school_class, f'Имя{i}', 'Иванов')
+        make_student(self.school_class, 'Петр', 'Петров')
+
+        first, first_queries = self.autocomplete('Иван')
+        second, second_queries = self.autocomplete('Иван', page=2)
+
+        self.assertEqual(len(first['results']), 20)
+        self.assertTrue(first['pagination']['more'])
+        self.assertEqual(len(second['results']), 5)
+        self.assertFalse(second['pagination']['more'])
+        self.assertTrue(all('Иванов' in result['text'] for result in first['results'] + second['results']))
+        self.assertEqual(first_queries, second_queries)
+
+        # Поиск только по началу слова
+        self.assertEqual(self.autocomplete('ванов')[0]['results'], [])
+
+    def test_students_by_id_and_full_name(self):
+        anna = make_student(self.school_class, 'Анна', 'Иванова')
+        make_student(self.school_class, 'Борис', 'Иванов')
+
+        data, _ = self.autocomplete(anna.student_id[:4])
+        self.assertIn(str(anna.id), [result['id'] for result in data['results']])
+        data, _ = self.autocomplete('Иванова Ан')
+        self.assertEqual([result['id'] for result in data['results']], [str(anna.id)])
+
+    def test_change_form_does_not_render_all_students(self):
+        child = make_student(self.school_class, 'Анна', 'Андреева')
+        other = make_student(self.school_class, 'Борис', 'Борисов')
+        self.parent.students.add(child)
+
+        response = self.client.get(reverse('admin:school_app_parent_change', args=[self.parent.id]))
+
+        self.assertContains(response, str(child))
+        self.assertNotContains(response, str(other))
+
+    def test_class_search_by_name(self):
+        for term, expected in [('5-А', ['5-А']), ('5а', ['5-А']), ('5', ['5-А', '5-Б']), ('11-А', ['11-А'])]:
+            data, _ = self.autocomplete(term, model_name='teacher', field_name='classes')
+            self.assertEqual(sorted(result['text'] for result in data['results']), expected, term)
+
+
+@fast_accounts
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.student = make_student(self.school_class)
+        self.staff = User.objects.create_user('staff', password='secret', is_staff=True)
+
+    def test_records_per_view_metrics(self):
+        self.client.force_login(self.student.user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('student_dashboard'))
+
+        metrics = registry.snapshot()['student_dashboard']
+        self.assertEqual(metrics['count'], 1)
+        self.assertEqual(sum(metrics['buckets']), 1)
+        self.assertEqual(metrics['queries'], len(ctx.captured_queries))
+        self.assertGreater(metrics['template_time'], 0)
+        self.assertLessEqual(metrics['db_time'] + metrics['template_time'], metrics['duration'])
+        self.assertEqual(metrics['response_bytes'], len(response.content))
+
+    def test_metrics_endpoint_is_staff_only(self):
+        self.client.get(reverse('home'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+        self.client.force_login(self.student.user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn('# TYPE school_request_duration_seconds histogram', text)
+        self.assertIn('school_request_duration_seconds_count{view="home"} 1', text)
+        self.assertIn('school_request_duration_seconds_bucket{view="home",le="+Inf"} 1', text)
+        self.assertIn('school_db_queries_total{view="home"} 0', text)
+
+    @override_settings(METRICS={'SLOW_REQUEST_MS': 0, 'SLOW_LOG_SIZE': 2})
+    def test_slow_requests_keep_worst_with_sql(self):
+        self.client.force_login(self.student.user)
+        with self.assertLogs('school_app.metrics', 'WARNING'):
+            for _ in range(3):
+                self.client.get(reverse('student_dashboard'))
+
+        slow = registry.slow_requests()
+        self.assertEqual(len(slow), 2)
+        self.assertGreaterEqual(slow[0]['ms'], slow[1]['ms'])
+        self.assertEqual(slow[0]['view'], 'student_dashboard')
+        self.assertTrue(any('school_app_student' in query['sql'] for query in slow[0]['sql']))
+
+    def test_multiprocess_files_are_summed(self):
+        self.client.get(reverse('home'))
+        with tempfile.TemporaryDirectory() as directory:
+            other = {'home': {'buckets': [1] + [0] * 9, 'count': 1, 'duration': 0.005, 'queries': 2,
+                              'db_time': 0.001, 'template_time': 0.002, 'response_bytes': 100}}
+            with open(os.path.join(directory, '1.json'), 'w') as file:
+                json.dump(other, file)
+
+            views = collect(directory)
+
+        self.assertEqual(views['home']['count'], 2)
+        self.assertEqual(views['home']['queries'], 2 + registry.snapshot()['home']['queries'])
+        self.assertIn('school_request_duration_seconds_count{view="home"} 2', prometheus_text(views))
+
+
+@fast_accounts
+class ReportCardExportTests(TestCase):
+
+    def setUp(self):
+        self.class_a = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.class_b = SchoolClass.objects.create(number_class=6, letter_class='Б')
+        self.math = Subject.objects.create(name='Математика')
+        self.physics = Subject.objects.create(name='Физика')
+        self.math.classes.add(self.class_a)
+        self.anna = make_student(self.class_a, 'Анна', 'Андреева')
+        self.boris = make_student(self.class_a, 'Борис', 'Борисов')
+        self.vera = make_student(self.class_b, 'Вера', 'Васильева')
+        for student, subject, grade, day in [(self.anna, self.math, 8, 1), (self.anna, self.math, 9, 2),
+                                             (self.anna, self.physics, 6, 1), (self.vera, self.physics, 10, 1)]:
+            Grade.objects.create(student=student, subject=subject, grade=grade, date=date(2025, 10, day))
+
+    def rows(self, **kwargs):
+        return list(ReportCardExport(chunk_size=1, **kwargs).rows())
+
+    def test_whole_school(self):
+        header, anna, boris, vera = self.rows()
+
+        self.assertEqual(header, ['Класс', 'ID ученика', 'Фамилия', 'Имя', 'Математика', 'Физика', 'Средний балл'])
+        self.assertEqual(anna[:1] + anna[2:], ['5-А', 'Андреева', 'Анна', 8.5, 6, 7.67])
+        self.assertEqual(boris[2:], ['Борисов', 'Борис', '', '', ''])
+        self.assertEqual(vera[2:], ['Васильева', 'Вера', '', 10, 10])
+
+    def test_class_and_period(self):
+        header, anna, boris = self.rows(classes=[self.class_a], date_to=date(2025, 10, 1))
+
+        self.assertEqual(header[4:], ['Математика', 'Физика', 'Средний балл'])
+        self.assertEqual(anna[4:], [8, 6, 7])
+
+    def test_admin_action_streams_csv(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin_user)
+
+        response = self.client.post(reverse('admin:school_app_schoolclass_changelist'), {
+            'action': 'export_report_cards_csv', '_selected_action': [self.class_b.id],
+        })
+
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Васильева', lines[1])
+
+    def test_admin_action_streams_csv_under_asgi(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.async_client.force_login(admin_user)
+
+        response = async_to_sync(self.async_client.post)(reverse('admin:school_app_schoolclass_changelist'), {
+            'action': 'export_report_cards_csv', '_selected_action': [self.class_b.id],
+        })
+
+        # Асинхронный итератор: ASGI-обработчик не собирает ответ в память
+        self.assertTrue(response.is_async)
+
+        async def content():
+            return b''.join([chunk async for chunk in response.streaming_content])
+
+        lines = async_to_sync(content)().decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Васильева', lines[1])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_report_cards', '--class', '6-Б', stdout=out)
+        self.assertEqual(out.getvalue().splitlines()[1].split(',')[2:], ['Васильева', 'Вера', '10.0', '10.0'])
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+class ClassAnalyticsBenchmark(TestCase):
+    STUDENTS = 35
+    SCHOOL_DAYS = 170
+    LIMIT_SECONDS = 0.1
+
+    def test_full_year_class(self):
+        school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        subject = Subject.objects.create(name='Математика')
+        Student.objects.bulk_create([Student(student_id=f'a{i}', password='000000', class_field=school_class)
+                                     for i in range(self.STUDENTS)])
+        Grade.objects.bulk_create([
+            Grade(student_id=student_id, subject=subject, grade=(student_id + day) % 10 + 1,
+                  date=date(2025, 9, 1) + timedelta(days=day))
+            for student_id in Student.objects.values_list('id', flat=True)
+            for day in range(self.SCHOOL_DAYS)
+        ])
+
+        started = time.perf_counter()
+        stats = compute_class_subject_stats(school_class.id, subject.id)
+        elapsed = time.perf_counter() - started
+
+        report_benchmark('class analytics', grades=stats['count'], seconds=elapsed)
+        self.assertEqual(stats['count'], self.STUDENTS * self.SCHOOL_DAYS)
+        self.assertLess(elapsed, self.LIMIT_SECONDS)
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class TemplateRenderBenchmark(TestCase):
+    CHILDREN = 2
+    SUBJECTS = 10
+    GRADES_PER_CHILD = 500
+    REPEAT = 5
+
+    # Вывод оценок родителя так, как его делал шаблон до подготовки данных в представлении
+    TEMPLATE_SORTING = """{% for child_data in children_with_grades %}
+        {% regroup child_data.grades|dictsort:"subject.name" by subject as subject_list %}
+        {% for subject in subject_list %}{{ subject.grouper.name }}
+            {% for grade in subject.list|dictsort:"date" %}
+            <span title="{{ grade.date|date:'d.m.Y' }}" data-grade="{{ grade.grade }}">{{ grade.grade }}</span>
+            {% endfor %}
+        {% endfor %}
+    {% endfor %}"""
+    PRECOMPUTED = """{% for child_data in children_with_grades %}
+        {% for subject_data in child_data.subjects_data %}{{ subject_data.subject.name }}
+            {% for grade, day in subject_data.badges %}
+            <span title="{{ day }}" data-grade="{{ grade }}">{{ grade }}</span>
+            {% endfor %}
+        {% endfor %}
+    {% endfor %}"""
+
+    @classmethod
+    def setUpTestData(cls):
+        school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        subjects = [Subject.objects.create(name=f'Предмет {i}') for i in range(cls.SUBJECTS)]
+        cls.children = [make_student(school_class, last_name=f'Ученик {i}') for i in range(cls.CHILDREN)]
+        cls.parent = make_parent(cls.children)
+        Grade.objects.bulk_create([
+            Grade(student=child, subject=subject, grade=(day + s) % 10 + 1, date=date(2025, 9, 1) + timedelta(days=day))
+            for child in cls.children
+            for s, subject in enumerate(subjects)
+            for day in range(cls.GRADES_PER_CHILD // cls.SUBJECTS)
+        ])
+        GradeAggregate.rebuild()
+
+    def best_time(self, render):
+        timings = []
+        for _ in range(self.REPEAT):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    def test_dashboard_templates(self):
+        data = build_parent_dashboard(self.parent)
+        self.assertEqual(len(data['children_with_grades'][0]['grades']), self.GRADES_PER_CHILD)
+        history = student_history(self.children[0], page_size=self.GRADES_PER_CHILD)
+
+        template_sorting = self.best_time(lambda: Template(self.TEMPLATE_SORTING).render(Context(data)))
+        precomputed = self.best_time(lambda: Template(self.PRECOMPUTED).render(Context(data)))
+        parent_page = self.best_time(lambda: render_to_string('parent_dashboard.html', {'parent': self.parent, **data}))
+        grades_page = self.best_time(lambda: render_to_string('student_grades_view.html', {
+            'student': self.children[0], 'form': GradeHistoryForm(), **history,
+        }))
+
+        report_benchmark('template render', grades_per_child=self.GRADES_PER_CHILD,
+                         template_sorting_ms=template_sorting * 1000, precomputed_ms=precomputed * 1000,
+                         parent_dashboard_ms=parent_page * 1000, student_grades_view_ms=grades_page * 1000)
+        self.assertLess(precomputed, template_sorting)
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class GradeProjectionBenchmark(TestCase):
+    GRADES = 10000
+    SUBJECTS = 10
+    REPEAT = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        subjects = [Subject.objects.create(name=f'Предмет {i}') for i in range(cls.SUBJECTS)]
+        cls.student = make_student(SchoolClass.objects.create(number_class=5, letter_class='А'))
+        Grade.objects.bulk_create([
+            Grade(student=cls.student, subject=subject, grade=(day + s) % 10 + 1,
+                  date=date(2000, 1, 1) + timedelta(days=day))
+            for s, subject in enumerate(subjects)
+            for day in range(cls.GRADES // cls.SUBJECTS)
+        ])
+
+    def measure(self, load):
+        """(лучшее время, пик памяти при загрузке, размер pickle)."""
+        seconds = float('inf')
+        for _ in range(self.REPEAT):
+            started = time.perf_counter()
+            load()
+            seconds = min(seconds, time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            grades = load()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(grades), self.GRADES)
+        return seconds, peak, len(pickle.dumps(grades))
+
+    def test_rows_against_model_instances(self):
+        grades = history_queryset(self.student)
+        # Так оценки читались раньше: экземпляры Grade с подгруженным предметом
+        models_time, models_peak, models_pickle = self.measure(lambda: list(grades.select_related('subject')))
+        rows_time, rows_peak, rows_pickle = self.measure(lambda: grade_rows(grades))
+
+        report_benchmark('grade projection', grades=self.GRADES,
+                         models_ms=models_time * 1000, rows_ms=rows_time * 1000,
+                         models_peak_kb=models_peak / 1024, rows_peak_kb=rows_peak / 1024,
+                         models_pickle_kb=models_pickle / 1024, rows_pickle_kb=rows_pickle / 1024)
+        self.assertLess(rows_time, models_time)
+        self.assertLess(rows_peak, models_peak)
+        self.assertLess(rows_pickle, models_pickle)
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+class ReportExportBenchmark(TestCase):
+    STUDENTS = 2000
+    SUBJECTS = 10
+    DAYS = 50
+    RSS_CEILING_MB = 64
+
+    @classmethod
+    def setUpTestData(cls):
+        school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        Student.objects.bulk_create([Student(student_id=f'r{i}', password='000000', class_field=school_class)
+                                     for i in range(cls.STUDENTS)])
+        Subject.objects.bulk_create([Subject(name=f'Предмет {i}') for i in range(cls.SUBJECTS)])
+        subject_ids = list(Subject.objects.values_list('id', flat=True))
+        dates = [date(2025, 9, 1) + timedelta(days=day) for day in range(cls.DAYS)]
+
+        for student_id in Student.objects.values_list('id', flat=True).iterator():
+            Grade.objects.bulk_create([
+                Grade(student_id=student_id, subject_id=subject_id, grade=day % 10 + 1, date=grade_date)
+                for subject_id in subject_ids for day, grade_date in enumerate(dates)
+            ])
+
+    @staticmethod
+    def rss_mb():
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+    @skipUnless(os.path.exists('/proc/self/statm'), 'нужен Linux /proc')
+    def test_export_million_grades(self):
+        baseline = peak = self.rss_mb()
+        size = rows = 0
+
+        started = time.perf_counter()
+        for chunk in csv_chunks(ReportCardExport().rows()):
+            size += len(chunk)
+            rows += 1
+            if rows % 1000 == 0:
+                peak = max(peak, self.rss_mb())
+        elapsed = time.perf_counter() - started
+
+        report_benchmark('export report cards', grades=self.STUDENTS * self.SUBJECTS * self.DAYS,
+                         seconds=elapsed, megabytes=size / 2 ** 20, rss_growth_mb=peak - baseline)
+        self.assertEqual(rows, self.STUDENTS + 2)
+        self.assertLess(peak - baseline, self.RSS_CEILING_MB)
+
+
+@fast_accounts
+class SyntheticSchoolTests(TestCase):
+    SIZE = {'classes': 2, 'students_per_class': 3, 'subjects': 2, 'teachers': 1, 'parents': 4, 'weeks': 2}
+
+    def setUp(self):
+        calendar_service.invalidate()
+        self.addCleanup(calendar_service.invalidate)
+
+    def test_creates_school_with_working_accounts(self):
+        counts = SyntheticSchool(**self.SIZE, start=date(2025, 12, 29)).run()
+
+        self.assertEqual(counts, {'classes': 2, 'subjects': 2, 'teachers': 1, 'students': 6, 'parents': 4,
+                                  'grades': 6 * 2 * 2})
+
+        student = Student.objects.select_related('user').first()
+        self.assertEqual(PortalCredential.authenticate(student.student_id, '000000').user, student.user)
+        self.assertTrue(student.user.check_password('000000'))
+        self.assertEqual(Parent.objects.filter(students__isnull=False).distinct().count(), 4)
+        self.assertEqual(set(Teacher.objects.get().classes.all()), set(SchoolClass.objects.all()))
+
+        # Праздники 1.01, 2.01 и 7.01 пропускаются
+        dates = set(Grade.objects.values_list('date', flat=True))
+        self.assertTrue(all(calendar_service.is_school_day(day) for day in dates))
+        self.assertFalse(dates & {date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 7)})
+        self.assertEqual(sum(aggregate.count for aggregate in GradeAggregate.objects.all()), 24)
+
+    def test_query_count_does_not_grow_with_size(self):
+        with CaptureQueriesContext(connection) as small:
+            SyntheticSchool(**self.SIZE).run()
+        with CaptureQueriesContext(connection) as large:
+            SyntheticSchool(**{key: value * 3 for key, value in self.SIZE.items()}).run()
+
+        self.assertLessEqual(len(large.captured_queries), len(small.captured_queries))
+
+    def test_same_seed_same_grades(self):
+        SyntheticSchool(**self.SIZE).run()
+        students, subjects = list(Student.objects.all()), list(Subject.objects.all())
+
+        def grades(seed):
+            school = SyntheticSchool(**self.SIZE, seed=seed)
+            return [(grade.grade, grade.date) for grade in school.generate_grades(students, subjects)]
+
+        self.assertEqual(grades(7), grades(7))
+        self.assertNotEqual(grades(7), grades(8))
+
+    def test_command_refuses_non_empty_database(self):
+        SchoolClass.objects.create(number_class=5, letter_class='А')
+        with self.assertRaises(CommandError):
+            call_command('seed_school', '--size', 'small', stdout=StringIO())
+
+
+@fast_accounts
+class BenchmarkSuiteTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        calendar_service.invalidate()
+        self.addCleanup(calendar_service.invalidate)
+        SyntheticSchool(classes=2, students_per_class=3, subjects=2, teachers=2, parents=3, weeks=3).run()
+
+    def test_runs_every_scenario(self):
+        grades = Grade.objects.count()
+        results = BenchmarkSuite(repeat=2).run(connection)
+
+        self.assertEqual(set(results), {
+            'user_login', 'teacher_dashboard', 'add_grade_form', 'add_grade', 'grade_sheet',
+            'student_dashboard', 'parent_dashboard', 'student_grades_view', 'student_dashboard_api',
+            'parent_dashboard_api', 'admin_teacher_changelist', 'admin_student_changelist',
+            'admin_parent_changelist', 'admin_subject_changelist', 'admin_schoolclass_changelist',
+        })
+        self.assertTrue(all(metrics['queries'] > 0 and metrics['peak_kb'] > 0 for metrics in results.values()))
+        # Два замера и прогон под tracemalloc
+        self.assertEqual(Grade.objects.count(), grades + 3)
+
+    def test_compare_with_baseline(self):
+        base = {'small': {'scenarios': {'home': {'median_ms': 10, 'queries': 3, 'peak_kb': 100}}}}
+        same = {'small': {'scenarios': {'home': {'median_ms': 11, 'queries': 3, 'peak_kb': 120}}}}
+        worse = {'small': {'scenarios': {'home': {'median_ms': 20, 'queries': 4, 'peak_kb': 100}}}}
+
+        self.assertEqual(compare(same, base), [])
+        self.assertEqual(compare(worse, base), [('small', 'home', 'queries', 3, 4),
+                                                ('small', 'home', 'median_ms', 10, 20)])
+        self.assertEqual(compare(worse, {}), [])
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class EndToEndBenchmark(TestCase):
+
+    def test_small_school(self):
+        result = run_size('small', connection)
+        report_benchmark('synthetic school small', **result['dataset'])
+        for name, metrics in result['scenarios'].items():
+            report_benchmark(name, **metrics)
+
+
+@fast_accounts
+class AsyncDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+        self.math = Subject.objects.create(name='Математика')
+        self.children = [make_student(self.school_class, last_name=f'Ученик {i}') for i in range(3)]
+        self.parent = make_parent(self.children)
+        for i, child in enumerate(self.children):
+            Grade.objects.create(student=child, subject=self.math, grade=i + 5, date=date(2025, 10, 1))
+
+    def get(self, client, user, url):
+        """Запрос тестовым клиентом (AsyncClient идет через асинхронный обработчик); ответ и число SQL."""
+        cache.clear()
+        client.force_login(user)
+        request = async_to_sync(client.get) if client is self.async_client else client.get
+        with CaptureQueriesContext(connection) as ctx:
+            response = request(url)
+        return response, len(ctx.captured_queries)
+
+    def test_parent_dashboard(self):
+        url = reverse('parent_dashboard')
+        response, queries = self.get(self.async_client, self.parent.user, url)
+
+        self.assertEqual(response.status_code, 200)
+        children_with_grades = response.context['children_with_grades']
+        self.assertEqual([data['subjects_data'][0]['average'] for data in children_with_grades], [5, 6, 7])
+        self.assertContains(response, 'Ученик 2')
+        # Тот же набор запросов, что и под синхронным обработчиком
+        self.assertEqual(queries, self.get(self.client, self.parent.user, url)[1])
+
+    def test_student_pages(self):
+        student = self.children[0]
+        response, _ = self.get(self.async_client, student.user, reverse('student_dashboard'))
+        self.assertEqual(response.context['total_grades_count'], 1)
+
+        url = reverse('student_grades_view', args=[student.id])
+        response, _ = self.get(self.async_client, student.user, f'{url}?date_to=2025-09-30')
+        self.assertEqual(response.context['total_grades_count'], 0)
+
+        response, _ = self.get(self.async_client, student.user, reverse('student_grades_view', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_wrong_role_redirects_home(self):
+        response, _ = self.get(self.async_client, self.parent.user, reverse('student_dashboard'))
+        self.assertRedirects(response, reverse('home'), fetch_redirect_response=False)
+
+
+@fast_accounts
+class ServerComparisonTests(TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        calendar_service.invalidate()
+        self.addCleanup(calendar_service.invalidate)
+
+    def test_dashboards_served_by_wsgi_and_asgi(self):
+        SyntheticSchool(classes=1, students_per_class=2, subjects=2, teachers=1, parents=2, weeks=2).run()
+
+        results = compare_servers(clients=2, per_client=3, wsgi_threads=1)
+
+        for server in ('wsgi', 'asgi'):
+            self.assertEqual(results[server]['requests'], 6)
+            self.assertEqual(results[server]['errors'], 0)
+
+
+@skipUnless(RUN_BENCHMARKS, 'задайте SCHOOL_BENCHMARK=1 для запуска бенчмарков')
+@fast_accounts
+class ServerConcurrencyBenchmark(TransactionTestCase):
+    databases = '__all__'
+    CLIENTS = 200
+
+    def test_wsgi_vs_asgi(self):
+        calendar_service.invalidate()
+        SyntheticSchool(**SIZES['small']).run()
+        for server, metrics in compare_servers(clients=self.CLIENTS, per_client=3).items():
+            report_benchmark(f'{server} {self.CLIENTS} clients', **metrics)
+
+
+@fast_accounts
+@override_settings(DB_ROUTING={**settings.DB_ROUTING, 'REPLICA_ALIAS': 'missing'})
+class NoReplicaRoutingTests(TestCase):
+
+    def test_everything_uses_default(self):
+        student = make_student(SchoolClass.objects.create(number_class=5, letter_class='А'))
+        get_login_throttle.cache_clear()
+
+        response = self.client.post(reverse('login'), {'user_id': student.student_id, 'password': student.password})
+
+        self.assertNotIn('db_primary', response.cookies)
+        self.assertEqual(read_alias(), 'default')
+        with replica_reads():
+            self.assertEqual(PrimaryReplicaRouter().db_for_read(Grade), 'default')
+
+
+@skipUnless(replica_alias(), 'добавьте реплику в DATABASES (POSTGRES_REPLICA_HOST) для проверки маршрутизации')
+@fast_accounts
+class ReplicaRoutingTests(TransactionTestCase):
+    # Реплика в тестах - зеркало default (TEST MIRROR): отдельное соединение к той же базе
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        calendar_service.invalidate()
+        self.addCleanup(calendar_service.invalidate)
+        get_login_throttle.cache_clear()
+        self.math = Subject.objects.create(name='Математика')
+        self.student = make_student(SchoolClass.objects.create(number_class=5, letter_class='А'))
+        Grade.objects.create(student=self.student, subject=self.math, grade=8, date=date(2025, 10, 1))
+
+    def grade_reads(self, request):
+        """Ответ и число запросов к таблицам оценок в основной БД и в реплике."""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[replica_alias()]) as replica:
+            response = request()
+        return response, *[
+            sum('school_app_grade' in query['sql'] for query in ctx.captured_queries) for ctx in (primary, replica)
+        ]
+
+    def test_dashboards_read_replica(self):
+        for client in (self.client, self.async_client):
+            cache.clear()
+            client.force_login(self.student.user)
+            request = async_to_sync(client.get) if client is self.async_client else client.get
+            response, primary, replica = self.grade_reads(lambda: request(reverse('student_dashboard')))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(primary, 0)
+            self.assertGreater(replica, 0)
+
+    def test_client_reads_primary_after_write(self):
+        response = self.client.post(reverse('login'), {
+            'user_id': self.student.student_id, 'password': self.student.password,
+        })
+        self.assertIn('db_primary', response.cookies)
+
+        response, primary, replica = self.grade_reads(lambda: self.client.get(reverse('student_dashboard')))
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_dashboard_reset_by_new_grade_rebuilt_from_primary(self):
+        self.client.force_login(self.student.user)
+        self.client.get(reverse('student_dashboard'))
+
+        # Сигнал Grade сбрасывает дневник после коммита и помечает его "собрать по основной БД"
+        Grade.objects.create(student=self.student, subject=self.math, grade=6, date=date(2025, 10, 2))
+        response, primary, replica = self.grade_reads(lambda: self.client.get(reverse('student_dashboard')))
+        self.assertEqual(response.context['total_grades_count'], 2)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        # Метка истекла - следующая сборка снова идет с реплики
+        cache.delete_many([student_key(self.student.id), primary_key(student_key(self.student.id))])
+        _, primary, replica = self.grade_reads(lambda: self.client.get(reverse('student_dashboard')))
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_reports_read_replica_outside_transactions(self):
+        self.assertEqual(ReportCardExport().using, replica_alias())
+        self.assertEqual(len(list(ReportCardExport().rows())), 2)
+
+        with transaction.atomic():
+            self.assertEqual(ReportCardExport().using, 'default')
+            with replica_reads():
+                self.assertEqual(PrimaryReplicaRouter().db_for_read(Grade), 'default')
+        self.assertEqual(PrimaryReplicaRouter().db_for_write(Grade), 'default')
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS, PORTAL_DEFERRED_HASHING=True, PORTAL_HASH_WORKERS=0)
+class DeferredHashingTests(TestCase):
+
+    def setUp(self):
+        get_login_throttle.cache_clear()
+        self.school_class = SchoolClass.objects.create(number_class=5, letter_class='А')
+
+    def login(self, student):
+        return self.client.post(reverse('login'), {'user_id': student.student_id, 'password': student.password})
+
+    def test_pending_account_cannot_log_in(self):
+        student = make_student(self.school_class)
+
+        self.assertFalse(student.user.has_usable_password())
+        response = self.login(student)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_hash_written_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            student = make_student(self.school_class)
+
+        student.user.refresh_from_db()
+        self.assertTrue(student.user.check_password(student.password))
+        self.assertRedirects(self.login(student), reverse('student_dashboard'), fetch_redirect_response=False)
+
+    def test_lost_jobs_recovered_by_command(self):
+        student = make_student(self.school_class)
+        call_command('hash_pending_passwords', stdout=StringIO())
+
+        student.user.refresh_from_db()
+        self.assertTrue(student.user.check_password(student.password))
@@ -0,0 +1,117 @@
+"""
+Ограничение частоты попыток входа (token bucket).
+
+Для каждого ID портала и каждого IP-адреса заводится "ведро" на capacity
+попыток, которое равномерно наполняется заново за refill_seconds секунд.
+Попытка, для которой в ведре нет жетона, отклоняется до обращения к БД.
+
+По умолчанию состояние хранится в памяти процесса (LRU). Если воркеров
+несколько, подключите CacheBucketBackend - он считает попытки в кеше Django
+(Redis, Memcached и т.п.), общем для всех процессов. Общий кеш не умеет
+атомарно пересчитать ведро, поэтому там вместо ведра - счетчик попыток за
+окно в refill_seconds на атомарных add/incr: за окно проходит не больше
+capacity попыток, но на стыке двух окон - до 2 * capacity подряд.
+"""
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+DEFAULTS = {
+    'BACKEND': 'school_app.throttling.MemoryBucketBackend',
+    'OPTIONS': {},
+    'PER_ID': {'capacity': 5, 'refill_seconds': 60},
+    'PER_IP': {'capacity': 30, 'refill_seconds': 60},
+}
+
+
+def take_token(state, capacity, refill_seconds, now):
+    """Пересчитывает ведро на момент now; возвращает (разрешено, новое состояние)."""
+    if state is None:
+        tokens, updated = float(capacity), now
+    else:
+        tokens, updated = state
+        tokens = min(float(capacity), tokens + (now - updated) * capacity / refill_seconds)
+
+    if tokens < 1:
+        return False, (tokens, now)
+    return True, (tokens - 1, now)
+
+
+class MemoryBucketBackend:
+    """Ведра в памяти процесса; самые давние вытесняются после max_entries."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, refill_seconds, now):
+        with self._lock:
+            allowed, state = take_token(self._buckets.get(key), capacity, refill_seconds, now)
+            self._buckets[key] = state
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+            return allowed
+
+
+class CacheBucketBackend:
+    """Счетчики попыток по окнам в кеше Django - общие для всех воркеров."""
+
+    def __init__(self, alias='default', key_prefix='login-throttle'):
+        self.cache = caches[alias]
+        self.key_prefix = key_prefix
+
+    def consume(self, key, capacity, refill_seconds, now):
+        window = int(now // refill_seconds)
+        cache_key = f'{self.key_prefix}:{key}:{window}'
+        # add и incr атомарны: параллельные попытки с разных воркеров
+        # не могут прочитать один и тот же остаток и пройти все сразу
+        if self.cache.add(cache_key, 1, timeout=int(refill_seconds) + 1):
+            return capacity >= 1
+        try:
+            attempts = self.cache.incr(cache_key)
+        except ValueError:
+            # Счетчик вытеснен из кеша - окно считается заново
+            return self.cache.add(cache_key, 1, timeout=int(refill_seconds) + 1) and capacity >= 1
+        return attempts <= capacity
+
+
+class LoginThrottle:
+
+    def __init__(self, backend, per_id, per_ip, clock=time.time):
+        self.backend = backend
+        self.per_id = per_id
+        self.per_ip = per_ip
+        self.clock = clock
+
+    def allow(self, portal_id, ip):
+        now = self.clock()
+        if ip and not self.backend.consume(f'ip:{ip}', now=now, **self.per_ip):
+            return False
+        return self.backend.consume(f'id:{portal_id}', now=now, **self.per_id)
+
+
+@lru_cache(maxsize=None)
+def get_login_throttle():
+    config = {**DEFAULTS, **getattr(settings, 'LOGIN_THROTTLE', {})}
+    backend = import_string(config['BACKEND'])(**config['OPTIONS'])
+    return LoginThrottle(backend, config['PER_ID'], config['PER_IP'])
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR')
+
+
+@receiver(setting_changed)
+def reset_login_throttle(setting, **kwargs):
+    if setting == 'LOGIN_THROTTLE':
+        get_login_throttle.cache_clear()
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, metrics, views
 
 
 urlpatterns = [
@@ -8,7 +8,14 @@ urlpatterns = [
     path('logout/', views.user_logout, name='logout'),
     path('teacher/dashboard/', views.teacher_dashboard, name='teacher_dashboard'),
     path('teacher/add-grade/', views.add_grade, name='add_grade'),
+    path('teacher/grade-sheet/', views.grade_sheet, name='grade_sheet'),
     path('student/dashboard/', views.student_dashboard, name='student_dashboard'),
     path('parent/dashboard/', views.parent_dashboard, name='parent_dashboard'),
-    path('grades/student/<int:student_id>/', views.student_grades_view, name='student_grades_view')
+    path('grades/student/<int:student_id>/', views.student_grades_view, name='student_grades_view'),
+    path('api/student/dashboard/', api.student_dashboard_api, name='student_dashboard_api'),
+    path('api/parent/dashboard/', api.parent_dashboard_api, name='parent_dashboard_api'),
+    path('api/grades/student/<int:student_id>/', api.student_grades_api, name='student_grades_api'),
+    path('stats/dashboard-cache/', views.dashboard_cache_stats_view, name='dashboard_cache_stats'),
+    path('metrics', metrics.metrics_view, name='metrics'),
+    path('metrics/slow/', metrics.slow_requests_view, name='slow_requests'),
 ]
\ No newline at end of file
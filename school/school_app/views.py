@@ -1,12 +1,37 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, aget_object_or_404
+from django.http import JsonResponse
 from django.contrib.auth import login, logout
 from django.contrib import messages
-from .models import Teacher, Student, Subject, Grade, Parent
-from .forms import LoginForm
+from .models import Student, Subject, Grade, GradeAggregate, PortalCredential
+from .analytics import class_subject_stats
+from .dashboard_cache import aget_or_build, dashboard_cache_stats, get_or_build, parent_key, student_key
+from .forms import GradeHistoryForm, LoginForm
+from .grade_history import astudent_history, average_class, grade_badges, student_history
+from .grading import GradeSheetError, GradeSheetForbidden, non_working_day_error, save_grade_sheet
+from .grants import FORBIDDEN, NOT_TAUGHT, get_grants
+from .portal import arole_profile, role_profile
+from .queries import agrade_rows, children_grades, grade_rows
+from .throttling import client_ip, get_login_throttle
+import asyncio
+import json
 from datetime import date, datetime
 from collections import defaultdict
+from asgiref.sync import sync_to_async
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import IntegrityError, transaction
+
+
+# Асинхронные представления рендерят шаблоны в потоке: контекстные процессоры
+# и шаблоны обращаются к БД синхронно
+arender = sync_to_async(render)
+
+
+ROLE_DASHBOARDS = {
+    PortalCredential.TEACHER: 'teacher_dashboard',
+    PortalCredential.STUDENT: 'student_dashboard',
+    PortalCredential.PARENT: 'parent_dashboard',
+}
 
 
 def home(request):
@@ -20,34 +45,20 @@ def user_login(request):
             user_id = form.cleaned_data['user_id']
             password = form.cleaned_data['password']
 
-            try:
-                teacher = Teacher.objects.get(teacher_id=user_id, password=password)
-                user = teacher.user
-                login(request, user)
-                messages.success(request, f'Добро пожаловать, {user.get_full_name()}!')
-                return redirect('teacher_dashboard')
-            except Teacher.DoesNotExist:
-                pass
+            if not get_login_throttle().allow(user_id, client_ip(request)):
+                messages.error(request, 'Слишком много попыток входа. Попробуйте позже.')
+                return render(request, 'login.html', {'form': form}, status=429)
 
-            try:
-                student = Student.objects.get(student_id=user_id, password=password)
-                user = student.user
+            credential = PortalCredential.authenticate(user_id, password)
+            if credential is not None and credential.is_pending:
+                messages.error(request, 'Учетная запись еще активируется. Попробуйте войти через минуту.')
+            elif credential is not None:
+                user = credential.user
                 login(request, user)
                 messages.success(request, f'Добро пожаловать, {user.get_full_name()}!')
-                return redirect('student_dashboard')
-            except Student.DoesNotExist:
-                pass
-
-            try:
-                parent = Parent.objects.get(parent_id=user_id, password=password)
-                user = parent.user
-                login(request, user)
-                messages.success(request, f'Добро пожаловать, {user.get_full_name()}!')
-                return redirect('parent_dashboard')
-            except Parent.DoesNotExist:
-                pass
-
-            messages.error(request, 'Неверный ID или пароль')
+                return redirect(ROLE_DASHBOARDS[credential.role])
+            else:
+                messages.error(request, 'Неверный ID или пароль')
 
     else:
         form = LoginForm()
@@ -63,27 +74,46 @@ def user_logout(request):
 
 @login_required
 def teacher_dashboard(request):
-    try:
-        teacher = request.user.teacher_profile
-    except Teacher.DoesNotExist:
+    teacher = role_profile(request, PortalCredential.TEACHER)
+    if teacher is None:
         return redirect('home')
 
-    subjects = teacher.subjects.all()
-    classes = teacher.classes.all()
+    subjects = list(teacher.subjects.all())
+    classes = list(teacher.classes.all())
+
+    # Пары (класс, предмет) для аналитики - те, где учитель может ставить оценки
+    classes_by_id = {school_class.id: school_class for school_class in classes}
+    subjects_by_id = {subject.id: subject for subject in subjects}
+    analytics_pairs = sorted(
+        ((classes_by_id[class_id], subjects_by_id[subject_id])
+         for class_id, subject_id in get_grants(teacher.id).pairs
+         if class_id in classes_by_id and subject_id in subjects_by_id),
+        key=lambda pair: (pair[0].number_class, pair[0].letter_class, pair[1].name)
+    )
+
+    selected = None
+    analytics = None
+    if analytics_pairs:
+        requested = (request.GET.get('class'), request.GET.get('subject'))
+        selected = next((pair for pair in analytics_pairs
+                         if (str(pair[0].id), str(pair[1].id)) == requested), analytics_pairs[0])
+        analytics = class_subject_stats(selected[0].id, selected[1].id)
 
     context = {
         'teacher': teacher,
         'subjects': subjects,
         'classes': classes,
+        'analytics_pairs': analytics_pairs,
+        'selected_pair': selected,
+        'analytics': analytics,
     }
     return render(request, 'teacher_dashboard.html', context)
 
 
 @login_required
 def add_grade(request):
-    try:
-        teacher = request.user.teacher_profile
-    except Teacher.DoesNotExist:
+    teacher = role_profile(request, PortalCredential.TEACHER)
+    if teacher is None:
         return redirect('home')
 
     students_in_classes = Student.objects.filter(
@@ -102,7 +132,7 @@ def add_grade(request):
         date_str = request.POST.get('date')
 
         try:
-            student = Student.objects.get(id=student_id)
+            student = Student.objects.select_related('user', 'class_field').get(id=student_id)
             subject = Subject.objects.get(id=subject_id)
             grade_int = int(grade_value)
 
@@ -111,61 +141,38 @@ def add_grade(request):
 
                 return redirect('add_grade')
 
-            if not (subject in teacher.subjects.all() and
-                    student.class_field in teacher.classes.all()):
+            denial = get_grants(teacher.id).check(student.class_field_id, subject.id)
+            if denial == FORBIDDEN:
                 messages.error(request, '❌ Нет прав')
 
                 return redirect('add_grade')
 
-            if not subject.classes.filter(id=student.class_field.id).exists():
+            if denial == NOT_TAUGHT:
                 messages.error(request,
                                f'❌ Предмет "{subject.name}" не преподается в классе {student.class_field.name_class}')
                 return redirect('add_grade')
 
-            existing_grade = Grade.objects.filter(
-                student=student,
-                subject=subject,
-                date=date_str,
-            ).exists()
-
             grade_date = datetime.strptime(date_str, '%Y-%m-%d').date()
 
-            day_of_week = grade_date.weekday()
-
-            if day_of_week == 5 or day_of_week == 6:
-                messages.error(request,
-                               f'❌ Нельзя поставить оценку ({grade_date.strftime("%d.%m.%Y")}) - это выходной день'
-                               )
-                return redirect('add_grade')
-
-            holidays_2025_2026 = [
-                date(2025, 11, 7),
-                date(2025, 12, 25),
-                date(2026, 1, 1),
-                date(2026, 1, 2),
-                date(2026, 1, 7),
-                date(2026, 3, 8),
-                date(2026, 5, 1),
-                date(2026, 5, 9),
-            ]
-
-            if grade_date in holidays_2025_2026:
-                messages.error(request,
-                               f'❌ Нельзя поставить оценку ({grade_date.strftime("%d.%m.%Y")}) - праздничный день'
-                               )
+            day_error = non_working_day_error(grade_date)
+            if day_error:
+                messages.error(request, day_error)
                 return redirect('add_grade')
 
-            if existing_grade:
+            # Дубликаты отсекает уникальное ограничение (ученик, предмет, дата)
+            try:
+                with transaction.atomic():
+                    Grade.objects.create(
+                        student=student,
+                        subject=subject,
+                        grade=grade_int,
+                        date=grade_date
+                    )
+            except IntegrityError:
                 messages.error(request, f'❌ У этого ученика уже есть оценка по предмету "{subject.name}" на {date_str}.'
                                         f'Используйте другую дату.')
                 return redirect('add_grade')
 
-            Grade.objects.create(
-                student=student,
-                subject=subject,
-                grade=grade_value,
-                date=date_str
-            )
             messages.success(request,
                              f'✅ Оценка {grade_value} по предмету "{subject.name}" успешно добавлена ученику {student.user.last_name} {student.user.first_name}'
                              )
@@ -190,79 +197,233 @@ def add_grade(request):
     return render(request, 'add_grade.html', context)
 
 
-@login_required
-def student_dashboard(request):
+def parse_id(value):
+    """id из параметра запроса; пустое или нечисловое значение - None."""
     try:
-        student = request.user.student_profile
-    except Student.DoesNotExist:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@login_required
+def grade_sheet(request):
+    teacher = role_profile(request, PortalCredential.TEACHER)
+    if teacher is None:
         return redirect('home')
 
-    grades = Grade.objects.filter(student=student).order_by('-date')
+    if request.content_type == 'application/json':
+        return grade_sheet_api(request, teacher)
 
-    subjects_dict = defaultdict(list)
+    source = request.POST if request.method == 'POST' else request.GET
+    class_id = parse_id(source.get('class'))
+    subject_id = parse_id(source.get('subject'))
+    date_str = source.get('date') or date.today().strftime('%Y-%m-%d')
 
-    for grade in grades:
-        subjects_dict[grade.subject].append(grade)
+    students = []
+    row_errors = {}
+    submitted = {}
 
-    subjects_grades_data = []
-    total_grades_count = 0
-    all_grades_sum = 0
-    grade_stats = {i: 0 for i in range(1, 11)}
+    if class_id and subject_id:
+        students = Student.objects.filter(
+            class_field_id=class_id,
+            class_field__in=teacher.classes.all()
+        ).select_related('user').order_by('user__last_name', 'user__first_name')
 
-    for subject, subject_grades in subjects_dict.items():
-        subject_grades_count = len(subject_grades)
-        subject_grades_sum = sum(grade.grade for grade in subject_grades)
-        subject_average = subject_grades_sum / subject_grades_count if subject_grades_count > 0 else 0
+    if request.method == 'POST':
+        submitted = {
+            key[len('grade_'):]: value
+            for key, value in request.POST.items()
+            if key.startswith('grade_')
+        }
 
-        for grade in subject_grades:
-            if 1 <= grade.grade <= 10:
-                grade_stats[grade.grade] = grade_stats.get(grade.grade, 0) + 1
+        try:
+            grade_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+            created, row_errors = save_grade_sheet(teacher, class_id, subject_id, grade_date, submitted)
+        except ValueError:
+            messages.error(request, '❌ Неверные данные ведомости')
+        except GradeSheetError as e:
+            messages.error(request, str(e))
+        except IntegrityError:
+            messages.error(request, '❌ Часть оценок уже была добавлена. Обновите ведомость.')
+        else:
+            if row_errors:
+                messages.error(request, f'❌ Ведомость не сохранена: ошибок - {len(row_errors)}')
+            elif created:
+                messages.success(request, f'✅ Добавлено оценок: {len(created)}')
+                return redirect(f"{request.path}?class={class_id}&subject={subject_id}&date={date_str}")
+            else:
+                messages.error(request, '❌ Не выставлено ни одной оценки')
+
+    rows = [
+        {
+            'student': student,
+            'value': submitted.get(str(student.id), ''),
+            'error': row_errors.get(str(student.id)),
+        }
+        for student in students
+    ]
+
+    context = {
+        'teacher': teacher,
+        'classes': teacher.classes.all(),
+        'subjects': teacher.subjects.all(),
+        'class_id': class_id,
+        'subject_id': subject_id,
+        'date': date_str,
+        'rows': rows,
+        'grade_choices': range(10, 0, -1),
+    }
+    return render(request, 'grade_sheet.html', context)
 
-        subjects_grades_data.append({
-            'subject': subject,
-            'grades': subject_grades,
-            'average': subject_average,
-            'count': subject_grades_count
-        })
 
-        total_grades_count += subject_grades_count
-        all_grades_sum += subject_grades_sum
+def grade_sheet_api(request, teacher):
+    """
+    JSON-вариант ведомости:
+    {"class": 1, "subject": 2, "date": "2025-10-06", "grades": {"<id ученика>": 8, ...}}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Метод не поддерживается'}, status=405)
+
+    try:
+        payload = json.loads(request.body)
+        grade_date = datetime.strptime(payload['date'], '%Y-%m-%d').date()
+        created, row_errors = save_grade_sheet(
+            teacher, payload['class'], payload['subject'], grade_date, payload['grades']
+        )
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Неверный формат ведомости'}, status=400)
+    except GradeSheetForbidden as e:
+        return JsonResponse({'error': str(e)}, status=403)
+    except GradeSheetError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except IntegrityError:
+        return JsonResponse({'error': 'Часть оценок уже была добавлена'}, status=409)
+
+    if row_errors:
+        return JsonResponse({'created': 0, 'errors': row_errors}, status=400)
+    return JsonResponse({'created': len(created), 'errors': {}}, status=201)
+
+
+def student_dashboard_history(student, form):
+    if form.is_bound:
+        date_from, date_to = form.period()
+        return student_history(student, date_from, date_to, form.cursor())
+    # Первая страница без фильтра - самая частая, она и кешируется
+    return get_or_build(student_key(student.id), lambda: student_history(student))
+
+
+async def astudent_dashboard_history(student, form):
+    if form.is_bound:
+        # Проверка формы читает учебные годы из БД
+        await sync_to_async(form.is_valid)()
+        date_from, date_to = form.period()
+        return await astudent_history(student, date_from, date_to, form.cursor())
+    return await aget_or_build(student_key(student.id), lambda: astudent_history(student))
+
+
+async def arequest_user(request):
+    """Пользователь запроса в асинхронном представлении.
+
+    request.user заменяется тем же объектом, чтобы шаблоны не загружали
+    пользователя заново.
+    """
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+@login_required
+async def student_dashboard(request):
+    student = await arole_profile(request, PortalCredential.STUDENT)
+    if student is None:
+        return redirect('home')
+    await arequest_user(request)
 
-    average_grade = all_grades_sum / total_grades_count if total_grades_count > 0 else 0
+    form = GradeHistoryForm(request.GET or None)
+    data = await astudent_dashboard_history(student, form)
 
     context = {
         'student': student,
-        'subjects_grades_data': subjects_grades_data,
-        'total_grades_count': total_grades_count,
-        'average_grade': average_grade,
-        'grade_stats': grade_stats,
+        'form': form,
+        **history_page_urls(request, form, data['next_cursor']),
+        **data,
     }
-    return render(request, 'student_dashboard.html', context)
+    return await arender(request, 'student_dashboard.html', context)
 
 
-@login_required
-def parent_dashboard(request):
-    try:
-        parent = request.user.parent_profile
-    except Parent.DoesNotExist:
-        return redirect('home')
+def history_page_urls(request, form, next_cursor):
+    """Ссылки на первую (если открыта не она) и следующую страницы истории с тем же фильтром."""
+    def page_url(cursor):
+        params = request.GET.copy()
+        params.pop('after', None)
+        if cursor:
+            params['after'] = cursor
+        return f'{request.path}?{params.urlencode()}'
+
+    return {
+        'first_page_url': page_url(None) if form.cursor() else None,
+        'next_page_url': page_url(next_cursor) if next_cursor else None,
+    }
+
+
+def parent_dashboard_querysets(parent):
+    """Дети, их оценки и сводки - три независимых запроса (оценки и сводки - с подзапросом детей)."""
+    children = parent.students.all()
+    return (
+        children.select_related('user', 'class_field'),
+        children_grades(children),
+        GradeAggregate.objects.filter(student__in=children),
+    )
+
 
-    children = parent.students.all().select_related('user', 'class_field')
+def build_parent_dashboard(parent):
+    """Данные дневника родителя по всем детям (кешируются, см. dashboard_cache)."""
+    children, all_grades, aggregates = parent_dashboard_querysets(parent)
+    return group_parent_dashboard(list(children), grade_rows(all_grades), aggregates)
+
+
+async def abuild_parent_dashboard(parent):
+    children, all_grades, aggregates = parent_dashboard_querysets(parent)
+    children, all_grades, aggregates = await asyncio.gather(
+        alist(children), agrade_rows(all_grades), alist(aggregates)
+    )
+    return group_parent_dashboard(children, all_grades, aggregates)
+
+
+async def alist(queryset):
+    return [obj async for obj in queryset]
+
+
+def group_parent_dashboard(children, all_grades, aggregates):
+    # Все оценки всех детей одним запросом, группировка - в памяти
+    grades_by_child = defaultdict(list)
+    for grade in all_grades:
+        grades_by_child[grade.student_id].append(grade)
+
+    averages = {
+        (aggregate.student_id, aggregate.subject_id): aggregate.average
+        for aggregate in aggregates
+    }
 
     children_with_grades = []
     for child in children:
-        grades = Grade.objects.filter(student=child).select_related('subject').order_by('-date')
+        grades = grades_by_child.get(child.id, [])
 
+        grades_by_subject = defaultdict(list)
+        for grade in grades:
+            grades_by_subject[grade.subject].append(grade)
+
+        # Предметы по названию, оценки - от старых к новым: шаблону остается только вывести
         subjects_data = []
-        for subject in Subject.objects.all():
-            subject_grades = grades.filter(subject=subject)
-            if subject_grades.exists():
-                avg = subject_grades.aggregate(avg=Avg('grade'))['avg']
-                subjects_data.append({
-                    'subject': subject,
-                    'grades': list(subject_grades),
-                    'average': round(avg, 2) if avg else 0
-                })
+        for subject in sorted(grades_by_subject, key=lambda s: s.name):
+            average = round(averages.get((child.id, subject.id), 0), 2)
+            subjects_data.append({
+                'subject': subject,
+                'grades': grades_by_subject[subject],
+                'badges': grade_badges(reversed(grades_by_subject[subject])),
+                'average': average,
+                'average_class': average_class(average),
+            })
 
         children_with_grades.append({
             'child': child,
@@ -270,44 +431,51 @@ def parent_dashboard(request):
             'subjects_data': subjects_data
         })
 
-    context = {
-        'parent': parent,
+    return {
         'children': children,
         'children_with_grades': children_with_grades,
     }
-    return render(request, 'parent_dashboard.html', context)
 
 
 @login_required
-def student_grades_view(request, student_id):
-    student = get_object_or_404(Student, id=student_id)
-    grades = Grade.objects.filter(student=student).select_related('subject')
+async def parent_dashboard(request):
+    parent = await arole_profile(request, PortalCredential.PARENT)
+    if parent is None:
+        return redirect('home')
+    await arequest_user(request)
+
+    data = await aget_or_build(parent_key(parent.id), lambda: abuild_parent_dashboard(parent))
 
-    subjects_grades = {}
-    total_grades_count = 0
-    total_grades_sum = 0
+    context = {'parent': parent, **data}
+    return await arender(request, 'parent_dashboard.html', context)
 
-    for grade in grades:
-        if grade.subject not in subjects_grades:
-            subjects_grades[grade.subject] = []
-        subjects_grades[grade.subject].append(grade)
-        total_grades_count += 1
-        total_grades_sum += grade.grade
 
-    subject_averages = {}
-    for subject, grade_list in subjects_grades.items():
-        subject_sum = sum(grade.grade for grade in grade_list)
-        subject_averages[subject.id] = round(subject_sum / len(grade_list), 2)
+@login_required
+async def student_grades_view(request, student_id):
+    await arequest_user(request)
+    student = await aget_object_or_404(Student.objects.select_related('user', 'class_field'), id=student_id)
+
+    form = GradeHistoryForm(request.GET or None)
+    if form.is_bound:
+        await sync_to_async(form.is_valid)()
+    date_from, date_to = form.period()
 
-    average_grade = round(total_grades_sum / total_grades_count, 2) if total_grades_count > 0 else 0
+    history = await astudent_history(student, date_from, date_to, form.cursor())
 
     context = {
         'student': student,
-        'subjects_grades': subjects_grades,
-        'grades': grades,
-        'subject_averages': subject_averages,
-        'average_grade': average_grade,
-        'total_grades_count': total_grades_count,
+        'form': form,
+        **history_page_urls(request, form, history['next_cursor']),
+        **history,
     }
 
-    return render(request, 'student_grades_view.html', context)
+    return await arender(request, 'student_grades_view.html', context)
+
+
+@staff_member_required
+def dashboard_cache_stats_view(request):
+    """Счетчики попаданий/промахов кеша дневников (текущего процесса)."""
+    stats = dashboard_cache_stats()
+    requests_total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / requests_total, 3) if requests_total else None
+    return JsonResponse(stats)